@@ -0,0 +1,180 @@
+from database_cache import DEFAULT_CACHE_SIZE
+from generate import ALL_SHEETS, ALL_BACKENDS, BACKEND_OPENPYXL, check_job, check_options, create_xlsx, filter_charts, load_database
+from parse_config import parse_config, titles_to_ids
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import contextlib
+import csv
+import io
+import os
+import sys
+import time
+import traceback
+
+# Creates the score sheets of many players from one database: the database is read once, the
+# charts of each mix are filtered once for all the configs that filter alike, and the sheets are
+# created in a pool of processes that share both
+
+# Set in each worker process by init_worker
+worker_state = None
+
+# One spreadsheet to create, as listed by a manifest
+# Once it's checked, either error is set or config holds its parsed config
+class Job:
+	def __init__(self, line, configpath, frompath, outpath):
+		self.line = line
+		self.configpath = configpath
+		self.frompath = frompath
+		self.outpath = outpath
+		self.config = None
+		self.error = None
+
+# Returns the jobs listed by a manifest
+#
+# Each line lists the config, the old spreadsheet to copy scores from (which may be left empty) and
+# the spreadsheet to create, separated by commas, with quotes around paths that contain commas
+# Relative paths are relative to the manifest; empty lines and lines starting with # are skipped
+def read_manifest(path):
+	base = os.path.dirname(os.path.abspath(path))
+	def resolve(p):
+		if p == "": return None
+		return os.path.join(base, p)
+
+	jobs = []
+	with open(path, newline="") as f:
+		for (i, fields) in enumerate(csv.reader(f), 1):
+			if not fields or fields[0].strip().startswith("#"): continue
+			fields = [field.strip() for field in fields]
+			if len(fields) != 3:
+				jobs.append(Job(i, None, None, None))
+				jobs[-1].error = "Expected 3 fields (config, from, out), found %d" % len(fields)
+				continue
+			jobs.append(Job(i, resolve(fields[0]), resolve(fields[1]), resolve(fields[2])))
+	return jobs
+
+def init_worker(state):
+	global worker_state
+	worker_state = state
+
+# Creates the spreadsheet of one job, in a worker process or in this one
+# Returns (job, error or None, what it printed, seconds taken); an exception only fails its own job
+def run_job(job):
+	(db, dbpath, cache, sheets, stream, backend, static) = worker_state
+	start = time.time()
+	log = io.StringIO()
+	error = None
+	try:
+		with contextlib.redirect_stdout(log):
+			(mix_to_charts, all_filtered_charts) = filter_charts(db, job.config, cache)
+			create_xlsx(db, dbpath, job.outpath, job.config, job.frompath, mix_to_charts, all_filtered_charts, sheets, stream, 1, backend, static)
+	except Exception as e:
+		error = str(e) or type(e).__name__
+		log.write(traceback.format_exc())
+	return (job, error, log.getvalue(), time.time() - start)
+
+# Prints the outcome of a job
+def report(job, error, log, seconds):
+	if error == None:
+		print("OK     line %d: %s (%.1fs)" % (job.line, job.outpath, seconds))
+		return
+	print("FAILED line %d: %s: %s" % (job.line, job.outpath or "(no output)", error))
+	for line in log.splitlines():
+		print("       %s" % line)
+
+def generate_batch(dbpath, manifestpath, overwrite, cachedir=None, cache_size=DEFAULT_CACHE_SIZE, sheets=ALL_SHEETS, stream=False, workers=1, backend=BACKEND_OPENPYXL, static=False):
+	print("Database Path: %s" % dbpath)
+	print("Manifest Path: %s" % manifestpath)
+	print("Sheets:        %s" % ", ".join(sheets))
+	print("Backend:       %s" % backend)
+	print("")
+
+	if not os.path.isfile(manifestpath):
+		print("ERROR: Manifest does not exist at %s" % manifestpath)
+		return False
+	# The processes run whole jobs, each of which creates its sheets in one process
+	error = check_options(dbpath, cachedir, sheets, stream, 1, backend)
+	if error:
+		print("ERROR: %s" % error)
+		return False
+
+	jobs = read_manifest(manifestpath)
+	outpaths = set()
+	for job in jobs:
+		if job.error: continue
+		job.error = check_job(job.outpath, job.configpath, job.frompath, overwrite, False)
+		if job.error: continue
+		if os.path.abspath(job.outpath) in outpaths:
+			job.error = "Output path %s is already used by another job" % job.outpath
+			continue
+		outpaths.add(os.path.abspath(job.outpath))
+		try:
+			job.config = parse_config(job.configpath)
+		except Exception as e:
+			job.error = "Config file %s: %s" % (job.configpath, e)
+
+	db = None
+	cache = {}
+	if any(job.error == None for job in jobs):
+		db = load_database(dbpath, cachedir, cache_size, sheets)
+		print("Filtering charts...")
+		for job in jobs:
+			if job.error: continue
+			try:
+				job.config.mix_ids = titles_to_ids(job.config.mixes, db.mixes, "mix")
+				job.config.mode_ids = titles_to_ids(job.config.modes, db.modes, "mode")
+				# Fills the cache that the jobs share
+				filter_charts(db, job.config, cache)
+			except Exception as e:
+				job.error = "Config file %s: %s" % (job.configpath, e)
+
+	failed = 0
+	for job in jobs:
+		if job.error:
+			report(job, job.error, "", 0)
+			failed += 1
+
+	valid = [job for job in jobs if job.error == None]
+	state = (db, dbpath, cache, sheets, stream, backend, static)
+	print("Creating %d spreadsheets%s..." % (len(valid), ("", " in %d processes" % workers)[workers > 1]))
+	if workers > 1:
+		with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(state,)) as pool:
+			futures = {pool.submit(run_job, job): job for job in valid}
+			for future in as_completed(futures):
+				try:
+					(job, error, log, seconds) = future.result()
+				except Exception as e:
+					# The worker process itself failed
+					(job, error, log, seconds) = (futures[future], str(e) or type(e).__name__, "", 0)
+				report(job, error, log, seconds)
+				failed += error != None
+	else:
+		init_worker(state)
+		for job in valid:
+			(job, error, log, seconds) = run_job(job)
+			report(job, error, log, seconds)
+			failed += error != None
+
+	print("")
+	print("%d of %d spreadsheets created" % (len(jobs) - failed, len(jobs)))
+	return failed == 0
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Create the XLSX score spreadsheets listed by a manifest from one Pump Out database.")
+	parser.add_argument("db", type=str, help="The path of the Pump Out database")
+	parser.add_argument("manifest", type=str, help="The path of the manifest, which lists a config, an optional old spreadsheet from which to copy scores, and the spreadsheet to create on each line, separated by commas")
+	parser.add_argument("--overwrite", action="store_true", help="Overwrite the output paths that already exist (default: off)")
+	parser.add_argument("--cache", type=str, dest="cachedir", help="The optional path of a directory in which to cache the parsed database between runs")
+	parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE // (1024*1024), help="The maximum total size of the cache directory in MB (default: %d)" % (DEFAULT_CACHE_SIZE // (1024*1024)))
+	parser.add_argument("--sheets", type=str, default=",".join(ALL_SHEETS), help="Comma-separated list of the sheets to create (default: %s)" % ",".join(ALL_SHEETS))
+	parser.add_argument("--stream", action="store_true", help="Write each workbook in write-only mode (default: off)")
+	parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, dest="workers", help="The number of spreadsheets to create in parallel (default: the number of CPUs)")
+	parser.add_argument("--backend", type=str, default=BACKEND_OPENPYXL, choices=ALL_BACKENDS, help="The library that writes the workbooks (default: openpyxl)")
+	parser.add_argument("--static", action="store_true", help="Write the title, cut, mode and difficulty of each chart on the score sheets as values (default: off)")
+	args = parser.parse_args()
+	sheets = [s.strip().lower() for s in args.sheets.split(",") if s.strip() != ""]
+	if args.workers < 1:
+		print("ERROR: The number of jobs must be at least 1")
+		sys.exit(1)
+	ok = generate_batch(args.db, args.manifest, args.overwrite, args.cachedir, args.cache_size * 1024*1024, sheets, args.stream, args.workers, args.backend, args.static)
+	sys.exit((1, 0)[ok])
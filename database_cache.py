@@ -0,0 +1,108 @@
+from parse_pump_out import read_database, PARSER_VERSION, ALL_ATTRIBUTES
+from profiling import NO_PROFILE
+
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+
+CACHE_SUFFIX = ".pickle"
+
+# Default upper bound on the total size of a cache directory, in bytes
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+
+# Returns the key under which the parsed form of the database at dbpath is cached
+#
+# The key covers the contents of the file, the parser version, the loaded attributes and chart
+# filter (see read_database) and the Python version (pickles of the model classes aren't
+# guaranteed to load in a different Python), so a changed dump or parser never matches an old entry
+def cache_key(dbpath, attributes=None, chart_filter=None):
+	if attributes == None:
+		attributes = ALL_ATTRIBUTES
+	h = hashlib.sha256()
+	h.update(("parser=%d;python=%d.%d;" % (PARSER_VERSION, sys.version_info[0], sys.version_info[1])).encode())
+	h.update(("attributes=%s;" % ",".join(sorted(attributes))).encode())
+	if chart_filter != None:
+		h.update(("filter=%r;" % ((sorted(chart_filter.mixes), sorted(chart_filter.modes),
+			chart_filter.diff_min, chart_filter.diff_max, bool(chart_filter.unrated)),)).encode())
+	with open(dbpath, "rb") as f:
+		while True:
+			block = f.read(1 << 20)
+			if not block: break
+			h.update(block)
+	return h.hexdigest()
+
+# Reads the database at dbpath, reusing the copy parsed by a previous run if cachedir holds one
+# for the same dump, parser, attributes and chart filter
+# Returns (db, hit), where hit is True if the database was loaded from the cache
+# Loading the cache entry, parsing the database and storing the entry are stages of profile
+def read_database_cached(dbpath, cachedir, max_size=DEFAULT_CACHE_SIZE, attributes=None, chart_filter=None, profile=NO_PROFILE):
+	os.makedirs(cachedir, exist_ok=True)
+	path = os.path.join(cachedir, cache_key(dbpath, attributes, chart_filter) + CACHE_SUFFIX)
+
+	with profile.stage("load_cache"):
+		db = load_entry(path)
+	if db != None:
+		# Mark the entry as recently used for evict_entries
+		os.utime(path)
+		return (db, True)
+
+	with profile.stage("parse"):
+		db = read_database(dbpath, attributes, chart_filter, profile)
+	with profile.stage("store_cache"):
+		store_entry(path, db)
+		evict_entries(cachedir, max_size, keep=path)
+	return (db, False)
+
+# Returns the Database pickled at path, or None if there is no usable entry there
+def load_entry(path):
+	if not os.path.isfile(path):
+		return None
+	try:
+		with open(path, "rb") as f:
+			return pickle.load(f)
+	except Exception as e:
+		print("WARNING: Discarding unreadable database cache entry %s (%s)" % (path, e))
+		remove_entry(path)
+		return None
+
+# Pickles db to path, replacing the file atomically so that a concurrent or interrupted run
+# never sees a partial entry
+def store_entry(path, db):
+	fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+	try:
+		with os.fdopen(fd, "wb") as f:
+			pickle.dump(db, f, pickle.HIGHEST_PROTOCOL)
+		os.replace(tmppath, path)
+	except:
+		remove_entry(tmppath)
+		raise
+
+def remove_entry(path):
+	try:
+		os.remove(path)
+	except OSError:
+		pass
+
+# Deletes the least recently used entries in cachedir until their total size is at most max_size
+# The entry at keep is never deleted, even if it is larger than max_size on its own
+def evict_entries(cachedir, max_size, keep=None):
+	entries = []
+	for name in os.listdir(cachedir):
+		if not name.endswith(CACHE_SUFFIX): continue
+		path = os.path.join(cachedir, name)
+		try:
+			st = os.stat(path)
+		except OSError:
+			continue
+		entries.append((st.st_mtime, st.st_size, path))
+
+	total = sum(size for (_, size, _) in entries)
+	for (_, size, path) in sorted(entries):
+		if total <= max_size:
+			break
+		if keep != None and os.path.abspath(path) == os.path.abspath(keep):
+			continue
+		remove_entry(path)
+		total -= size
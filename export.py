@@ -0,0 +1,185 @@
+from database_cache import DEFAULT_CACHE_SIZE
+from parse_config import parse_config, titles_to_ids
+from scores_reader import read_scores, PAD_HEADERS, KBD_HEADERS
+from sheet_rows import SHEET_SCORES, SHEET_DATA, SHEET_COMPLETE, ALL_SHEETS, load_database, filter_charts, data_sheet_rows, score_sheet_rows
+
+import argparse
+import csv
+import datetime
+import os
+import sqlite3
+import sys
+import tempfile
+
+# Exports the rows of the score and data sheets to CSV files or an SQLite database, for tools that
+# want the data without opening a workbook
+# The rows are the ones generate.py writes, with the same columns, except that the title, cut, mode
+# and difficulty of each chart on the score sheet are values (as with --static) rather than
+# lookups; they are written out one at a time as they're worked out, and openpyxl isn't used
+
+# The formats that can be exported to, selected with --format
+FORMAT_CSV    = "csv"    # A directory holding <sheet>.csv for each sheet
+FORMAT_SQLITE = "sqlite" # An SQLite database holding a table named after each sheet
+EXPORT_FORMATS = [FORMAT_CSV, FORMAT_SQLITE]
+
+# The sheets that can be exported, in the order they are written
+EXPORT_SHEETS = [SHEET_SCORES, SHEET_DATA, SHEET_COMPLETE]
+
+# Returns (headers, rows) of a sheet to export, where rows yields the list of values of each row
+def export_rows(db, kind, config, all_filtered_charts, scores):
+	if kind == SHEET_DATA:
+		return data_sheet_rows(db, all_filtered_charts, config)
+	if kind == SHEET_COMPLETE:
+		return data_sheet_rows(db, set(db.charts), None, by_cid=True)
+	(headers, key_headers, rows) = score_sheet_rows(db, all_filtered_charts, config, lookup=False)
+	return (headers, score_values(headers, rows, config, scores))
+
+# Returns a score's value as exported: dates, times and durations (read from date-formatted cells)
+# become the text that the CSV writer shows for them, since SQLite has no type for them
+def score_value(value):
+	if isinstance(value, (datetime.date, datetime.time, datetime.timedelta)):
+		return str(value)
+	return value
+
+# Yields the list of values of each row of the score sheet, with the scores from scores (see
+# scores_reader.read_scores) in the pad and keyboard columns
+def score_values(headers, rows, config, scores):
+	columns = []
+	if config.pad:
+		columns.append((headers.index(PAD_HEADERS[0]), True))
+	if config.keyboard:
+		columns.append((headers.index(KBD_HEADERS[0]), False))
+	for (cid, values) in rows:
+		row = [values.get(col) for col in range(1, len(headers)+1)]
+		for (i, pad) in columns:
+			s = scores.get((cid, pad))
+			if s != None:
+				row[i:i+4] = [score_value(v) for v in (s.passed, s.grade, s.miss, s.comment)]
+		yield row
+
+# Returns the paths that exporting to outpath in a format creates or replaces
+def export_paths(outpath, fmt, sheets):
+	if fmt == FORMAT_CSV:
+		return [os.path.join(outpath, "%s.csv" % kind) for kind in sheets]
+	return [outpath]
+
+# Writes each (kind, headers, rows) in sheets to <kind>.csv in the directory outpath
+# Each file is replaced once it's complete, so that an interrupted export leaves no partial file
+def write_csv(outpath, sheets):
+	os.makedirs(outpath, exist_ok=True)
+	for (kind, headers, rows) in sheets:
+		print("Writing %s.csv..." % kind)
+		fd, tmppath = tempfile.mkstemp(suffix=".csv", dir=outpath)
+		try:
+			with os.fdopen(fd, "w", newline="", encoding="utf-8") as f:
+				writer = csv.writer(f)
+				writer.writerow(headers)
+				writer.writerows(rows)
+			os.replace(tmppath, os.path.join(outpath, "%s.csv" % kind))
+		finally:
+			if os.path.exists(tmppath):
+				os.remove(tmppath)
+
+def quote_name(name):
+	return '"%s"' % name.replace('"', '""')
+
+# Writes each (kind, headers, rows) in sheets to a table named kind in a new SQLite database at
+# outpath, with the columns named after the headers
+# CID is the primary key of each table, and the tables with a SID column are indexed on it too; the
+# index is created once the rows are in, which is faster than keeping it up to date row by row
+# The database is replaced once it's complete, so that an interrupted export leaves no partial file
+def write_sqlite(outpath, sheets):
+	fd, tmppath = tempfile.mkstemp(suffix=".sqlite", dir=os.path.dirname(os.path.abspath(outpath)))
+	os.close(fd)
+	try:
+		conn = sqlite3.connect(tmppath)
+		for (kind, headers, rows) in sheets:
+			print("Writing table %s..." % kind)
+			columns = [quote_name(h) + ("", " INTEGER PRIMARY KEY")[h == "CID"] for h in headers]
+			conn.execute("CREATE TABLE %s (%s)" % (quote_name(kind), ", ".join(columns)))
+			conn.executemany("INSERT INTO %s VALUES (%s)" % (quote_name(kind), ", ".join(["?"] * len(headers))), rows)
+			if "SID" in headers:
+				conn.execute("CREATE INDEX %s ON %s (SID)" % (quote_name("%s_sid" % kind), quote_name(kind)))
+		conn.commit()
+		conn.close()
+		os.replace(tmppath, outpath)
+	finally:
+		if os.path.exists(tmppath):
+			os.remove(tmppath)
+
+# Exports the score and data sheets among sheets to outpath, in format fmt (one of EXPORT_FORMATS)
+# The other arguments are the same as those of generate.generate; the other sheets are left out
+# Returns whether it succeeded
+def export(dbpath, outpath, configpath, frompath, overwrite, fmt, cachedir=None, cache_size=DEFAULT_CACHE_SIZE, sheets=ALL_SHEETS, sql_filter=False):
+	exported = [s for s in EXPORT_SHEETS if s in sheets]
+	print("Database Path:   %s" % dbpath)
+	print("Output Path:     %s%s" % (outpath, ("", " (Overwrite)")[overwrite]))
+	print("Config Path:     %s" % configpath)
+	print("Old Scores Path: %s" % ("(None specified)",frompath)[frompath != None])
+	print("Cache Path:      %s" % ("(None specified)",cachedir)[cachedir != None])
+	print("Sheets:          %s" % ", ".join(exported))
+	print("Format:          %s" % fmt)
+	print("")
+
+	error = None
+	unknown = [s for s in sheets if not s in ALL_SHEETS]
+	if not fmt in EXPORT_FORMATS:
+		error = "Unknown format %s (expected one of %s)" % (fmt, ", ".join(EXPORT_FORMATS))
+	elif not os.path.isfile(dbpath):
+		error = "Database does not exist at %s" % dbpath
+	elif cachedir and os.path.exists(cachedir) and not os.path.isdir(cachedir):
+		error = "Cache path %s is not a directory" % cachedir
+	elif unknown:
+		error = "Unknown sheet(s) %s (expected some of %s)" % (", ".join(unknown), ", ".join(ALL_SHEETS))
+	elif len(exported) == 0:
+		error = "None of the selected sheets can be exported (expected some of %s)" % ", ".join(EXPORT_SHEETS)
+	elif fmt == FORMAT_CSV and os.path.exists(outpath) and not os.path.isdir(outpath):
+		error = "Output path %s is not a directory" % outpath
+	elif fmt == FORMAT_SQLITE and os.path.isdir(outpath):
+		error = "Output path %s is a directory" % outpath
+	elif not overwrite and any(os.path.exists(p) for p in export_paths(outpath, fmt, exported)):
+		error = "Output path %s already exists (force write with --overwrite)" % outpath
+	elif not os.path.isfile(configpath):
+		error = "Config file does not exist at %s" % configpath
+	elif frompath and not os.path.isfile(frompath):
+		error = "Scores path %s does not exist" % frompath
+	if error:
+		print("ERROR: %s" % error)
+		return False
+
+	print("Reading config file...")
+	config = parse_config(configpath)
+	db = load_database(dbpath, cachedir, cache_size, exported, (None, config)[sql_filter])
+	config.mix_ids = titles_to_ids(config.mixes, db.mixes, "mix")
+	config.mode_ids = titles_to_ids(config.modes, db.modes, "mode")
+	(mix_to_charts, all_filtered_charts) = filter_charts(db, config)
+
+	scores = {}
+	if frompath:
+		print("Reading old scores...")
+		scores = read_scores(frompath)
+
+	# The rows are only worked out as they're written
+	rows = [(kind,) + export_rows(db, kind, config, all_filtered_charts, scores) for kind in exported]
+	if fmt == FORMAT_CSV:
+		write_csv(outpath, rows)
+	else:
+		write_sqlite(outpath, rows)
+	return True
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Export the rows of the score and data sheets to CSV files or an SQLite database, without creating a spreadsheet.")
+	parser.add_argument("db", type=str, help="The path of the Pump Out database")
+	parser.add_argument("out", type=str, help="The path of the directory of CSV files, or of the SQLite database, to create")
+	parser.add_argument("--format", type=str, default=FORMAT_CSV, dest="fmt", choices=EXPORT_FORMATS, help="csv to write a CSV file for each sheet, or sqlite to write an SQLite database with a table for each sheet (default: csv)")
+	parser.add_argument("--from", type=str, dest="frompath", help="The optional path of a previous spreadsheet from which to copy scores")
+	parser.add_argument("--config", type=str, default="config.txt", help="The path of the configuration file (default: config.txt)")
+	parser.add_argument("--overwrite", action="store_true", help="Overwrite the output files if they already exist (default: off)")
+	parser.add_argument("--cache", type=str, dest="cachedir", help="The optional path of a directory in which to cache the parsed database between runs")
+	parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE // (1024*1024), help="The maximum total size of the cache directory in MB (default: %d)" % (DEFAULT_CACHE_SIZE // (1024*1024)))
+	parser.add_argument("--sheets", type=str, default=",".join(EXPORT_SHEETS), help="Comma-separated list of the sheets to export (default: %s)" % ",".join(EXPORT_SHEETS))
+	parser.add_argument("--sql-filter", action="store_true", help="Filter charts inside SQLite and only read the charts that pass the filter; the complete data sheet then only lists those charts (default: off)")
+	args = parser.parse_args()
+	sheets = [s.strip().lower() for s in args.sheets.split(",") if s.strip() != ""]
+	ok = export(args.db, args.out, args.config, args.frompath, args.overwrite, args.fmt, args.cachedir, args.cache_size * 1024*1024, sheets, args.sql_filter)
+	sys.exit((1, 0)[ok])
@@ -0,0 +1,213 @@
+import os
+import sys
+
+# The root of the repository, which the default config and work directory are relative to
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+sys.path.insert(0, ROOT)
+
+from generate import ALL_SHEETS, ALL_BACKENDS, BACKEND_OPENPYXL, DEFAULT_CACHE_SIZE, SHEET_SCORES, SHEET_SUMMARY, SHEET_DATA, SHEET_COMPLETE, create_xlsx, filter_charts, load_database
+from make_test_db import SONGS_PER_SCALE, make_database
+from parse_config import parse_config, titles_to_ids
+from profiling import MB, max_rss_mb
+from scores_reader import PAD_HEADERS, KBD_HEADERS, read_scores
+import xlsx_writer
+
+import argparse
+import contextlib
+import datetime
+import json
+import platform
+import random
+import subprocess
+import time
+import tracemalloc
+
+# Times each stage of generate.py on synthetic databases (see make_test_db.py) of several sizes,
+# and saves the results as JSON, so that the results of two commits can be compared
+#
+# Each size runs in its own process, so that the peak memory of one doesn't carry over to the
+# next. Peak memory is measured as the process's maximum resident set size after each stage, which
+# only ever grows; with --tracemalloc, each size is run a second time to measure the peak of the
+# memory that Python allocates during each stage on its own (which slows it down too much to be
+# timed in the same run)
+
+# The share of charts that have a score in the old spreadsheet that the stages read scores from
+SCORED_SHARE = 0.3
+# A stage is reported as a regression by --baseline when it's this much slower
+DEFAULT_THRESHOLD = 1.2
+
+# Writes a spreadsheet with a Scores sheet that has made-up scores for some of the charts, for the
+# stages to read scores from
+def write_scores_workbook(path, charts, seed):
+	rnd = random.Random(seed)
+	wb = xlsx_writer.Workbook()
+	ws = wb.create_sheet("Scores")
+	ws.append(["CID"] + PAD_HEADERS + KBD_HEADERS)
+	for cid in sorted(charts):
+		if rnd.random() >= SCORED_SHARE: continue
+		pad = [rnd.choice(["Y", "N"]), rnd.choice(["S", "A", "B", "C", None]), rnd.randint(0, 50), rnd.choice([None, None, "Close"])]
+		kbd = [None] * 4
+		if rnd.random() < 0.5:
+			kbd = [rnd.choice(["Y", "N"]), rnd.choice(["S", "A", None]), rnd.randint(0, 50), None]
+		ws.append([cid] + pad + kbd)
+	wb.save(path)
+	wb.close()
+
+# Runs every stage on one database, and returns {"charts": number of charts, "stages":
+# [{"stage", "seconds", "max_rss_mb"}]}, with "peak_alloc_mb" in each stage too if trace is True
+def run_stages(dbpath, configpath, workdir, backend, trace):
+	results = []
+	def stage(name, function):
+		if trace:
+			tracemalloc.reset_peak()
+		start = time.perf_counter()
+		with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+			value = function()
+		result = {"stage": name, "seconds": round(time.perf_counter() - start, 3), "max_rss_mb": max_rss_mb()}
+		if trace:
+			result["peak_alloc_mb"] = round(tracemalloc.get_traced_memory()[1] / MB, 1)
+		results.append(result)
+		print("  %-16s %8.2fs" % (name, result["seconds"]), file=sys.stderr)
+		return value
+
+	def out(name):
+		return os.path.join(workdir, "%s.xlsx" % name)
+
+	if trace:
+		tracemalloc.start()
+	config = parse_config(configpath)
+	db = stage("read_database", lambda: load_database(dbpath, None, DEFAULT_CACHE_SIZE, ALL_SHEETS))
+	config.mix_ids = titles_to_ids(config.mixes, db.mixes, "mix")
+	config.mode_ids = titles_to_ids(config.modes, db.modes, "mode")
+	(mix_to_charts, all_filtered_charts) = stage("filter_charts", lambda: filter_charts(db, config))
+
+	frompath = out("from")
+	write_scores_workbook(frompath, all_filtered_charts, 1)
+	stage("read_scores", lambda: read_scores(frompath))
+
+	# Each kind of sheet on its own, then all of them, as generate.py creates them
+	def create(name, sheets, update=False):
+		stage(name, lambda: create_xlsx(db, dbpath, out("all"), config, (frompath, None)[update], mix_to_charts, all_filtered_charts, sheets, backend=backend, update=update))
+	create("create_data", [SHEET_DATA])
+	create("create_complete", [SHEET_COMPLETE])
+	create("create_scores", [SHEET_SCORES])
+	create("create_summary", [SHEET_SCORES, SHEET_SUMMARY])
+	create("create_all", ALL_SHEETS)
+	# Nothing has changed since create_all, so this is the cost of finding that out
+	create("update_unchanged", ALL_SHEETS, True)
+	return {"charts": len(db.charts), "stages": results}
+
+# Returns the database for a scale in the work directory, creating it if it isn't there yet
+def scale_database(workdir, scale, history, seed):
+	path = os.path.join(workdir, "db_x%g_h%d_s%d.sqlite" % (scale, history, seed))
+	if not os.path.isfile(path):
+		print("Creating database at scale %g..." % scale, file=sys.stderr)
+		factor = max(1, scale ** 0.5)
+		make_database(path, max(1, int(SONGS_PER_SCALE * scale)), versions_per_mix=(int(2 * factor), int(8 * factor)), history=history, seed=seed)
+	return path
+
+# Runs the stages at one scale in a new process, and returns its results
+def run_scale(args, scale, trace):
+	command = [sys.executable, os.path.abspath(__file__), "--run-scale", "%g" % scale,
+		"--config", args.config, "--backend", args.backend, "--work", args.work,
+		"--history", "%d" % args.history, "--seed", "%d" % args.seed]
+	if trace:
+		command.append("--tracemalloc")
+	output = subprocess.run(command, stdout=subprocess.PIPE, check=True).stdout
+	return json.loads(output)
+
+# Returns the commit that the tree is at, or None if it isn't known
+def git_commit():
+	try:
+		commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+		return commit.decode("ascii").strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+# Prints how long each stage took compared with a baseline report, and returns the number of
+# stages that are slower than it by more than threshold
+def compare(report, baseline, threshold):
+	print("")
+	print("Compared with %s (%s):" % (baseline.get("commit") or "unknown commit", baseline.get("date")))
+	old = {}
+	for run in baseline["runs"]:
+		for result in run["stages"]:
+			old[(run["scale"], result["stage"])] = result
+
+	regressions = 0
+	print("%-8s %-16s %10s %10s %8s %12s %12s" % ("Scale", "Stage", "Before", "After", "Ratio", "RSS before", "RSS after"))
+	for run in report["runs"]:
+		for result in run["stages"]:
+			before = old.get((run["scale"], result["stage"]))
+			if before == None: continue
+			ratio = result["seconds"] / max(before["seconds"], 0.001)
+			flag = ""
+			if ratio > threshold:
+				flag = " SLOWER"
+				regressions += 1
+			print("%-8g %-16s %9.2fs %9.2fs %7.2fx %10s MB %9s MB%s" % (run["scale"], result["stage"], before["seconds"], result["seconds"], ratio,
+				before.get("max_rss_mb"), result.get("max_rss_mb"), flag))
+	return regressions
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Time each stage of generate.py on synthetic databases of several sizes.")
+	parser.add_argument("--scales", type=str, default="1,10", help="Comma-separated list of the sizes of the databases, relative to a current dump (default: 1,10)")
+	parser.add_argument("--config", type=str, default=os.path.join(ROOT, "config.txt"), help="The path of the configuration file (default: config.txt)")
+	parser.add_argument("--backend", type=str, default=BACKEND_OPENPYXL, choices=ALL_BACKENDS, help="The library that writes the workbooks (default: openpyxl)")
+	parser.add_argument("--work", type=str, default=os.path.join(ROOT, "benchmark"), help="The directory in which to keep the databases, which are reused by later runs, and the spreadsheets (default: benchmark)")
+	parser.add_argument("--history", type=int, default=1, help="How many times each song and chart may change in the databases (default: 1)")
+	parser.add_argument("--seed", type=int, default=1, help="The seed of the databases (default: 1)")
+	parser.add_argument("--tracemalloc", action="store_true", help="Also measure the peak memory that each stage allocates, in a second run of each size (default: off)")
+	parser.add_argument("--out", type=str, help="The path of the JSON file to save the results to (default: benchmark-<commit>.json in the work directory)")
+	parser.add_argument("--baseline", type=str, help="The path of the JSON results of an earlier run to compare these with; the exit status is 1 if a stage got slower")
+	parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="How many times slower than the baseline a stage has to be to count as slower (default: %g)" % DEFAULT_THRESHOLD)
+	parser.add_argument("--run-scale", type=float, help=argparse.SUPPRESS)
+	args = parser.parse_args()
+	os.makedirs(args.work, exist_ok=True)
+
+	if args.run_scale != None:
+		# In the process of one scale: prints its results as JSON
+		dbpath = scale_database(args.work, args.run_scale, args.history, args.seed)
+		json.dump(run_stages(dbpath, args.config, args.work, args.backend, args.tracemalloc), sys.stdout)
+		sys.exit(0)
+
+	if not os.path.isfile(args.config):
+		print("ERROR: Config file does not exist at %s" % args.config)
+		sys.exit(1)
+
+	commit = git_commit()
+	report = {
+		"commit": commit,
+		"date": datetime.datetime.now().isoformat(timespec="seconds"),
+		"python": platform.python_version(),
+		"platform": platform.platform(),
+		"backend": args.backend,
+		"config": os.path.basename(args.config),
+		"history": args.history,
+		"seed": args.seed,
+		"runs": [],
+	}
+	for scale in [float(s) for s in args.scales.split(",") if s.strip() != ""]:
+		print("Scale %g:" % scale, file=sys.stderr)
+		run = run_scale(args, scale, False)
+		if args.tracemalloc:
+			print("Scale %g (tracemalloc):" % scale, file=sys.stderr)
+			traced = run_scale(args, scale, True)
+			for (result, peak) in zip(run["stages"], traced["stages"]):
+				result["peak_alloc_mb"] = peak["peak_alloc_mb"]
+		dbpath = scale_database(args.work, scale, args.history, args.seed)
+		report["runs"].append({"scale": scale, "charts": run["charts"], "db_size_mb": round(os.path.getsize(dbpath) / MB, 1), "stages": run["stages"]})
+
+	outpath = args.out or os.path.join(args.work, "benchmark-%s.json" % (commit or "unknown")[:10])
+	with open(outpath, "w") as f:
+		json.dump(report, f, indent=1)
+	print("Results saved to %s" % outpath)
+
+	if args.baseline:
+		with open(args.baseline) as f:
+			baseline = json.load(f)
+		regressions = compare(report, baseline, args.threshold)
+		print("")
+		print("%d stage(s) slower than the baseline" % regressions)
+		sys.exit((0, 1)[regressions > 0])
@@ -0,0 +1,120 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from generate import generate_xlsx, ALL_BACKENDS
+
+from openpyxl import load_workbook
+
+import argparse
+
+# Creates the same spreadsheet with each backend of generate.py, then loads them back with
+# openpyxl and checks that they hold the same values, formulas, styles, merged cells, column
+# widths, hidden columns, frozen panes and conditional formatting
+
+# Returns a comparable summary of a border side
+def side_summary(side):
+	if side == None or side.style == None:
+		return None
+	return (side.style, side.color.rgb if side.color != None else None)
+
+# Returns a comparable summary of the style of a cell
+def style_summary(c):
+	fill = None
+	if c.fill.fill_type:
+		fill = (c.fill.fill_type, c.fill.fgColor.rgb)
+	border = tuple(side_summary(s) for s in (c.border.left, c.border.right, c.border.top, c.border.bottom))
+	return (c.font.b, fill, border, c.alignment.horizontal)
+
+# The style_summary of a cell without any formatting
+DEFAULT_STYLE = (False, None, (None, None, None, None), None)
+
+# Returns {sheet title: {aspect: value}} for the spreadsheet at path
+def summarize(path):
+	wb = load_workbook(path)
+	sheets = {}
+	for ws in wb.worksheets:
+		cells = {}
+		for row in ws.iter_rows():
+			for c in row:
+				style = style_summary(c)
+				if c.value == None and style == DEFAULT_STYLE: continue
+				value = c.value
+				# The generation time
+				if ws.title == "About" and c.coordinate == "B3": value = None
+				cells[c.coordinate] = (value, style)
+
+		cf = []
+		for rng in ws.conditional_formatting:
+			for rule in rng.rules:
+				fill = None
+				if rule.dxf and rule.dxf.fill:
+					fill = rule.dxf.fill.bgColor.rgb
+				cf.append((str(rng.sqref), rule.type, rule.operator, tuple(rule.formula), fill))
+
+		sheets[ws.title] = {
+			"cells": cells,
+			"merged cells": sorted(str(m) for m in ws.merged_cells.ranges),
+			"column widths": {k: (d.width, d.hidden) for k, d in ws.column_dimensions.items() if d.width or d.hidden},
+			"frozen panes": ws.freeze_panes,
+			"conditional formatting": sorted(cf),
+		}
+	return (wb.sheetnames, sheets)
+
+# Prints the differences between two summaries, returning their number
+def compare(name_a, a, name_b, b, limit):
+	(titles_a, sheets_a) = a
+	(titles_b, sheets_b) = b
+	if titles_a != titles_b:
+		print("Sheets differ: %s has %s, %s has %s" % (name_a, titles_a, name_b, titles_b))
+		return 1
+
+	diffs = 0
+	for title in titles_a:
+		for aspect in sheets_a[title]:
+			x = sheets_a[title][aspect]
+			y = sheets_b[title][aspect]
+			if x == y: continue
+			if aspect != "cells":
+				print("%s: %s differ: %s has %s, %s has %s" % (title, aspect, name_a, x, name_b, y))
+				diffs += 1
+				continue
+			for coord in sorted(set(x) | set(y)):
+				if x.get(coord) == y.get(coord): continue
+				if diffs < limit:
+					print("%s!%s: %s has %s, %s has %s" % (title, coord, name_a, x.get(coord), name_b, y.get(coord)))
+				diffs += 1
+	return diffs
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Check that every backend of generate.py creates the same spreadsheet.")
+	parser.add_argument("db", type=str, help="The path of the Pump Out database")
+	parser.add_argument("--from", type=str, dest="frompath", help="The optional path of a previous spreadsheet from which to copy scores")
+	parser.add_argument("--config", type=str, default="config.txt", help="The path of the configuration file (default: config.txt)")
+	parser.add_argument("--limit", type=int, default=20, help="The maximum number of cell differences to print (default: 20)")
+	args = parser.parse_args()
+
+	# Each backend creates the spreadsheet as generate.py does by default, then again with the
+	# charts filtered by SQLite and the parsed database cached (which the first backend stores and
+	# the others load)
+	diffs = 0
+	with tempfile.TemporaryDirectory() as tmpdir:
+		variants = [("default", {}), ("sql-filter, cache", {"sql_filter": True, "cachedir": os.path.join(tmpdir, "cache")})]
+		for (variant, options) in variants:
+			summaries = []
+			for backend in ALL_BACKENDS:
+				path = os.path.join(tmpdir, "%s.xlsx" % backend)
+				print("=== Generating with the %s backend (%s) ===" % (backend, variant))
+				generate_xlsx(args.db, path, args.config, args.frompath, backend=backend, **options)
+				summaries.append(("%s (%s)" % (backend, variant), summarize(path)))
+
+			(reference, expected) = summaries[0]
+			for (backend, actual) in summaries[1:]:
+				diffs += compare(reference, expected, backend, actual, args.limit)
+
+	if diffs:
+		print("FAILED: %d difference(s)" % diffs)
+		sys.exit(1)
+	print("OK: all backends created the same spreadsheet")
@@ -0,0 +1,301 @@
+import argparse
+import os
+import random
+import sqlite3
+
+# Writes a synthetic Pump Out database, with the tables and columns that parse_pump_out reads
+# (see db_relations.txt), for testing and benchmarking at sizes that no real dump has
+#
+# At scale 1 it holds about as many songs, charts and versions as a current dump; the mixes keep
+# their real titles so that the usual configs work with it
+
+MIXES = ["The 1st Dance Floor", "2nd Ultimate Remix", "3rd O.B.G", "The O.B.G / Season Evolution", "The Collection",
+	"The Perfect Collection", "Extra", "The Premiere", "The Prex", "The Rebirth", "The Premiere 2", "The Prex 2",
+	"The Premiere 3", "The Prex 3", "Exceed", "Exceed 2", "Zero", "NX / New Xenesis", "NX2 / Next Xenesis",
+	"NX Absolute", "Fiesta", "Fiesta EX", "Fiesta 2", "Infinity", "Prime", "Prime JE", "Prime 2", "XX"]
+# The mix whose versions branch off the last version of the one before it, instead of following on
+BRANCH_MIX = "Prime JE"
+# (title, abbreviation, color, order, pads, routine, co-op, performance)
+MODES = [("Single", "S", "ff0000", 0, 1, 0, 0, 0), ("Double", "D", "00ff00", 1, 2, 0, 0, 0),
+	("Single Performance", "SP", "ff00ff", 2, 1, 0, 0, 1), ("Double Performance", "DP", "00ffff", 3, 2, 0, 0, 1),
+	("Co-Op", "CO", "ffff00", 4, 2, 0, 1, 0), ("Routine", "R", "0000ff", 5, 2, 1, 0, 0), ("Half-Double", "HD", "888888", 6, 2, 0, 0, 0)]
+MODE_WEIGHTS = [10, 8, 2, 2, 1, 1, 1]
+MODE_ROUTINE = 6
+CUTS = ["Arcade", "Remix", "Full Song", "Short Cut"]
+LABELS = ["Hidden", "Unlock", "Quest", "Removed in patch", "Jump", "Bracket", "Twist", "Gimmick"]
+CATEGORIES = ["K-Pop", "World Music", "Original", "J-Music", "Xross"]
+DIFFICULTY_MAX = 28
+DIFFICULTY_UNRATED = 99
+
+OP_INSERT = 1
+OP_DELETE = 2
+OP_UPDATE = 3
+OP_REVIVE = 5
+
+SONGS_PER_SCALE = 600
+STEPMAKERS = 40
+ARTISTS = 300
+
+SCHEMA = '''
+	CREATE TABLE operation (operationId INTEGER PRIMARY KEY, internalTitle TEXT);
+	CREATE TABLE game (gameId INTEGER PRIMARY KEY, internalTitle TEXT);
+	CREATE TABLE mix (mixId INTEGER PRIMARY KEY, gameId INTEGER, internalTitle TEXT, parentMixId INTEGER, sortOrder INTEGER);
+	CREATE TABLE mode (modeId INTEGER PRIMARY KEY, internalTitle TEXT, internalAbbreviation TEXT, internalHexColor TEXT, sortOrder INTEGER, padsUsed INTEGER, routine INTEGER, coOp INTEGER, performance INTEGER);
+	CREATE TABLE cut (cutId INTEGER PRIMARY KEY, internalTitle TEXT, sortOrder INTEGER);
+	CREATE TABLE version (versionId INTEGER PRIMARY KEY, mixId INTEGER, internalTitle TEXT, parentVersionId INTEGER, sortOrder INTEGER);
+	CREATE TABLE difficulty (difficultyId INTEGER PRIMARY KEY, value INTEGER);
+	CREATE TABLE rating (modeId INTEGER, difficultyId INTEGER, path TEXT);
+	CREATE TABLE song (songId INTEGER PRIMARY KEY, cutId INTEGER, internalTitle TEXT);
+	CREATE TABLE songVersion (songId INTEGER, versionId INTEGER, operationId INTEGER, internalDescription TEXT);
+	CREATE TABLE chart (chartId INTEGER PRIMARY KEY, songId INTEGER);
+	CREATE TABLE chartVersion (chartId INTEGER, versionId INTEGER, operationId INTEGER, internalDescription TEXT);
+	CREATE TABLE chartRating (chartRatingId INTEGER PRIMARY KEY, chartId INTEGER, modeId INTEGER, difficultyId INTEGER);
+	CREATE TABLE chartRatingVersion (chartRatingId INTEGER, chartId INTEGER, versionId INTEGER);
+	CREATE TABLE stepmaker (stepmakerId INTEGER PRIMARY KEY, internalTitle TEXT);
+	CREATE TABLE chartStepmaker (chartId INTEGER, stepmakerId INTEGER, prefix TEXT, sortOrder INTEGER);
+	CREATE TABLE label (labelId INTEGER PRIMARY KEY, internalTitle TEXT);
+	CREATE TABLE chartLabel (chartLabelId INTEGER PRIMARY KEY, chartId INTEGER, labelId INTEGER);
+	CREATE TABLE chartLabelVersion (chartLabelId INTEGER, versionId INTEGER, operationId INTEGER);
+	CREATE TABLE language (languageId INTEGER PRIMARY KEY, code TEXT);
+	CREATE TABLE songTitle (songTitleId INTEGER, languageId INTEGER, songId INTEGER, title TEXT);
+	CREATE TABLE songTitleVersion (songTitleId INTEGER, songId INTEGER, languageId INTEGER, versionId INTEGER);
+	CREATE TABLE songGameIdentifier (songGameIdentifierId INTEGER PRIMARY KEY, songId INTEGER, gameIdentifier TEXT);
+	CREATE TABLE songGameIdentifierVersion (songGameIdentifierId INTEGER, versionId INTEGER, operationId INTEGER);
+	CREATE TABLE category (categoryId INTEGER PRIMARY KEY, internalTitle TEXT);
+	CREATE TABLE songCategory (songCategoryId INTEGER PRIMARY KEY, songId INTEGER, categoryId INTEGER);
+	CREATE TABLE songCategoryVersion (songCategoryId INTEGER, songId INTEGER, versionId INTEGER);
+	CREATE TABLE songBpm (songBpmId INTEGER PRIMARY KEY, songId INTEGER, bpmMin REAL, bpmMax REAL);
+	CREATE TABLE songBpmVersion (songBpmId INTEGER, songId INTEGER, versionId INTEGER);
+	CREATE TABLE artist (artistId INTEGER PRIMARY KEY, internalTitle TEXT);
+	CREATE TABLE songArtist (songId INTEGER, artistId INTEGER, prefix TEXT, sortOrder INTEGER);
+	CREATE TABLE songCard (songCardId INTEGER PRIMARY KEY, songId INTEGER, path TEXT);
+	CREATE TABLE songCardVersion (songCardId INTEGER, versionId INTEGER, operationId INTEGER);
+'''
+
+# Returns (min, max) from a "min-max" or "n" argument
+def parse_range(text):
+	if "-" in text:
+		(lo, hi) = text.split("-", 1)
+		return (int(lo), int(hi))
+	return (int(text), int(text))
+
+# Rows to insert, by table, written out at the end with one executemany per table
+class Rows:
+	def __init__(self):
+		self.tables = {}
+		self.ids = {}
+
+	def add(self, table, *values):
+		self.tables.setdefault(table, []).append(values)
+
+	# Returns the next id of a kind of row, starting from 1
+	def next_id(self, kind):
+		self.ids[kind] = self.ids.get(kind, 0) + 1
+		return self.ids[kind]
+
+	def write(self, conn):
+		for (table, rows) in self.tables.items():
+			conn.executemany("INSERT INTO %s VALUES (%s)" % (table, ",".join("?" * len(rows[0]))), rows)
+
+# The version tree: each mix is a run of versions, each the child of the one before, and each mix
+# follows on from the last version of the one before it (except BRANCH_MIX, which branches off)
+class Versions:
+	def __init__(self, rnd, mixes, versions_per_mix, rows):
+		self.order = {}
+		self.children = {}
+		self.descendant_lists = {}
+		self.all = []
+
+		parent = None
+		order = 0
+		for (i, title) in enumerate(mixes):
+			rows.add("mix", i+1, 1, title, i if i else None, (i+1)*10)
+			p = parent
+			for j in range(rnd.randint(*versions_per_mix)):
+				vid = rows.next_id("version")
+				order += 1
+				rows.add("version", vid, i+1, "1.%02d" % j, p, order)
+				self.order[vid] = order
+				self.children.setdefault(p, []).append(vid)
+				self.all.append(vid)
+				p = vid
+			if title != BRANCH_MIX:
+				parent = p
+
+	# Returns the versions that descend from v, v included, in chronological order
+	def descendants(self, v):
+		if not v in self.descendant_lists:
+			found = []
+			stack = [v]
+			while stack:
+				w = stack.pop()
+				found.append(w)
+				stack.extend(self.children.get(w, []))
+			found.sort(key=lambda w: self.order[w])
+			self.descendant_lists[v] = found
+		return self.descendant_lists[v]
+
+	# Returns up to n versions, in chronological order, that each descend from the one before,
+	# starting after v; each is picked with the given probability
+	def later_changes(self, rnd, v, n, probability):
+		changes = []
+		for i in range(n):
+			later = self.descendants(v)[1:]
+			if not later or rnd.random() >= probability: break
+			v = rnd.choice(later)
+			changes.append(v)
+		return changes
+
+# Writes the database to path, replacing any file there
+#
+# songs: the number of songs; charts_per_song, versions_per_mix: (min, max) ranges
+# mixes: the number of mixes, the last ones of MIXES first, then made-up older ones
+# history: how many times each song and chart may change after it's introduced (renames, new
+# ratings, removals and revivals, labels coming and going)
+def make_database(path, songs, charts_per_song=(4, 12), mixes=len(MIXES), versions_per_mix=(2, 8), history=1, seed=1):
+	rnd = random.Random(seed)
+	if os.path.exists(path):
+		os.remove(path)
+
+	mix_titles = ["Old Mix %d" % (i+1) for i in range(mixes - len(MIXES))] + MIXES[max(0, len(MIXES) - mixes):]
+
+	rows = Rows()
+	for (i, title) in enumerate(["INSERT", "DELETE", "UPDATE", "EXISTS", "REVIVE", "CROSS"]):
+		rows.add("operation", i+1, title)
+	rows.add("game", 1, "Pump It Up")
+	rows.add("language", 1, "en")
+	rows.add("language", 2, "ko")
+	for (i, mode) in enumerate(MODES):
+		rows.add("mode", i+1, *mode)
+	for (i, title) in enumerate(CUTS):
+		rows.add("cut", i+1, title, i)
+	for d in range(1, DIFFICULTY_MAX+1):
+		rows.add("difficulty", d, d)
+	rows.add("difficulty", DIFFICULTY_UNRATED, None)
+	for m in range(len(MODES)):
+		for d in range(1, DIFFICULTY_MAX+1):
+			rows.add("rating", m+1, d, "img/%d_%d.png" % (m+1, d))
+	for i in range(STEPMAKERS):
+		rows.add("stepmaker", i+1, "Stepmaker %d" % i)
+	for i in range(ARTISTS):
+		rows.add("artist", i+1, "Artist %d" % i)
+	for (i, title) in enumerate(LABELS):
+		rows.add("label", i+1, title)
+	for (i, title) in enumerate(CATEGORIES):
+		rows.add("category", i+1, title)
+
+	versions = Versions(rnd, mix_titles, versions_per_mix, rows)
+
+	for s in range(1, songs+1):
+		intro = rnd.choice(versions.all)
+		rows.add("song", s, rnd.randint(1, len(CUTS)), "Song %d" % s)
+		rows.add("songVersion", s, intro, OP_INSERT, rnd.choice([None, "", "Imported"]))
+		for v in versions.later_changes(rnd, intro, history, 0.1):
+			rows.add("songVersion", s, v, OP_UPDATE, "Updated song")
+
+		for (k, v) in enumerate([intro] + versions.later_changes(rnd, intro, history, 0.1)):
+			tid = rows.next_id("songTitle")
+			rows.add("songTitle", tid, 1, s, "Song Title %d%s" % (s, " (Renamed %d)" % k if k else ""))
+			rows.add("songTitleVersion", tid, s, 1, v)
+			tid = rows.next_id("songTitle")
+			rows.add("songTitle", tid, 2, s, "노래 %d" % s)
+			rows.add("songTitleVersion", tid, s, 2, v)
+
+		gid = rows.next_id("songGameIdentifier")
+		rows.add("songGameIdentifier", gid, s, "%X" % (0x100 + s))
+		rows.add("songGameIdentifierVersion", gid, intro, OP_INSERT)
+
+		for v in [intro] + versions.later_changes(rnd, intro, history, 0.05):
+			scid = rows.next_id("songCategory")
+			rows.add("songCategory", scid, s, rnd.randint(1, len(CATEGORIES)))
+			rows.add("songCategoryVersion", scid, s, v)
+
+		bid = rows.next_id("songBpm")
+		lo = rnd.choice([90, 120, 140, 150.5, 160, 180, 195])
+		hi = lo if rnd.random() < 0.8 else lo + rnd.randint(10, 60)
+		rows.add("songBpm", bid, s, lo, hi)
+		rows.add("songBpmVersion", bid, s, intro)
+
+		for k in range(rnd.randint(1, 2)):
+			rows.add("songArtist", s, rnd.randint(1, ARTISTS), "" if k == 0 else "feat.", k)
+
+		# Some songs have two cards at once
+		card_versions = [intro] + versions.descendants(intro)[1:2] * (rnd.random() >= 0.9)
+		for (k, v) in enumerate(card_versions):
+			cdid = rows.next_id("songCard")
+			rows.add("songCard", cdid, s, "cards/%d_%d.png" % (s, k))
+			rows.add("songCardVersion", cdid, v, OP_INSERT)
+
+		for k in range(rnd.randint(*charts_per_song)):
+			add_chart(rnd, rows, versions, s, intro, history)
+
+	conn = sqlite3.connect(path)
+	conn.executescript(SCHEMA)
+	rows.write(conn)
+	conn.commit()
+	conn.close()
+	return rows.ids.get("chart", 0)
+
+# Adds a chart of song s, introduced with the song or later
+def add_chart(rnd, rows, versions, s, song_intro, history):
+	cid = rows.next_id("chart")
+	rows.add("chart", cid, s)
+	intro = song_intro
+	if rnd.random() >= 0.8:
+		intro = rnd.choice(versions.descendants(song_intro))
+	rows.add("chartVersion", cid, intro, OP_INSERT, rnd.choice([None, "New chart"]))
+
+	# Removed, and maybe revived, up to history times
+	v = intro
+	for i in range(history):
+		removed = versions.later_changes(rnd, v, 1, 0.15)
+		if not removed: break
+		rows.add("chartVersion", cid, removed[0], OP_DELETE, "Removed")
+		revived = versions.later_changes(rnd, removed[0], 1, 0.5)
+		if not revived: break
+		rows.add("chartVersion", cid, revived[0], OP_REVIVE, "Revived")
+		v = revived[0]
+
+	mode = rnd.choices(range(1, len(MODES)+1), weights=MODE_WEIGHTS)[0]
+	for v in [intro] + versions.later_changes(rnd, intro, history, 0.25):
+		rid = rows.next_id("chartRating")
+		if mode == MODE_ROUTINE:
+			diff = rnd.choice([2, 3, 4, DIFFICULTY_UNRATED])
+		else:
+			diff = rnd.choice(list(range(1, DIFFICULTY_MAX+1)) + [DIFFICULTY_UNRATED])
+		rows.add("chartRating", rid, cid, mode, diff)
+		rows.add("chartRatingVersion", rid, cid, v)
+
+	for k in range(rnd.randint(1, 2)):
+		rows.add("chartStepmaker", cid, rnd.randint(1, STEPMAKERS), "" if k == 0 else "&", k)
+
+	for label in rnd.sample(range(1, len(LABELS)+1), rnd.choice([0, 0, 1, 2])):
+		lid = rows.next_id("chartLabel")
+		rows.add("chartLabel", lid, cid, label)
+		rows.add("chartLabelVersion", lid, intro, OP_INSERT)
+		# Taken off and put back on in turn
+		for (i, v) in enumerate(versions.later_changes(rnd, intro, history, 0.2)):
+			rows.add("chartLabelVersion", lid, v, (OP_DELETE, OP_INSERT)[i % 2])
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Write a synthetic Pump Out database for testing and benchmarking.")
+	parser.add_argument("out", type=str, help="The path of the database to write (replaced if it exists)")
+	parser.add_argument("--scale", type=float, default=1.0, help="The size relative to a current dump, which sets the default number of songs and versions (default: 1)")
+	parser.add_argument("--songs", type=int, help="The number of songs (default: %d times the scale)" % SONGS_PER_SCALE)
+	parser.add_argument("--charts-per-song", type=str, default="4-12", help="The number of charts of each song, as n or min-max (default: 4-12)")
+	parser.add_argument("--mixes", type=int, default=len(MIXES), help="The number of mixes; beyond %d, older made-up ones are added (default: %d)" % (len(MIXES), len(MIXES)))
+	parser.add_argument("--versions-per-mix", type=str, help="The number of versions of each mix, as n or min-max (default: 2-8 times the square root of the scale)")
+	parser.add_argument("--history", type=int, default=1, help="How many times each song and chart may change after it's introduced (default: 1)")
+	parser.add_argument("--seed", type=int, default=1, help="The seed of the random generator (default: 1)")
+	args = parser.parse_args()
+
+	songs = args.songs
+	if songs == None:
+		songs = max(1, int(SONGS_PER_SCALE * args.scale))
+	versions_per_mix = args.versions_per_mix
+	if versions_per_mix == None:
+		factor = max(1, args.scale ** 0.5)
+		versions_per_mix = "%d-%d" % (int(2 * factor), int(8 * factor))
+
+	charts = make_database(args.out, songs, parse_range(args.charts_per_song), args.mixes, parse_range(versions_per_mix), args.history, args.seed)
+	print("Wrote %s: %d songs, %d charts" % (args.out, songs, charts))
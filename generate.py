@@ -1,21 +1,50 @@
-from parse_pump_out import read_database
-from parse_config import parse_config, titles_to_ids, config_all
+from database_cache import DEFAULT_CACHE_SIZE
+from export import EXPORT_FORMATS, export
+from parse_config import parse_config, titles_to_ids
+from scores_reader import read_scores, PAD_HEADERS, KBD_HEADERS
+from sheet_rows import (SHEET_SCORES, SHEET_SUMMARY, SHEET_DATA, SHEET_COMPLETE, SHEET_ABOUT, ALL_SHEETS, NAME_COMPLETE,
+	load_database, filter_charts, get_latest_filtered_mix, data_sheet_rows, score_sheet_rows, summary_group, summary_key)
+from sheet_pool import check_openpyxl_version, render_sheets, save_with_sheets
+from workbook_update import OldWorkbook, normalize_row
+from profiling import NO_PROFILE, Profile
+import xlsx_writer
 
 from openpyxl import Workbook
-from openpyxl import load_workbook
-from openpyxl.drawing.image import Image
-from openpyxl.formatting.rule import CellIsRule, FormulaRule, Rule
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import TIME_TYPES
+from openpyxl.formatting.rule import CellIsRule
 from openpyxl.styles import Font, PatternFill
 from openpyxl.styles.alignment import Alignment
 from openpyxl.styles.borders import Border, Side
-from openpyxl.styles.differential import DifferentialStyle
 from openpyxl.utils import get_column_letter as gcl
+from openpyxl.workbook.defined_name import DefinedName
+from openpyxl.worksheet._write_only import WriteOnlyWorksheet
+from openpyxl.worksheet.worksheet import Worksheet
 
+from copy import copy
+from itertools import chain
 import argparse
 import datetime
 import os
 import re
-import sys
+import tempfile
+
+# The libraries that can write the workbook, selected with --backend
+BACKEND_OPENPYXL = "openpyxl" # openpyxl's object model (the reference)
+BACKEND_NATIVE   = "native"   # xlsx_writer, which writes the XML directly
+ALL_BACKENDS = [BACKEND_OPENPYXL, BACKEND_NATIVE]
+
+# The formats of the output, selected with --format: a workbook, or one of those of export.py
+FORMAT_XLSX = "xlsx"
+ALL_FORMATS = [FORMAT_XLSX] + EXPORT_FORMATS
+
+# Names of the ranges that the formulas look up, defined by generate_xlsx with the number of rows
+# actually written, so that the lookups neither scan empty rows nor miss rows past a fixed limit
+# (and NAME_COMPLETE, in sheet_rows)
+NAME_SCORES_PASSED = "%sPassed"    # Passed column of Scores, for "Pad" or "Kbd"
+NAME_SCORES_GRADE  = "%sGrade"     # Grade column of Scores, for "Pad" or "Kbd"
+NAME_SCORES_MISS   = "%sMiss"      # Miss column of Scores, for "Pad" or "Kbd"
+NAME_SUMMARY_KEYS  = "SummaryKeys%d" # Summary keys column of Scores, for the nth mix of the config
 
 def adjust_column_widths(ws, cols, rows):
 	for c in cols:
@@ -26,94 +55,89 @@ def adjust_column_widths(ws, cols, rows):
 			width = max(width, len(str(val)))
 		ws.column_dimensions[gcl(c)].width = width + 1
 
-def get_latest_filtered_mix(db, mixes):
-	latest = -1
-	for mid in mixes:
-		if latest == -1:
-			latest = mid
-		elif db.mixes[mid].order > db.mixes[latest].order:
-			latest = mid
-	return latest
-
-def add_border(ws, row, column, left=None, right=None, bottom=None, top=None):
-	old = ws.cell(row=row, column=column).border
-	if left == None:
-		left = old.left
-	if right == None:
-		right = old.right
-	if bottom == None:
-		bottom = old.bottom
-	if top == None:
-		top = old.top
-	ws.cell(row=row, column=column).border = Border(left=left, right=right, bottom=bottom, top=top, diagonal=old.diagonal, diagonal_direction=old.diagonal_direction, vertical=old.vertical, horizontal=old.horizontal)
-
-def write_data_sheet(ws, db, chart_set, config):
-	if chart_set == None:
-		chart_set = set(db.charts)
-	if config == None:
-		config = config_all(db)
-
-	fmix = get_latest_filtered_mix(db, config.mix_ids)
-	fver = db.newest_version_from_mix(fmix)
-
-	charts = list(chart_set)
-	charts.sort(key=lambda cid: db.chart_sort_key(cid, fver, down=config.down))
-
-	headers = [
-		"CID", # A
-		"SID", # B
-		"GID", # C
-		"Title", # D
-		"Cut", # E
-		"Mode", # F
-		"Difficulty", # G
-		"First Seen", # H
-		"Last Seen", # I
-		"BPM", # J
-		"Category", # K
-		"Stepmaker", # L
-	]
-	headers += config.mixes
-	headers += [
-		"Labels",
-		"Card",
-		"Comment"
-	]
-	m = len(config.mixes)
-	for i in range(len(headers)):
-		ws.cell(row=1, column=i+1, value=headers[i]).font = Font(bold=True)
-	for i, cid in enumerate(charts):
-		sid = db.charts[cid].songId
-
-		game_id = db.song_game_id(sid, fver)
-		if game_id == None: game_id = ""
-
-		first_seen = last_seen = "???"
-		vid = db.chart_introduced(cid)
-		if vid != None:
-			first_seen = db.version_title(vid)
-		vid = db.chart_last_seen(cid)
-		if vid != None:
-			last_seen = db.version_title(vid)
-
-		ws.cell(row=i+2, column=1, value=cid)
-		ws.cell(row=i+2, column=2, value=sid)
-		ws.cell(row=i+2, column=3, value=game_id)
-		ws.cell(row=i+2, column=4, value=db.song_title(sid, fver))
-		ws.cell(row=i+2, column=5, value=db.song_cut_str(sid))
-		ws.cell(row=i+2, column=6, value=db.chart_mode_str(cid, fver))
-		ws.cell(row=i+2, column=7, value=db.chart_difficulty_str(cid, fver))
-		ws.cell(row=i+2, column=8, value=first_seen)
-		ws.cell(row=i+2, column=9, value=last_seen)
-		ws.cell(row=i+2, column=10, value=db.song_bpm_str(sid, fver))
-		ws.cell(row=i+2, column=11, value=db.song_category(sid, fver))
-		ws.cell(row=i+2, column=12, value=str(db.chart_stepmaker(cid)))
-		for j, mid in enumerate(config.mix_ids):
-			ws.cell(row=i+2, column=13+j, value="NY"[db.chart_in_mix(cid, mid)])
-		ws.cell(row=i+2, column=13+m, value=",".join(db.chart_labels(cid, fver)))
-		ws.cell(row=i+2, column=14+m, value=db.song_card(sid, fver))
-		ws.cell(row=i+2, column=15+m, value=db.song_comment(sid, fver))
-
+# Returns a sheet to draw on with random access (ws.cell, merges, borders...)
+# In a write-only workbook this is a detached buffer that must be passed to finish_sheet once it
+# is complete; otherwise it is a regular sheet of wb
+def create_sheet(wb, title):
+	if wb.write_only:
+		return Worksheet(wb, title=title)
+	return wb.create_sheet(title=title)
+
+# Adds a sheet returned by create_sheet to a write-only workbook, streaming its rows in order
+# along with its column widths, panes, merged cells and conditional formatting
+# Does nothing for a regular workbook
+def finish_sheet(wb, buffer):
+	if not wb.write_only:
+		return
+	ws = wb.create_sheet(title=buffer.title)
+	ws.column_dimensions = buffer.column_dimensions
+	ws.row_dimensions = buffer.row_dimensions
+	ws.freeze_panes = buffer.freeze_panes
+	ws.merged_cells = buffer.merged_cells
+	ws.conditional_formatting = buffer.conditional_formatting
+
+	rows = {}
+	for (r, c), cell in buffer._cells.items():
+		rows.setdefault(r, []).append(cell)
+	for r in range(1, max(rows, default=0)+1):
+		row = []
+		for cell in sorted(rows.get(r, []), key=lambda e: e.column):
+			# Both sheets belong to wb, so the style indices can be shared as-is
+			out = WriteOnlyCell(ws)
+			out._value = cell._value
+			out.data_type = cell.data_type
+			out._style = copy(cell._style)
+			while len(row) < cell.column - 1:
+				row.append(None)
+			row.append(out)
+		ws.append(row)
+
+def define_name(wb, name, ref):
+	wb.defined_names[name] = DefinedName(name, attr_text=ref)
+
+# Border sides, as (style, color) for StyleRegistry.border
+SIDE_THIN      = ("thin", None)
+SIDE_THIN_GRAY = ("thin", "777777")
+SIDE_MEDIUM    = ("medium", None)
+SIDE_THICK     = ("thick", None)
+
+# Creates each distinct style object once and hands out the same object to every cell that uses
+# it, instead of building (and having the workbook compare) a new one per cell
+class StyleRegistry:
+	def __init__(self):
+		self.styles = {}
+
+	def get(self, key, create):
+		style = self.styles.get(key)
+		if style == None:
+			style = self.styles[key] = create()
+		return style
+
+	def side(self, spec):
+		if spec == None:
+			return None
+		(style, color) = spec
+		return self.get(("side", spec), lambda: Side(style=style, color=color))
+
+	def border(self, left=None, right=None, top=None, bottom=None):
+		return self.get(("border", left, right, top, bottom), lambda: Border(
+			left=self.side(left), right=self.side(right), top=self.side(top), bottom=self.side(bottom)))
+
+	def fill(self, color):
+		return self.get(("fill", color), lambda: PatternFill("solid", fgColor=color))
+
+	def font(self, bold):
+		return self.get(("font", bold), lambda: Font(bold=bold))
+
+	def alignment(self, horizontal):
+		return self.get(("alignment", horizontal), lambda: Alignment(horizontal=horizontal))
+
+def write_data_sheet(ws, db, chart_set, config, by_cid=False):
+	(headers, rows) = data_sheet_rows(db, chart_set, config, by_cid)
+	# The mix columns sit between the 12 leading and 3 trailing columns
+	m = len(headers) - 15
+
+	# Column widths and panes must be set before any rows are written to a write-only sheet
 	ws.column_dimensions['A'].width = 5
 	ws.column_dimensions['B'].width = 5
 	ws.column_dimensions['C'].width = 5
@@ -134,48 +158,55 @@ def write_data_sheet(ws, db, chart_set, config):
 
 	ws.freeze_panes = 'A2'
 
-def write_score_sheet(ws, db, chart_set, config, scores):
-	latest_filtered_mix = get_latest_filtered_mix(db, config.mix_ids)
-	fver = db.newest_version_from_mix(latest_filtered_mix)
-
-	charts = list(chart_set)
-	charts.sort(key=lambda cid: db.chart_sort_key(cid, fver, down=config.down))
-
-	mixes = config.mix_ids
-	if len(mixes) == 1:
-		mixes = []
-
-	headers = [
-		"CID",           # A
-		"Title",         # B
-		"Cut",           # C
-		"Mode",          # D
-		"Difficulty",    # E
-	]
+	# Rows are appended in order so that this works on both regular and write-only sheets
+	bold = Font(bold=True)
+	header_cells = []
+	for header in headers:
+		cell = WriteOnlyCell(ws, value=header)
+		cell.font = bold
+		header_cells.append(cell)
+	ws.append(header_cells)
+
+	for values in rows:
+		ws.append(values)
+
+# Returns {defined name: column} for the columns of the Scores sheet that the summary sheets
+# aggregate over, as write_score_sheet lays them out when given mix_to_charts
+def score_sheet_columns(config):
+	columns = {}
+	col = 6
+	if config.pad:
+		columns[NAME_SCORES_PASSED % "Pad"] = col
+		columns[NAME_SCORES_GRADE % "Pad"] = col+1
+		columns[NAME_SCORES_MISS % "Pad"] = col+2
+		col += 4
+	if config.keyboard:
+		columns[NAME_SCORES_PASSED % "Kbd"] = col
+		columns[NAME_SCORES_GRADE % "Kbd"] = col+1
+		columns[NAME_SCORES_MISS % "Kbd"] = col+2
+		col += 4
+	if len(config.mix_ids) > 1:
+		col += len(config.mix_ids)
+	# After the History column
+	col += 1
+	for i in range(len(config.mix_ids)):
+		columns[NAME_SUMMARY_KEYS % (i+1)] = col+i
+	return columns
+
+# See score_sheet_rows for lookup and mix_to_charts
+def write_score_sheet(ws, db, chart_set, config, scores, lookup=True, mix_to_charts=None):
+	(headers, key_headers, rows) = score_sheet_rows(db, chart_set, config, lookup, mix_to_charts)
 	if config.pad:
-		col_pad = len(headers) + 1
-		headers += [
-			"Passed (Pad)",  # F
-			"Grade (Pad)",   # G
-			"Miss (Pad)",    # H
-			"Comment (Pad)", # I
-		]
+		col_pad = headers.index(PAD_HEADERS[0]) + 1
 	if config.keyboard:
-		col_kbd = len(headers) + 1
-		headers += [
-			"Passed (Kbd)",  # F J
-			"Grade (Kbd)",   # G K
-			"Miss (Kbd)",    # H L
-			"Comment (Kbd)"  # I M
-		]
-	col_mix = len(headers) + 1
-	headers += [db.mixes[m].title for m in mixes] # F J N
-	col_hist = len(headers) + 1
-	headers += ["History"]
+		col_kbd = headers.index(KBD_HEADERS[0]) + 1
+	# Not part of the headers, so that they are left out of the borders
+	col_keys = len(headers) + 1
 
-	bold = Font(bold=True)
-	gray = PatternFill("solid", fgColor="EEEEEE")
-	dgray = PatternFill("solid", fgColor="CCCCCC")
+	styles = StyleRegistry()
+	bold = styles.font(True)
+	gray = styles.fill("EEEEEE")
+	dgray = styles.fill("CCCCCC")
 
 	border_cols = [5]
 	if config.pad or config.keyboard:
@@ -183,56 +214,62 @@ def write_score_sheet(ws, db, chart_set, config, scores):
 	if config.pad and config.keyboard:
 		border_cols += [13]
 
+	# The border of each column below the header
+	col_borders = []
+	for c in range(1, len(headers)+1):
+		right = None
+		if c == len(headers):
+			right = SIDE_THIN
+		if c in border_cols:
+			right = SIDE_THICK
+		col_borders.append(styles.border(bottom=SIDE_THIN_GRAY, right=right))
+
 	if scores:
 		scores_left = set(scores)
 
-	for i in range(len(headers)):
-		right = None
-		c = ws.cell(row=1, column=i+1, value=headers[i])
+	# Rows are appended whole, so that the native backend can write each one out straight away
+	# Below the header, every column of the headers has its border, and those that the row has a
+	# value for (even None) are filled too; the styles are set up once and shared by the cells of
+	# each column, which aren't restyled afterwards
+	header_border = styles.border(bottom=SIDE_THICK)
+	header_cells = []
+	for header in headers:
+		c = WriteOnlyCell(ws, value=header)
 		c.font = bold
 		c.fill = dgray
-		c.border = Border(bottom=Side(style="thick"), right=right)
-
-	for i, cid in enumerate(charts):
-		ws.cell(row=i+2, column=1, value=cid).fill = dgray
-		ws.cell(row=i+2, column=2, value="=VLOOKUP(A%d, 'Data (Complete)'!A1:O9999, 4, FALSE)" % (i+2)).fill = gray
-		ws.cell(row=i+2, column=3, value="=VLOOKUP(A%d, 'Data (Complete)'!A1:O9999, 5, FALSE)" % (i+2)).fill = gray
-		ws.cell(row=i+2, column=4, value="=VLOOKUP(A%d, 'Data (Complete)'!A1:O9999, 6, FALSE)" % (i+2)).fill = gray
-		ws.cell(row=i+2, column=5, value="=VLOOKUP(A%d, 'Data (Complete)'!A1:O9999, 7, FALSE)" % (i+2)).fill = gray
-
-		for j, mid in enumerate(mixes):
-			ws.cell(row=i+2, column=col_mix+j, value="NY"[db.chart_in_mix(cid, mid)]).fill = gray
-		ws.cell(row=i+2, column=col_mix+len(mixes), value=db.chart_rating_sequence_str(cid, changes_only=True)).fill = gray
-
+		c.border = header_border
+		header_cells.append(c)
+	ws.append(header_cells + key_headers)
+
+	col_styles = {}
+	for c in range(1, col_keys):
+		for filled in (False, True):
+			cell = WriteOnlyCell(ws)
+			if filled:
+				cell.fill = (gray, dgray)[c == 1]
+			cell.border = col_borders[c-1]
+			col_styles[(c, filled)] = cell._style
+
+	for (cid, values) in rows:
+		row = [values.get(col) for col in range(1, max(chain(values, [col_keys-1]))+1)]
 		if scores:
-			if config.pad:
-				key = (cid, True)
-				if key in scores:
+			for (pad, col) in ((True, config.pad and col_pad), (False, config.keyboard and col_kbd)):
+				key = (cid, pad)
+				if col and key in scores:
 					s = scores[key]
-					ws.cell(row=i+2, column=col_pad+0, value=s.passed)
-					ws.cell(row=i+2, column=col_pad+1, value=s.grade)
-					ws.cell(row=i+2, column=col_pad+2, value=s.miss)
-					ws.cell(row=i+2, column=col_pad+3, value=s.comment)
+					for (j, value) in enumerate([s.passed, s.grade, s.miss, s.comment]):
+						if value != None:
+							row[col-1+j] = value
 					scores_left.remove(key)
-			if config.keyboard:
-				key = (cid, False)
-				if key in scores:
-					s = scores[key]
-					ws.cell(row=i+2, column=col_kbd+0, value=s.passed)
-					ws.cell(row=i+2, column=col_kbd+1, value=s.grade)
-					ws.cell(row=i+2, column=col_kbd+2, value=s.miss)
-					ws.cell(row=i+2, column=col_kbd+3, value=s.comment)
-					scores_left.remove(key)
-
-	for c in range(len(headers)):
-		for r in range(len(charts)):
-			right = None
-			if c+1 == len(headers):
-				right = Side(style="thin")
-			if c+1 in border_cols:
-				right = Side(style="thick")
-			border = Border(bottom=Side(style="thin", color="777777"), right=right)
-			ws.cell(row=r+2, column=c+1).border = border
+		for c in range(1, col_keys):
+			cell = WriteOnlyCell(ws)
+			cell._style = col_styles[(c, c in values)]
+			# Dates set their number format in the style, so they get a copy of it
+			if isinstance(row[c-1], TIME_TYPES):
+				cell._style = copy(cell._style)
+			cell.value = row[c-1]
+			row[c-1] = cell
+		ws.append(row)
 
 	ws.column_dimensions['A'].width = 5
 	ws.column_dimensions['B'].width = 30
@@ -252,10 +289,13 @@ def write_score_sheet(ws, db, chart_set, config, scores):
 		ws.column_dimensions[gcl(c+2)].width = 4
 		ws.column_dimensions[gcl(c+3)].width = 20
 		c += 4
-	for i in range(len(mixes)):
-		ws.column_dimensions[gcl(c+i)].width = 2
-	c += len(mixes)
+	while c < len(headers):
+		ws.column_dimensions[gcl(c)].width = 2
+		c += 1
 	ws.column_dimensions[gcl(c)].width = 10 #24
+	for i in range(len(key_headers)):
+		ws.column_dimensions[gcl(col_keys+i)].width = 8
+		ws.column_dimensions[gcl(col_keys+i)].hidden = True
 
 	green = PatternFill("solid", bgColor="44FF44")
 	red = PatternFill("solid", bgColor="FF4444")
@@ -268,33 +308,35 @@ def write_score_sheet(ws, db, chart_set, config, scores):
 	grade_ss = PatternFill("solid", bgColor="FFEE00")
 	grade_sss = PatternFill("solid", bgColor="44FF44")
 
+	# Sized to the rows written, like the lookup ranges (at least one, for an empty sheet)
+	last_row = max(len(chart_set)+1, 2)
 	if config.pad or config.keyboard:
-		ws.conditional_formatting.add('F2:F9999', CellIsRule(operator='equal', formula=['"Y"'], fill=green))
-		ws.conditional_formatting.add('F2:F9999', CellIsRule(operator='equal', formula=['"N"'], fill=red))
+		ws.conditional_formatting.add('F2:F%d' % last_row, CellIsRule(operator='equal', formula=['"Y"'], fill=green))
+		ws.conditional_formatting.add('F2:F%d' % last_row, CellIsRule(operator='equal', formula=['"N"'], fill=red))
 
 	if config.pad and config.keyboard:
-		ws.conditional_formatting.add('J2:J9999', CellIsRule(operator='equal', formula=['"Y"'], fill=green))
-		ws.conditional_formatting.add('J2:J9999', CellIsRule(operator='equal', formula=['"N"'], fill=red))
+		ws.conditional_formatting.add('J2:J%d' % last_row, CellIsRule(operator='equal', formula=['"Y"'], fill=green))
+		ws.conditional_formatting.add('J2:J%d' % last_row, CellIsRule(operator='equal', formula=['"N"'], fill=red))
 
 	if config.pad or config.keyboard:
-		ws.conditional_formatting.add('G2:G9999', CellIsRule(operator='equal', formula=['"SSS"'], fill=grade_sss))
-		ws.conditional_formatting.add('G2:G9999', CellIsRule(operator='equal', formula=['"SS"'], fill=grade_ss))
-		ws.conditional_formatting.add('G2:G9999', CellIsRule(operator='equal', formula=['"S"'], fill=grade_s))
-		ws.conditional_formatting.add('G2:G9999', CellIsRule(operator='equal', formula=['"A"'], fill=grade_a))
-		ws.conditional_formatting.add('G2:G9999', CellIsRule(operator='equal', formula=['"B"'], fill=grade_b))
-		ws.conditional_formatting.add('G2:G9999', CellIsRule(operator='equal', formula=['"C"'], fill=grade_c))
-		ws.conditional_formatting.add('G2:G9999', CellIsRule(operator='equal', formula=['"D"'], fill=grade_d))
-		ws.conditional_formatting.add('G2:G9999', CellIsRule(operator='equal', formula=['"F"'], fill=grade_f))
+		ws.conditional_formatting.add('G2:G%d' % last_row, CellIsRule(operator='equal', formula=['"SSS"'], fill=grade_sss))
+		ws.conditional_formatting.add('G2:G%d' % last_row, CellIsRule(operator='equal', formula=['"SS"'], fill=grade_ss))
+		ws.conditional_formatting.add('G2:G%d' % last_row, CellIsRule(operator='equal', formula=['"S"'], fill=grade_s))
+		ws.conditional_formatting.add('G2:G%d' % last_row, CellIsRule(operator='equal', formula=['"A"'], fill=grade_a))
+		ws.conditional_formatting.add('G2:G%d' % last_row, CellIsRule(operator='equal', formula=['"B"'], fill=grade_b))
+		ws.conditional_formatting.add('G2:G%d' % last_row, CellIsRule(operator='equal', formula=['"C"'], fill=grade_c))
+		ws.conditional_formatting.add('G2:G%d' % last_row, CellIsRule(operator='equal', formula=['"D"'], fill=grade_d))
+		ws.conditional_formatting.add('G2:G%d' % last_row, CellIsRule(operator='equal', formula=['"F"'], fill=grade_f))
 
 	if config.pad and config.keyboard:
-		ws.conditional_formatting.add('K2:K9999', CellIsRule(operator='equal', formula=['"SSS"'], fill=grade_sss))
-		ws.conditional_formatting.add('K2:K9999', CellIsRule(operator='equal', formula=['"SS"'], fill=grade_ss))
-		ws.conditional_formatting.add('K2:K9999', CellIsRule(operator='equal', formula=['"S"'], fill=grade_s))
-		ws.conditional_formatting.add('K2:K9999', CellIsRule(operator='equal', formula=['"A"'], fill=grade_a))
-		ws.conditional_formatting.add('K2:K9999', CellIsRule(operator='equal', formula=['"B"'], fill=grade_b))
-		ws.conditional_formatting.add('K2:K9999', CellIsRule(operator='equal', formula=['"C"'], fill=grade_c))
-		ws.conditional_formatting.add('K2:K9999', CellIsRule(operator='equal', formula=['"D"'], fill=grade_d))
-		ws.conditional_formatting.add('K2:K9999', CellIsRule(operator='equal', formula=['"F"'], fill=grade_f))
+		ws.conditional_formatting.add('K2:K%d' % last_row, CellIsRule(operator='equal', formula=['"SSS"'], fill=grade_sss))
+		ws.conditional_formatting.add('K2:K%d' % last_row, CellIsRule(operator='equal', formula=['"SS"'], fill=grade_ss))
+		ws.conditional_formatting.add('K2:K%d' % last_row, CellIsRule(operator='equal', formula=['"S"'], fill=grade_s))
+		ws.conditional_formatting.add('K2:K%d' % last_row, CellIsRule(operator='equal', formula=['"A"'], fill=grade_a))
+		ws.conditional_formatting.add('K2:K%d' % last_row, CellIsRule(operator='equal', formula=['"B"'], fill=grade_b))
+		ws.conditional_formatting.add('K2:K%d' % last_row, CellIsRule(operator='equal', formula=['"C"'], fill=grade_c))
+		ws.conditional_formatting.add('K2:K%d' % last_row, CellIsRule(operator='equal', formula=['"D"'], fill=grade_d))
+		ws.conditional_formatting.add('K2:K%d' % last_row, CellIsRule(operator='equal', formula=['"F"'], fill=grade_f))
 
 	ws.freeze_panes = 'C2'
 
@@ -322,11 +364,40 @@ def write_score_sheet(ws, db, chart_set, config, scores):
 
 			print("WARNING: New sheet does not contain a %s entry for CID=%d: %s %s" % (etype, scores[s].cid, title, rstr))
 
+# The kinds of row in a table of a summary sheet
+SUMMARY_TITLE  = 0
+SUMMARY_HEADER = 1
+SUMMARY_ROW    = 2
+
+# Returns the border of the cell in the given column (1-15) of a summary table row, where last is
+# True for the last SUMMARY_ROW of the table
+def summary_border(styles, kind, column, last=False):
+	left = right = top = bottom = None
+	if kind == SUMMARY_TITLE:
+		top = SIDE_MEDIUM
+		if column == 1:
+			(left, right) = (SIDE_MEDIUM, SIDE_MEDIUM)
+	else:
+		if kind == SUMMARY_HEADER:
+			top = bottom = SIDE_THIN
+		if column == 1:
+			(left, right) = (SIDE_MEDIUM, SIDE_THIN)
+		if column == 4 or column == 12:
+			right = SIDE_THIN
+		if last:
+			bottom = SIDE_MEDIUM
+	if column == 15:
+		right = SIDE_MEDIUM
+	return styles.border(left=left, right=right, top=top, bottom=bottom)
+
 def write_summary_sheet(ws, db, chart_set, config, mixId, pad):
 	table_names = ["Single + Single Performance", "Double + Double Performance", "Half-Double", "Routine", "Co-Op"]
 	table_colors = ["ff2211", "11dd22", "cc0066", "23a98d", "f2c219"]
 	table_headers = ["Passed", "Failed", "Unplayed", "SSS", "SS", "S", "A", "B", "C", "D", "F", "Low Miss", "High Miss", "Avg Miss"]
-	gray = PatternFill("solid", fgColor="eeece1")
+	styles = StyleRegistry()
+	gray = styles.fill("eeece1")
+	bold = styles.font(True)
+	center = styles.alignment("center")
 
 	def difficulty_sort_key(d):
 		if d == None:
@@ -342,269 +413,86 @@ def write_summary_sheet(ws, db, chart_set, config, mixId, pad):
 
 	table = []
 	for cid in chart_set:
-		ver = db.chart_version_in_mix(cid, mixId)
-
-		mode_title = db.chart_mode_str(cid, ver)
-		if mode_title == None: continue
-		mode_title = mode_title.lower()
-
-		table_num = -1
-		if mode_title.startswith("single"):
-			table_num = 0
-		elif mode_title.startswith("double"):
-			table_num = 1
-		elif mode_title.startswith("half"):
-			table_num = 2
-		elif mode_title.startswith("routine"):
-			table_num = 3
-		elif mode_title.startswith("co"):
-			table_num = 4
-		if table_num == -1: continue
-
-		difficulty = db.chart_difficulty(cid, ver)
-
-		table.append((table_num, difficulty_sort_key(difficulty), difficulty, cid))
-
+		group = summary_group(db, cid, mixId)
+		if group == None: continue
+		(table_num, difficulty) = group
+		table.append((table_num, difficulty_sort_key(difficulty), difficulty))
 	table.sort()
-	table.append((None, None, None, None))
 
-	ws.cell(row=1, column=17, value="CID")
-	ws.cell(row=1, column=18, value="T")
-	ws.cell(row=1, column=19, value="D")
-	ws.cell(row=1, column=20, value="Pass")
-	ws.cell(row=1, column=21, value="Grade")
-	ws.cell(row=1, column=22, value="Miss")
+	# One [table number, difficulty, number of charts] per row of the tables
+	rows = []
+	for (mode, _, diff) in table:
+		if rows and rows[-1][0] == mode and rows[-1][1] == diff:
+			rows[-1][2] += 1
+		else:
+			rows.append([mode, diff, 1])
+
+	# The formulas aggregate the player's scores straight from the Scores sheet, over the charts
+	# whose summary key for this mix matches the row
+	keys = NAME_SUMMARY_KEYS % (config.mix_ids.index(mixId) + 1)
+	prefix = ("Kbd","Pad")[pad]
+	passed = NAME_SCORES_PASSED % prefix
+	grade = NAME_SCORES_GRADE % prefix
+	miss = NAME_SCORES_MISS % prefix
 
-	last_mode = last_diff = -1
-	start_row = end_row = -1
 	main_row = 1
-
-	score_col = 6
-	if not pad and config.pad:
-		score_col = 10
-
-	for r, (mode, _, diff, cid) in enumerate(table):
-		# Add an entry to the hidden lookup table
-		if mode != None:
-			ws.cell(row=r+2, column=17, value=cid)
-			ws.cell(row=r+2, column=18, value=mode)
-			ws.cell(row=r+2, column=19, value=difficulty_name(diff))
-			ws.cell(row=r+2, column=20, value='=IF(VLOOKUP(Q%d, Scores!$A$2:$M$9999, %d, FALSE)="", "", UPPER(VLOOKUP(Q%d, Scores!$A$2:$M$9999, %d, FALSE)))' % (r+2, score_col+0, r+2, score_col+0))
-			ws.cell(row=r+2, column=21, value='=IF(VLOOKUP(Q%d, Scores!$A$2:$M$9999, %d, FALSE)="", "", UPPER(VLOOKUP(Q%d, Scores!$A$2:$M$9999, %d, FALSE)))' % (r+2, score_col+1, r+2, score_col+1))
-			ws.cell(row=r+2, column=22, value='=IF(VLOOKUP(Q%d, Scores!$A$2:$M$9999, %d, FALSE)="", "", VLOOKUP(Q%d, Scores!$A$2:$M$9999, %d, FALSE))' % (r+2, score_col+2, r+2, score_col+2))
-
-		# If there is a previous row...
-		if last_mode != -1:
-			# Finish writing the previous row
-			if last_diff != diff or last_mode != mode:
-				end_row = r+1
-				ws.cell(row=main_row-1, column=2,  value='=COUNTIF(T%d:T%d, "Y")' % (start_row, end_row))
-				ws.cell(row=main_row-1, column=3,  value='=COUNTIF(T%d:T%d, "N")' % (start_row, end_row))
-				ws.cell(row=main_row-1, column=4,  value='=(%d-%d+1) - B%d - C%d' % (end_row, start_row, main_row-1, main_row-1))
-				ws.cell(row=main_row-1, column=5,  value='=IF(COUNTIF(U%d:U%d, "SSS")<>0,COUNTIF(U%d:U%d, "SSS"),"")' % (start_row, end_row, start_row, end_row))
-				ws.cell(row=main_row-1, column=6,  value='=IF(COUNTIF(U%d:U%d, "SS")<>0,COUNTIF(U%d:U%d, "SS"),"")' % (start_row, end_row, start_row, end_row))
-				ws.cell(row=main_row-1, column=7,  value='=IF(COUNTIF(U%d:U%d, "S")<>0,COUNTIF(U%d:U%d, "S"),"")' % (start_row, end_row, start_row, end_row))
-				ws.cell(row=main_row-1, column=8,  value='=IF(COUNTIF(U%d:U%d, "A")<>0,COUNTIF(U%d:U%d, "A"),"")' % (start_row, end_row, start_row, end_row))
-				ws.cell(row=main_row-1, column=9,  value='=IF(COUNTIF(U%d:U%d, "B")<>0,COUNTIF(U%d:U%d, "B"),"")' % (start_row, end_row, start_row, end_row))
-				ws.cell(row=main_row-1, column=10, value='=IF(COUNTIF(U%d:U%d, "C")<>0,COUNTIF(U%d:U%d, "C"),"")' % (start_row, end_row, start_row, end_row))
-				ws.cell(row=main_row-1, column=11, value='=IF(COUNTIF(U%d:U%d, "D")<>0,COUNTIF(U%d:U%d, "D"),"")' % (start_row, end_row, start_row, end_row))
-				ws.cell(row=main_row-1, column=12, value='=IF(COUNTIF(U%d:U%d, "F")<>0,COUNTIF(U%d:U%d, "F"),"")' % (start_row, end_row, start_row, end_row))
-				ws.cell(row=main_row-1, column=13, value='=IF(SUMPRODUCT(--(V%d:V%d<>""))=0,"",MIN(V%d:V%d))' % (start_row, end_row, start_row, end_row))
-				ws.cell(row=main_row-1, column=14, value='=IF(SUMPRODUCT(--(V%d:V%d<>""))=0,"",MAX(V%d:V%d))' % (start_row, end_row, start_row, end_row))
-				ws.cell(row=main_row-1, column=15, value='=IF(SUMPRODUCT(--(V%d:V%d<>""))=0,"",AVERAGE(V%d:V%d))' % (start_row, end_row, start_row, end_row))
-
-			# Finish the table
-			if last_mode != mode:
-				for i in range(15):
-					add_border(ws, main_row-1, i+1, bottom=Side(style="medium"))
-				main_row += 1
-
-		# If this is a new entry...
-		if mode != None:
-			# Draw the header of a new table
-			if last_mode != mode:
-				ws.merge_cells("A%d:O%d" % (main_row, main_row))
-				ws.cell(row=main_row, column=1, value=table_names[mode])
-				ws.cell(row=main_row, column=1).alignment = Alignment(horizontal='center')
-				ws.cell(row=main_row, column=1).font = Font(bold=True)
-				ws.cell(row=main_row, column=1).fill = PatternFill("solid", fgColor=table_colors[mode])
-				for i, header in enumerate(table_headers):
-					ws.cell(row=main_row+1, column=i+2, value=header)
-					ws.cell(row=main_row+1, column=i+2).alignment = Alignment(horizontal='center')
-					ws.cell(row=main_row+1, column=i+2).font = Font(bold=True)
-					ws.cell(row=main_row+1, column=i+2).fill = gray
-				for i in range(15):
-					add_border(ws, main_row,   i+1, top=Side(style="medium"))
-					add_border(ws, main_row+1, i+1, top=Side(style="thin"), bottom=Side(style="thin"))
-				add_border(ws, main_row,   1, left=Side(style="medium"), right=Side(style="medium"))
-				add_border(ws, main_row+1, 1, left=Side(style="medium"), right=Side(style="thin"))
-				add_border(ws, main_row+1, 4, right=Side(style="thin"))
-				add_border(ws, main_row+1, 12, right=Side(style="thin"))
-				add_border(ws, main_row,   15, right=Side(style="medium"))
-				add_border(ws, main_row+1, 15, right=Side(style="medium"))
-				main_row += 2
-
-			# Draw the next row
-			if last_mode != mode or last_diff != diff:
-				ws.cell(row=main_row, column=1, value=difficulty_name(diff))
-				ws.cell(row=main_row, column=1).font = Font(bold=True)
-				ws.cell(row=main_row, column=1).fill = gray
-				add_border(ws, main_row, 1, right=Side(style="thin"), left=Side(style="medium"))
-				add_border(ws, main_row, 4, right=Side(style="thin"))
-				add_border(ws, main_row, 12, right=Side(style="thin"))
-				add_border(ws, main_row, 15, right=Side(style="medium"))
-				for i in range(15):
-					ws.cell(row=main_row, column=i+1).alignment = Alignment(horizontal='center')
-				start_row = r+2
-				main_row += 1
-
-		(last_mode, last_diff) = (mode, diff)
-
-	widths = [3, 7, 7, 9, 4, 4, 4, 4, 4, 4, 4, 4, 9, 10, 9, 8, 5, 2, 3, 5, 6, 5]
+	for i, (mode, diff, count) in enumerate(rows):
+		# Draw the header of a new table
+		if i == 0 or rows[i-1][0] != mode:
+			ws.merge_cells("A%d:O%d" % (main_row, main_row))
+			ws.cell(row=main_row, column=1, value=table_names[mode])
+			ws.cell(row=main_row, column=1).alignment = center
+			ws.cell(row=main_row, column=1).font = bold
+			ws.cell(row=main_row, column=1).fill = styles.fill(table_colors[mode])
+			for j, header in enumerate(table_headers):
+				ws.cell(row=main_row+1, column=j+2, value=header)
+				ws.cell(row=main_row+1, column=j+2).alignment = center
+				ws.cell(row=main_row+1, column=j+2).font = bold
+				ws.cell(row=main_row+1, column=j+2).fill = gray
+			for j in range(15):
+				ws.cell(row=main_row,   column=j+1).border = summary_border(styles, SUMMARY_TITLE, j+1)
+				ws.cell(row=main_row+1, column=j+1).border = summary_border(styles, SUMMARY_HEADER, j+1)
+			main_row += 2
+
+		key = summary_key(mode, diff)
+		ws.cell(row=main_row, column=1, value=difficulty_name(diff))
+		ws.cell(row=main_row, column=1).font = bold
+		ws.cell(row=main_row, column=1).fill = gray
+		ws.cell(row=main_row, column=2, value='=COUNTIFS(%s, "%s", %s, "Y")' % (keys, key, passed))
+		ws.cell(row=main_row, column=3, value='=COUNTIFS(%s, "%s", %s, "N")' % (keys, key, passed))
+		ws.cell(row=main_row, column=4, value='=%d - B%d - C%d' % (count, main_row, main_row))
+		for j, g in enumerate(["SSS", "SS", "S", "A", "B", "C", "D", "F"]):
+			count_grade = 'COUNTIFS(%s, "%s", %s, "%s")' % (keys, key, grade, g)
+			ws.cell(row=main_row, column=5+j, value='=IF(%s<>0,%s,"")' % (count_grade, count_grade))
+		count_miss = 'COUNTIFS(%s, "%s", %s, "<>")' % (keys, key, miss)
+		# AGGREGATE (SMALL/LARGE, ignoring errors) over misses divided by zero outside this key or
+		# where blank, since MINIFS/MAXIFS show #NAME? before Excel 2019
+		key_misses = '%s/((%s="%s")*(%s<>""))' % (miss, keys, key, miss)
+		ws.cell(row=main_row, column=13, value='=IF(%s=0,"",_xlfn.AGGREGATE(15,6,%s,1))' % (count_miss, key_misses))
+		ws.cell(row=main_row, column=14, value='=IF(%s=0,"",_xlfn.AGGREGATE(14,6,%s,1))' % (count_miss, key_misses))
+		ws.cell(row=main_row, column=15, value='=IF(%s=0,"",AVERAGEIFS(%s, %s, "%s"))' % (count_miss, miss, keys, key))
+
+		last = i+1 == len(rows) or rows[i+1][0] != mode
+		for j in range(15):
+			ws.cell(row=main_row, column=j+1).alignment = center
+			ws.cell(row=main_row, column=j+1).border = summary_border(styles, SUMMARY_ROW, j+1, last)
+		main_row += 1
+
+		# Leave a blank row after each table
+		if last:
+			main_row += 1
+
+	widths = [3, 7, 7, 9, 4, 4, 4, 4, 4, 4, 4, 4, 9, 10, 9]
 	for i, w in enumerate(widths):
 		ws.column_dimensions[gcl(i+1)].width = w
 
-	for col in "QRSTUV":
-		ws.column_dimensions[col].hidden = True
-
-class Score:
-	def __init__(self, cid, pad, passed, grade, miss, comment):
-		self.cid = cid
-		self.pad = pad
-		self.passed = passed
-		self.grade = grade
-		self.miss = miss
-		self.comment = comment
-
-	def empty(self):
-		return not self.passed and not self.grade and not self.miss and not self.comment
-
-def read_scores(frompath):
-	wb = load_workbook(filename=frompath)
-	if not "Scores" in wb.sheetnames:
-		raise Exception("Old scores spreadsheet doesn't contain a sheet named 'Scores'. Did you rename it?")
-	ws = wb["Scores"]
-
-	pad_headers = ["Passed (Pad)", "Grade (Pad)", "Miss (Pad)", "Comment (Pad)"]
-	kbd_headers = ["Passed (Kbd)", "Grade (Kbd)", "Miss (Kbd)", "Comment (Kbd)"]
-	pad_cols = {}
-	kbd_cols = {}
-	cid_col = None
-
-	for c in range(1, ws.max_column+1):
-		val = ws.cell(row=1, column=c).value
-		if val in pad_headers:
-			i = pad_headers.index(val)
-			pad_cols[i] = c
-		if val in kbd_headers:
-			i = kbd_headers.index(val)
-			kbd_cols[i] = c
-		if val == "CID":
-			cid_col = c
-
-	if c == None:
-		raise Exception("Old 'Scores' sheet doesn't contain a column named 'CID'. Did you rename it?")
-
-	if pad_cols:
-		for i in range(4):
-			if not i in pad_cols:
-				print("WARNING: Pad scores available but column '%s' is missing" % pad_headers[i])
-	if kbd_cols:
-		for i in range(4):
-			if not i in kbd_cols:
-				print("WARNING: Keyboard scores available but column '%s' is missing" % kbd_headers[i])
-
-	scores = {}
-	for r in range(2, ws.max_row+1):
-		cid = ws.cell(row=r, column=cid_col).value
-		if pad_cols:
-			passed = grade = miss = comment = None
-			if 0 in pad_cols: passed  = ws.cell(row=r, column=pad_cols[0]).value
-			if 1 in pad_cols: grade   = ws.cell(row=r, column=pad_cols[1]).value
-			if 2 in pad_cols: miss    = ws.cell(row=r, column=pad_cols[2]).value
-			if 3 in pad_cols: comment = ws.cell(row=r, column=pad_cols[3]).value
-			s = Score(cid, True, passed, grade, miss, comment)
-			if not s.empty():
-				scores[(cid, True)] = s
-		if kbd_cols:
-			passed = grade = miss = comment = None
-			if 0 in kbd_cols: passed  = ws.cell(row=r, column=kbd_cols[0]).value
-			if 1 in kbd_cols: grade   = ws.cell(row=r, column=kbd_cols[1]).value
-			if 2 in kbd_cols: miss    = ws.cell(row=r, column=kbd_cols[2]).value
-			if 3 in kbd_cols: comment = ws.cell(row=r, column=kbd_cols[3]).value
-			s = Score(cid, False, passed, grade, miss, comment)
-			if not s.empty():
-				scores[(cid, False)] = s
-	return scores
-
-def generate_xlsx(dbpath, outpath, configpath, frompath):
-	print("Reading config file...")
-	config = parse_config(configpath)
-
-	print("Reading database file...")
-	db = read_database(dbpath)
-
-	config.mix_ids = titles_to_ids(config.mixes, db.mixes, "mix")
-	config.mode_ids = titles_to_ids(config.modes, db.modes, "mode")
-
-	mix_to_charts = {}
-	all_filtered_charts = set()
-	for mid in config.mix_ids:
-		charts = set()
-		for cid in db.charts.keys():
-			ver = db.chart_version_in_mix(cid, mid)
-			if ver != None:
-				rating = db.chart_rating(cid, ver)
-				if rating != None and rating.mode in config.mode_ids:
-					diff = rating.difficulty
-					if diff == None and config.unrated:
-						charts.add(cid)
-						continue
-					if diff != None and (diff >= config.diff_min and diff <= config.diff_max):
-						charts.add(cid)
-						continue
-		mix_to_charts[mid] = charts
-		all_filtered_charts |= charts
-
-	scores = None
-	if frompath:
-		print("Reading old scores...")
-		scores = read_scores(frompath)
-
-	print("Creating score sheet...")
-	wb = Workbook()
-	ws_scores = wb.active
-	ws_scores.title = "Scores"
-	write_score_sheet(ws_scores, db, all_filtered_charts, config, scores)
-
-	INVALID_TITLE_REGEX = re.compile(r'[\\*?:/\[\]]')
-	for ispad in (True, False):
-		if ispad == True and not config.pad: continue
-		if ispad == False and not config.keyboard: continue
-		short_name = ("Kbd","Pad")[ispad]
-		for mid in config.mix_ids:
-			print("Creating summary sheet (%s, %s)..." % (short_name, db.mixes[mid].title))
-			tab_title = "Summary (%s) %s" % (short_name, db.mixes[mid].title)
-			tab_title = INVALID_TITLE_REGEX.sub("", tab_title)
-			tab_title = tab_title[:31]
-			ws_summary = wb.create_sheet(title=tab_title)
-			write_summary_sheet(ws_summary, db, mix_to_charts[mid], config, mid, ispad)
-
-	print("Creating data sheet...")
-	ws_dump = wb.create_sheet(title="Data")
-	write_data_sheet(ws_dump, db, all_filtered_charts, config)
-
-	print("Creating complete data sheet...")
-	ws_dump = wb.create_sheet(title="Data (Complete)")
-	write_data_sheet(ws_dump, db, set(db.charts), None)
-
-	print("Creating about sheet...")
+# The player's name is kept from the sheet being updated, if any
+def write_about_sheet(ws_marker, db, dbpath, config, player=None):
 	options = []
 	if config.pad: options += ["+Pad"]
 	if config.keyboard: options += ["+Keyboard"]
 
 	bold = Font(bold=True)
-	ws_marker = wb.create_sheet(title="About")
 	ws_marker.cell(row=1, column=1, value="Database Name:").font = bold
 	ws_marker.cell(row=1, column=2, value=dbpath)
 	ws_marker.cell(row=2, column=1, value="Latest Mix in Database:").font = bold
@@ -615,7 +503,7 @@ def generate_xlsx(dbpath, outpath, configpath, frompath):
 	ws_marker.cell(row=4, column=2, value="v0.5")
 
 	ws_marker.cell(row=6, column=1, value="Player:").font = bold
-	ws_marker.cell(row=6, column=2, value="[YOUR NAME HERE]").font = bold
+	ws_marker.cell(row=6, column=2, value=(player, "[YOUR NAME HERE]")[player == None]).font = bold
 	ws_marker.cell(row=7, column=1, value="Mixes:").font = bold
 	ws_marker.cell(row=7, column=2, value=", ".join(config.mixes))
 	ws_marker.cell(row=8, column=1, value="Modes:").font = bold
@@ -627,34 +515,416 @@ def generate_xlsx(dbpath, outpath, configpath, frompath):
 	
 	adjust_column_widths(ws_marker, range(1,2+1), range(1,10+1))
 
+# If sql_filter is True, the charts are filtered by SQLite while the database is read, and nothing
+# else is loaded (so the Data (Complete) sheet only lists the charts that pass the filter)
+# If stream is True, the workbook is written in write-only mode: the data sheets are streamed to
+# disk row by row, and the other sheets are buffered one at a time
+# If workers is more than 1, the sheets are rendered in that many worker processes (see sheet_pool)
+# The backend is one of ALL_BACKENDS; the native one supports neither stream nor workers
+# If static is True, the title/cut/mode/difficulty columns of the score sheet hold values instead
+# of lookups into the Data (Complete) sheet (as they do anyway when that sheet isn't created)
+# If update is True, outpath is an existing spreadsheet to bring up to date: its scores are kept,
+# the sheets that haven't changed are copied as they are (see plan_update), and so are the sheets
+# that generate.py doesn't create
+# Each step is a stage of profile (see profiling)
+def generate_xlsx(dbpath, outpath, configpath, frompath, cachedir=None, cache_size=DEFAULT_CACHE_SIZE, sheets=ALL_SHEETS, sql_filter=False, stream=False, workers=1, backend=BACKEND_OPENPYXL, static=False, update=False, profile=NO_PROFILE):
+	print("Reading config file...")
+	with profile.stage("config"):
+		config = parse_config(configpath)
+
+	chart_filter = (None, config)[sql_filter]
+	db = load_database(dbpath, cachedir, cache_size, sheets, chart_filter, profile)
+
+	with profile.stage("filter_charts") as stage:
+		config.mix_ids = titles_to_ids(config.mixes, db.mixes, "mix")
+		config.mode_ids = titles_to_ids(config.modes, db.modes, "mode")
+		(mix_to_charts, all_filtered_charts) = filter_charts(db, config)
+		stage.count(len(all_filtered_charts))
+
+	create_xlsx(db, dbpath, outpath, config, frompath, mix_to_charts, all_filtered_charts, sheets, stream, workers, backend, static, update, profile)
+
+# Creates the spreadsheet from a loaded database and a config whose mix and mode ids are set,
+# with the charts that filter_charts returns for it (see generate_xlsx for the other arguments)
+def create_xlsx(db, dbpath, outpath, config, frompath, mix_to_charts, all_filtered_charts, sheets=ALL_SHEETS, stream=False, workers=1, backend=BACKEND_OPENPYXL, static=False, update=False, profile=NO_PROFILE):
+	scores = None
+	if update:
+		frompath = outpath
+	if frompath:
+		print("Reading old scores...")
+		with profile.stage("read_scores") as stage:
+			scores = read_scores(frompath)
+			stage.count(len(scores))
+
+	if backend == BACKEND_NATIVE:
+		wb = xlsx_writer.Workbook()
+	else:
+		wb = Workbook(write_only=stream)
+		if not stream:
+			wb.remove(wb.active)
+
+	# Each job is (sheet title, sheet kind, arguments...), in the order the sheets appear
+	jobs = []
+	if SHEET_SCORES in sheets:
+		jobs.append(("Scores", SHEET_SCORES))
+
+	INVALID_TITLE_REGEX = re.compile(r'[\\*?:/\[\]]')
+	for ispad in (True, False):
+		if ispad == True and not config.pad: continue
+		if ispad == False and not config.keyboard: continue
+		if not SHEET_SUMMARY in sheets: continue
+		short_name = ("Kbd","Pad")[ispad]
+		for mid in config.mix_ids:
+			tab_title = "Summary (%s) %s" % (short_name, db.mixes[mid].title)
+			tab_title = INVALID_TITLE_REGEX.sub("", tab_title)
+			tab_title = tab_title[:31]
+			jobs.append((tab_title, SHEET_SUMMARY, mid, ispad))
+
+	if SHEET_DATA in sheets:
+		jobs.append(("Data", SHEET_DATA))
+	if SHEET_COMPLETE in sheets:
+		jobs.append(("Data (Complete)", SHEET_COMPLETE))
+
+	# Name the lookup ranges, sized to the rows each sheet will have (at least one, for an empty sheet)
+	lookup = SHEET_COMPLETE in sheets and not static
+	if lookup:
+		define_name(wb, NAME_COMPLETE, "'Data (Complete)'!$A$2:$G$%d" % max(len(db.charts)+1, 2))
+	if SHEET_SUMMARY in sheets:
+		scores_rows = max(len(all_filtered_charts)+1, 2)
+		for (name, col) in score_sheet_columns(config).items():
+			define_name(wb, name, "Scores!$%s$2:$%s$%d" % (gcl(col), gcl(col), scores_rows))
+
+	state = (db, config, scores, all_filtered_charts, mix_to_charts, lookup, SHEET_SUMMARY in sheets)
+
+	old = None
+	copied = []
+	player = None
+	if update:
+		old = OldWorkbook(outpath)
+		plan = None
+		try:
+			with profile.stage("compare"):
+				plan = plan_update(old, jobs, state, sheets, dbpath)
+		finally:
+			if plan == None:
+				old.close()
+		if plan == None:
+			return
+		(copied, player) = plan
+		for (name, formula) in old.defined_names():
+			if not name in wb.defined_names:
+				define_name(wb, name, formula)
+	kept = set(sheet.title for sheet in copied)
+
+	rendered = []
+	if workers > 1:
+		rendered_jobs = [job for job in jobs if not job[0] in kept]
+		print("Creating %d sheets in %d processes..." % (len(rendered_jobs), workers))
+		# Start the biggest sheets first so that they don't end up running last on their own
+		biggest_first = [SHEET_COMPLETE, SHEET_SCORES, SHEET_DATA, SHEET_SUMMARY]
+		# Sorted once here, for the workers to share instead of each sorting the charts again
+		if SHEET_SCORES in sheets or SHEET_DATA in sheets:
+			db.sorted_charts(db.newest_version_from_mix(get_latest_filtered_mix(db, config.mix_ids)), config.down)
+		# Likewise for the lifetimes that both data sheets list
+		if SHEET_DATA in sheets or SHEET_COMPLETE in sheets:
+			db.chart_lifetimes()
+		with profile.stage("sheets"):
+			rendered = render_sheets(sorted(rendered_jobs, key=lambda job: biggest_first.index(job[1])), render_sheet, state, workers)
+			for sheet in rendered:
+				profile.add(sheet.title, sheet.stage)
+		# Leave empty sheets in place of the rendered ones, to be replaced when saving
+		for job in jobs:
+			wb.create_sheet(title=job[0])
+	else:
+		with profile.stage("sheets"):
+			for job in jobs:
+				# Left empty, to be replaced with the old sheet when saving
+				if job[0] in kept:
+					wb.create_sheet(title=job[0])
+					continue
+				print("Creating sheet %s..." % job[0])
+				with profile.stage(job[0]) as stage:
+					# The data sheets are written in order, so they can go straight to a write-only sheet
+					if job[1] in (SHEET_DATA, SHEET_COMPLETE):
+						ws = wb.create_sheet(title=job[0])
+						render_sheet(ws, job, state)
+					else:
+						ws = create_sheet(wb, job[0])
+						render_sheet(ws, job, state)
+						finish_sheet(wb, ws)
+					if profile.enabled:
+						stage.count(*sheet_size(ws))
+
+	if SHEET_ABOUT in sheets:
+		print("Creating about sheet...")
+		with profile.stage("about"):
+			ws_about = create_sheet(wb, "About")
+			write_about_sheet(ws_about, db, dbpath, config, player)
+			finish_sheet(wb, ws_about)
+
+	# The sheets that generate.py doesn't create go last
+	for sheet in copied:
+		if not sheet.title in wb.sheetnames:
+			wb.create_sheet(title=sheet.title)
+
 	print("Saving workbook...")
-	wb.save(outpath)
-	wb.close()
+	if update:
+		old.close()
+		# The old workbook is only replaced once the new one is complete
+		fd, savepath = tempfile.mkstemp(suffix=".xlsx", dir=os.path.dirname(os.path.abspath(outpath)))
+		os.close(fd)
+	else:
+		savepath = outpath
+	try:
+		with profile.stage("save"):
+			if rendered or copied:
+				save_with_sheets(wb, savepath, rendered + copied)
+			else:
+				wb.save(savepath)
+			wb.close()
+		if update:
+			os.replace(savepath, outpath)
+	finally:
+		if update and os.path.exists(savepath):
+			os.remove(savepath)
+
+# Returns (rows, cells) of a sheet that has been drawn, for profiling; a write-only sheet doesn't
+# keep track of either, so they're given as None
+def sheet_size(ws):
+	if isinstance(ws, xlsx_writer.Worksheet):
+		return (ws.max_row, ws._cell_count)
+	if isinstance(ws, WriteOnlyWorksheet):
+		return (None, None)
+	return (ws.max_row, len(ws._cells))
+
+# Returns the rows that render_sheet draws for a job, as (row number, {column number: value}) in
+# order, and wanted(row number, column number), which is False for the cells that an update
+# leaves to the user (the scores)
+def job_rows(job, state):
+	(db, config, scores, all_filtered_charts, mix_to_charts, lookup, summary) = state
+	kind = job[1]
+	if kind == SHEET_SCORES:
+		(headers, key_headers, rows) = score_sheet_rows(db, all_filtered_charts, config, lookup, (None, mix_to_charts)[summary])
+		score_cols = set(i+1 for (i, header) in enumerate(headers) if header in PAD_HEADERS or header in KBD_HEADERS)
+		header = dict(enumerate(headers + key_headers, 1))
+		rows = ((i+2, values) for (i, (cid, values)) in enumerate(rows))
+		return (chain([(1, header)], rows), lambda r, c: r == 1 or not c in score_cols)
+	if kind in (SHEET_DATA, SHEET_COMPLETE):
+		if kind == SHEET_DATA:
+			(headers, rows) = data_sheet_rows(db, all_filtered_charts, config)
+		else:
+			(headers, rows) = data_sheet_rows(db, set(db.charts), None, by_cid=True)
+		rows = ((i+1, dict(enumerate(values, 1))) for (i, values) in enumerate(chain([headers], rows)))
+		return (rows, lambda r, c: True)
+	# The summary sheets are small enough to be drawn to find out
+	ws = xlsx_writer.Workbook().create_sheet(job[0])
+	render_sheet(ws, job, state)
+	return (drawn_rows(ws), lambda r, c: True)
+
+# Returns the rows of a native worksheet, as (row number, {column number: value}) in order
+def drawn_rows(ws):
+	rows = {}
+	for ((r, c), (value, style_id)) in ws._cells.items():
+		rows.setdefault(r, {})[c] = value
+	return sorted(rows.items())
+
+# Compares the sheets of an OldWorkbook with those that generate_xlsx is about to create, printing
+# what changed
+# Returns (RenderedSheet list, player) where the sheets are copies of those that haven't changed, of
+# the data sheets with their changed rows patched, and of those that generate.py doesn't create,
+# and player is the name on the old About sheet
+# Returns None if the workbook doesn't need to be updated
+def plan_update(old, jobs, state, sheets, dbpath):
+	(db, config) = state[:2]
+	print("Comparing with the existing workbook...")
+
+	ours = [job[0] for job in jobs]
+	if SHEET_ABOUT in sheets:
+		ours.append("About")
+	others = [title for title in old.titles if not title in ours]
+	for title in others:
+		if not old.can_copy(title):
+			raise Exception("Sheet '%s' of %s holds charts, comments or other objects that an update can't keep (use --from to create a new spreadsheet instead)" % (title, old.path))
+
+	unchanged = []
+	patched = []
+	chart_changes = None
+	kinds = [job[1] for job in jobs if job[0] in old.parts]
+	most_complete = ([kind for kind in (SHEET_COMPLETE, SHEET_DATA, SHEET_SCORES) if kind in kinds] + [None])[0]
+	for job in jobs:
+		title = job[0]
+		if job[1] == SHEET_SUMMARY and not "Scores" in unchanged:
+			print("Sheet %s: recreating it along with Scores" % title)
+			continue
+		(rows, wanted) = job_rows(job, state)
+		# The charts are told apart on the most complete sheet, and on the data sheets, whose rows
+		# only hold values and can be patched one by one
+		key_column = None
+		if job[1] == most_complete or job[1] in (SHEET_DATA, SHEET_COMPLETE):
+			key_column = 1
+		changes = old.compare_sheet(title, rows, wanted, key_column)
+		if job[1] == most_complete:
+			chart_changes = changes
+		if not title in old.parts:
+			print("Sheet %s: new" % title)
+			continue
+		if changes.same and old.can_copy(title):
+			print("Sheet %s: unchanged" % title)
+			unchanged.append(title)
+			continue
+		if job[1] in (SHEET_DATA, SHEET_COMPLETE) and changes.old_rows.get(1) == normalize_row(1, changes.new_rows[0][1], wanted):
+			sheet = old.patch_sheet(title, changes, wanted)
+			if sheet != None:
+				print("Sheet %s: changed, patching its rows" % title)
+				patched.append(sheet)
+				continue
+		print("Sheet %s: changed" % title)
+
+	if chart_changes != None:
+		changes = chart_changes
+		print("Charts: %d added, %d removed, %d changed" % (len(changes.added), len(changes.removed), len(changes.changed)))
+
+	player = None
+	about_same = True
+	if SHEET_ABOUT in sheets:
+		player = old.cell("About", 6, 2)
+		ws = xlsx_writer.Workbook().create_sheet("About")
+		write_about_sheet(ws, db, dbpath, config, player)
+		# Ignoring the generation time
+		about_same = old.compare_sheet("About", drawn_rows(ws), lambda r, c: not (r == 3 and c == 2)).same
+	if about_same and len(unchanged) == len(jobs):
+		print("The spreadsheet is already up to date")
+		return None
+
+	copied = patched
+	for title in unchanged + others:
+		sheet = old.copy_sheet(title)
+		if sheet != None:
+			copied.append(sheet)
+		elif title in others:
+			print("WARNING: Sheet '%s' could not be kept" % title)
+	return (copied, player)
+
+# Draws one of the sheets listed by generate_xlsx on ws
+# Called in worker processes (see sheet_pool) when sheets are rendered in parallel
+def render_sheet(ws, job, state):
+	(db, config, scores, all_filtered_charts, mix_to_charts, lookup, summary) = state
+	kind = job[1]
+	if kind == SHEET_SCORES:
+		write_score_sheet(ws, db, all_filtered_charts, config, scores, lookup, (None, mix_to_charts)[summary])
+	elif kind == SHEET_SUMMARY:
+		(mid, ispad) = job[2:]
+		write_summary_sheet(ws, db, mix_to_charts[mid], config, mid, ispad)
+	elif kind == SHEET_DATA:
+		write_data_sheet(ws, db, all_filtered_charts, config)
+	elif kind == SHEET_COMPLETE:
+		write_data_sheet(ws, db, set(db.charts), None, by_cid=True)
+
+# Returns the error in the options that apply to every spreadsheet made from a database, if any
+def check_options(dbpath, cachedir, sheets, stream, workers, backend):
+	if not os.path.isfile(dbpath):
+		return "Database does not exist at %s" % dbpath
+	if cachedir and os.path.exists(cachedir) and not os.path.isdir(cachedir):
+		return "Cache path %s is not a directory" % cachedir
+
+	unknown = [s for s in sheets if not s in ALL_SHEETS]
+	if unknown:
+		return "Unknown sheet(s) %s (expected some of %s)" % (", ".join(unknown), ", ".join(ALL_SHEETS))
+	if len(sheets) == 0:
+		return "No sheets selected"
+	if SHEET_SUMMARY in sheets and not SHEET_SCORES in sheets:
+		return "The summary sheets require the scores sheet"
+
+	if workers < 1:
+		return "The number of jobs must be at least 1"
+	if workers > 1 and stream:
+		return "--stream cannot be combined with --jobs"
+	if workers > 1:
+		error = check_openpyxl_version()
+		if error:
+			return error
+
+	if not backend in ALL_BACKENDS:
+		return "Unknown backend %s (expected one of %s)" % (backend, ", ".join(ALL_BACKENDS))
+	if backend == BACKEND_NATIVE and (stream or workers > 1):
+		return "The %s backend cannot be combined with --stream or --jobs" % backend
+	return None
+
+# Returns the error in the paths of one spreadsheet, if any
+def check_job(outpath, configpath, frompath, overwrite, update):
+	if update and not os.path.isfile(outpath):
+		return "Spreadsheet to update does not exist at %s" % outpath
+	if update and frompath:
+		return "--update keeps the scores of the output spreadsheet, so it cannot be combined with --from"
+	if not update and not overwrite and os.path.exists(outpath):
+		return "Output path %s already exists (force write with --overwrite)" % outpath
+	if not os.path.isfile(configpath):
+		return "Config file does not exist at %s" % configpath
+	if frompath and not os.path.isfile(frompath):
+		return "Scores path %s does not exist" % frompath
+	if frompath == outpath:
+		return "Output path and old scores path cannot be equal"
+	return None
+
+# Prints the stages of a profile, indented by how deeply they're nested
+def print_profile(profile):
+	print("")
+	print("%-40s %9s %9s %10s %10s %10s" % ("Stage", "Wall (s)", "CPU (s)", "Peak (MB)", "Rows", "Cells"))
+	for stage in profile.stages:
+		names = stage.name.split("/")
+		label = "  " * (len(names) - 1) + names[-1]
+		if stage.process != "main":
+			label += " (%s)" % stage.process
+		print("%-40s %9.3f %9.3f %10s %10s %10s" % (label[:40], stage.wall_seconds, stage.cpu_seconds, stage.max_rss_mb, ("", stage.rows)[stage.rows != None], ("", stage.cells)[stage.cells != None]))
+
+# If profilepath is given, the time, memory and size of each stage are recorded (see profiling) and
+# saved there as JSON; if profile_stage is also given, the cProfile statistics of that stage are
+# saved next to it, with the extension .prof
+# If fmt isn't FORMAT_XLSX, the rows of the score and data sheets are exported instead (see export)
+def generate(dbpath, outpath, configpath, frompath, overwrite, cachedir=None, cache_size=DEFAULT_CACHE_SIZE, sheets=ALL_SHEETS, sql_filter=False, stream=False, workers=1, backend=BACKEND_OPENPYXL, static=False, update=False, profilepath=None, profile_stage=None, fmt=FORMAT_XLSX):
+	if fmt != FORMAT_XLSX:
+		if stream or workers > 1 or backend != BACKEND_OPENPYXL or static or update or profilepath:
+			print("ERROR: --format %s cannot be combined with --stream, --jobs, --backend, --static, --update or --profile" % fmt)
+			return
+		export(dbpath, outpath, configpath, frompath, overwrite, fmt, cachedir, cache_size, sheets, sql_filter)
+		return
 
-def generate(dbpath, outpath, configpath, frompath, overwrite):
 	print("Database Path:   %s" % dbpath)
-	print("Output Path:     %s%s" % (outpath, (""," (Overwrite)")[overwrite]))
+	print("Output Path:     %s%s" % (outpath, ("", " (Overwrite)", " (Update)")[(overwrite, 2)[update]]))
 	print("Config Path:     %s" % configpath)
 	print("Old Scores Path: %s" % ("(None specified)",frompath)[frompath != None])
+	print("Cache Path:      %s" % ("(None specified)",cachedir)[cachedir != None])
+	print("Sheets:          %s" % ", ".join(sheets))
+	print("Backend:         %s" % backend)
 	print("")
 
-	if not os.path.isfile(dbpath):
-		print("ERROR: Database does not exist at %s" % dbpath)
-		return
-	if not overwrite and os.path.exists(outpath):
-		print("ERROR: Output path %s already exists (force write with --overwrite)" % outpath)
-		return
-	if not os.path.isfile(configpath):
-		print("ERROR: Config file does not exist at %s" % configpath)
-		return
-	if frompath and not os.path.isfile(frompath):
-		print("ERROR: Scores path %s does not exist" % frompath)
-		return
-	if frompath == outpath:
-		print("ERROR: Output path and old scores path cannot be equal")
+	error = check_options(dbpath, cachedir, sheets, stream, workers, backend) or check_job(outpath, configpath, frompath, overwrite, update)
+	if not error and profile_stage and not profilepath:
+		error = "--profile-stage requires --profile"
+	if error:
+		print("ERROR: %s" % error)
 		return
 
-	generate_xlsx(dbpath, outpath, configpath, frompath)
+	profile = NO_PROFILE
+	if profilepath:
+		profile = Profile(cprofile_stage=profile_stage)
+		profile.info = {"database": dbpath, "output": outpath, "config": configpath, "from": frompath,
+			"sheets": sheets, "sql_filter": sql_filter, "stream": stream, "workers": workers,
+			"backend": backend, "static": static, "update": update}
+
+	generate_xlsx(dbpath, outpath, configpath, frompath, cachedir, cache_size, sheets, sql_filter, stream, workers, backend, static, update, profile)
+
+	if profilepath:
+		cprofile_path = None
+		if profile_stage:
+			cprofile_path = os.path.splitext(profilepath)[0] + ".prof"
+		profile.save(profilepath, cprofile_path)
+		print_profile(profile)
+		print("")
+		print("Profile saved to %s" % profilepath)
+		if profile_stage and profile.cprofile == None:
+			print("WARNING: Stage %s did not run in this process, so it wasn't profiled" % profile_stage)
+		elif profile_stage:
+			print("Statistics of stage %s saved to %s (python3 -m pstats %s)" % (profile_stage, cprofile_path, cprofile_path))
 
 if __name__ == '__main__':
 	parser = argparse.ArgumentParser(description="Create an XLSX spreadsheet for recording PIU scores.")
@@ -663,6 +933,19 @@ if __name__ == '__main__':
 	parser.add_argument("--from", type=str, dest="frompath", help="The optional path of a previous spreadsheet from which to copy scores to the new one")
 	parser.add_argument("--config", type=str, default="config.txt", help="The path of the configuration file (default: config.txt)")
 	parser.add_argument("--overwrite", action="store_true", help="Overwrite the output path if it already exists (default: off)")
+	parser.add_argument("--cache", type=str, dest="cachedir", help="The optional path of a directory in which to cache the parsed database between runs")
+	parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE // (1024*1024), help="The maximum total size of the cache directory in MB (default: %d)" % (DEFAULT_CACHE_SIZE // (1024*1024)))
+	parser.add_argument("--sheets", type=str, default=",".join(ALL_SHEETS), help="Comma-separated list of the sheets to create (default: %s)" % ",".join(ALL_SHEETS))
+	parser.add_argument("--sql-filter", action="store_true", help="Filter charts inside SQLite and only read the charts that pass the filter; the complete data sheet then only lists those charts (default: off)")
+	parser.add_argument("--stream", action="store_true", help="Write the workbook in write-only mode, streaming the data sheets to disk to keep memory use flat (default: off)")
+	parser.add_argument("--jobs", type=int, default=1, dest="workers", help="The number of processes in which to create sheets in parallel (default: 1)")
+	parser.add_argument("--backend", type=str, default=BACKEND_OPENPYXL, choices=ALL_BACKENDS, help="The library that writes the workbook: openpyxl, or native to write the XML directly, which is faster and uses less memory (default: openpyxl)")
+	parser.add_argument("--static", action="store_true", help="Write the title, cut, mode and difficulty of each chart on the score sheet as values instead of lookups into the complete data sheet (default: off)")
+	parser.add_argument("--update", action="store_true", help="Update the output spreadsheet in place, keeping its scores and the sheets that haven't changed (default: off)")
+	parser.add_argument("--profile", type=str, dest="profilepath", help="The optional path of a JSON file in which to save the wall time, CPU time, peak memory and row and cell counts of each stage")
+	parser.add_argument("--profile-stage", type=str, help="The name of a stage, as listed in the profile (e.g. sheets/Scores), to run under cProfile; its statistics are saved next to the profile with the extension .prof")
+	parser.add_argument("--format", type=str, default=FORMAT_XLSX, dest="fmt", choices=ALL_FORMATS, help="xlsx to create the spreadsheet, or csv or sqlite to export the rows of its score and data sheets to a directory of CSV files or an SQLite database instead (default: xlsx)")
 	args = parser.parse_args()
-	generate(args.db, args.out, args.config, args.frompath, args.overwrite)
+	sheets = [s.strip().lower() for s in args.sheets.split(",") if s.strip() != ""]
+	generate(args.db, args.out, args.config, args.frompath, args.overwrite, args.cachedir, args.cache_size * 1024*1024, sheets, args.sql_filter, args.stream, args.workers, args.backend, args.static, args.update, args.profilepath, args.profile_stage, args.fmt)
 
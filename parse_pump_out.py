@@ -1,7 +1,17 @@
+from profiling import NO_PROFILE
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
 import sqlite3
+import sys
 
 LANGUAGE = "en"
 
+# Bump this whenever read_database or the classes below change in a way that affects the
+# parsed Database, so that copies cached by database_cache are invalidated
+PARSER_VERSION = 7
+
 OP_NONE   = 0
 OP_INSERT = 1
 OP_DELETE = 2
@@ -10,10 +20,31 @@ OP_EXISTS = 4
 OP_REVIVE = 5
 OP_CROSS  = 6
 
+# Optional attributes that read_database can be told to skip (see read_database)
+# Everything else (mixes, modes, cuts, versions, chart/song operations, ratings and titles) is
+# always loaded
+ATTR_GAME_ID       = "game_id"       # song_game_id
+ATTR_CATEGORY      = "category"      # song_category
+ATTR_BPM           = "bpm"           # song_bpm, song_bpm_str
+ATTR_CARD          = "card"          # song_card
+ATTR_ARTIST        = "artist"        # Song.artist
+ATTR_STEPMAKER     = "stepmaker"     # chart_stepmaker
+ATTR_LABELS        = "labels"        # chart_labels
+ATTR_RATING_IMAGES = "rating_images" # Database.ratingImages
+ALL_ATTRIBUTES = frozenset([ATTR_GAME_ID, ATTR_CATEGORY, ATTR_BPM, ATTR_CARD, ATTR_ARTIST, ATTR_STEPMAKER, ATTR_LABELS, ATTR_RATING_IMAGES])
+# The attributes needed by Database.snapshot
+SNAPSHOT_ATTRIBUTES = frozenset([ATTR_GAME_ID, ATTR_CATEGORY, ATTR_BPM, ATTR_CARD, ATTR_STEPMAKER, ATTR_LABELS])
+
 class ParseError(Exception):
 	pass
 
+# Raised when an accessor needs an attribute that read_database was told not to load
+class NotLoadedError(Exception):
+	pass
+
 class Mix:
+	__slots__ = ("id", "title", "parent", "order")
+
 	def __init__(self, mixId, mixTitle, parentId, sortOrder):
 		self.id = mixId
 		self.title = mixTitle
@@ -21,6 +52,8 @@ class Mix:
 		self.order = sortOrder
 
 class Version:
+	__slots__ = ("id", "mix", "title", "parent", "order")
+
 	def __init__(self, versionId, mixId, versionTitle, parentId, sortOrder):
 		self.id = versionId
 		self.mix = mixId
@@ -29,37 +62,114 @@ class Version:
 		self.order = sortOrder
 
 class VersionedValue:
-	def __init__(self):
-		# Maps versionId -> value
-		self.values = {}
-		# A list of the versionIds in self.values, sorted BACKWARDS by order.
-		# Or None if the cache needs to be rebuilt (use ensure_cache).
-		self.cache = None
+	__slots__ = ("ranks", "vals")
 
-	def add(self, versionId, value):
-		if versionId in self.values:
-			raise Exception("duplicate key: vid=%d, new=%s, old=%s" % (versionId, value, self.values[versionId]))
-		self.values[versionId] = value
-		self.cache = None
+	def __init__(self):
+		# Parallel arrays holding the rank (see Database.version_rank) of each version that set a
+		# value and the value it set, sorted by rank (oldest first)
+		# Most histories only hold one or two entries, so the values are kept in a tuple rather
+		# than an over-allocated list
+		self.ranks = array("l")
+		self.vals = ()
+
+	def __len__(self):
+		return len(self.ranks)
+
+	def __contains__(self, rank):
+		return rank in self.ranks
+
+	# Returns the value set at exactly rank, or default if there isn't one
+	def get(self, rank, default=None):
+		i = bisect_left(self.ranks, rank)
+		if i == len(self.ranks) or self.ranks[i] != rank:
+			return default
+		return self.vals[i]
+
+	def add(self, rank, value):
+		i = bisect_left(self.ranks, rank)
+		if i < len(self.ranks) and self.ranks[i] == rank:
+			raise Exception("duplicate key: rank=%d, new=%s, old=%s" % (rank, value, self.vals[i]))
+		self.ranks.insert(i, rank)
+		self.vals = self.vals[:i] + (value,) + self.vals[i:]
+
+	# Returns (rank, value) for the newest value set at or before rank
+	# Returns (None, default) if no value had been set by then
+	def as_of(self, rank, default):
+		i = bisect_right(self.ranks, rank) - 1
+		if i < 0:
+			return (None, default)
+		return (self.ranks[i], self.vals[i])
 
-	def ensure_cache(self, versions):
-		if self.cache == None:
-			self.cache = sorted([vid for vid in self.values], key=lambda e: -versions[e].order)
+	# Returns a list of (rank, value), sorted BACKWARDS by rank
+	def get_list(self):
+		return list(zip(reversed(self.ranks), reversed(self.vals)))
 
-	def get_list(self, versions):
-		self.ensure_cache(versions)
-		return [(v, self.values[v]) for v in self.cache]
+# The end of the validity interval of a value that is never changed again, past every rank
+NO_END = float("inf")
 
 class MultipleVersionedValue:
+	__slots__ = ("values", "intervals")
+
 	def __init__(self):
+		# Maps value -> VersionedValue of operations
 		self.values = {}
+		# The validity intervals of the values, as live_intervals returns them, or None until
+		# they're needed
+		self.intervals = None
 
-	def add(self, versionId, operation, value):
+	def add(self, rank, operation, value):
 		if not value in self.values:
 			self.values[value] = VersionedValue()
-		self.values[value].add(versionId, operation)
-
+		self.values[value].add(rank, operation)
+		self.intervals = None
+
+	# Returns a tuple of (from rank, position, to rank, value) for each stretch of ranks over which a
+	# value exists: from the rank of each operation other than a delete, up to but not including
+	# the rank of the value's next operation (None if there isn't one)
+	# position is that of the value in the order in which the values were first added; the
+	# intervals are sorted by from rank, then position
+	def live_intervals(self):
+		if self.intervals == None:
+			intervals = []
+			for (position, (value, vv)) in enumerate(self.values.items()):
+				ranks = vv.ranks
+				for (i, op) in enumerate(vv.vals):
+					if op == OP_DELETE: continue
+					end = ranks[i+1] if i+1 < len(ranks) else None
+					intervals.append((ranks[i], position, end, value))
+			intervals.sort(key=lambda interval: interval[:2])
+			self.intervals = tuple(intervals)
+		return self.intervals
+
+	# Returns [(rank, value)] for the values that exist at rank (those whose newest operation at or
+	# before rank isn't a delete), in the order in which they were first added, where rank is that
+	# of the operation that set each one
+	def live_at(self, rank):
+		live = []
+		for (start, position, end, value) in self.live_intervals():
+			if start > rank: break
+			if end == None or end > rank:
+				live.append((position, start, value))
+		if len(live) > 1:
+			live.sort()
+		return [(start, value) for (position, start, value) in live]
+
+# Kinds of modes, told apart by how their titles start (see Mode.kind)
+MODE_KIND_SINGLE = 0      # Single, Single Performance
+MODE_KIND_DOUBLE = 1      # Double, Double Performance
+MODE_KIND_HALF_DOUBLE = 2 # Half-Double
+MODE_KIND_ROUTINE = 3     # Routine
+MODE_KIND_COOP = 4        # Co-Op
+
+# The position of charts of a mode when charts are sorted, for modes that fit none of these
+MODE_SORT_OTHER = 99
+
+# kind is the MODE_KIND_* that the title starts with, or None; sort_class is where charts of the
+# mode go when charts are sorted (see Database.chart_sort_key), by what the title contains
+# Both are worked out once, from the title, rather than for every chart
 class Mode:
+	__slots__ = ("id", "title", "abbr", "color", "order", "pads", "routine", "coop", "performance", "kind", "sort_class")
+
 	def __init__(self, modeId, modeTitle, abbreviation, color, sortOrder, padsUsed, routine, coOp, performance):
 		self.id = modeId
 		self.title = modeTitle
@@ -71,22 +181,67 @@ class Mode:
 		self.coop = coOp
 		self.performance = performance
 
+		mt = modeTitle.lower()
+		self.kind = None
+		for (prefix, kind) in (("single", MODE_KIND_SINGLE), ("double", MODE_KIND_DOUBLE), ("half", MODE_KIND_HALF_DOUBLE), ("routine", MODE_KIND_ROUTINE), ("co", MODE_KIND_COOP)):
+			if mt.startswith(prefix):
+				self.kind = kind
+				break
+		# "half" before "double", for Half-Double
+		self.sort_class = MODE_SORT_OTHER
+		for (part, sort_class) in (("single", 0), ("half", 2), ("double", 1), ("routine", 3), ("co", 4)):
+			if part in mt:
+				self.sort_class = sort_class
+				break
+
 class Cut:
+	__slots__ = ("id", "title", "order")
+
 	def __init__(self, cutId, cutTitle, sortOrder):
 		self.id = cutId
 		self.title = cutTitle
 		self.order = sortOrder
 
+# Ratings and BPMs are immutable flyweights: only a few hundred distinct ones exist, so
+# use Rating.get/Bpm.get to share a single instance per value instead of constructing them
 class Rating:
+	__slots__ = ("mode", "difficulty")
+	_instances = {}
+
 	def __init__(self, modeId=None, difficulty=None):
 		self.mode = modeId
 		self.difficulty = difficulty
 
+	@classmethod
+	def get(cls, modeId=None, difficulty=None):
+		key = (modeId, difficulty)
+		rating = cls._instances.get(key)
+		if rating == None:
+			rating = cls._instances[key] = cls(modeId, difficulty)
+		return rating
+
+	def __reduce__(self):
+		return (Rating.get, (self.mode, self.difficulty))
+
 class Bpm:
+	__slots__ = ("low", "high")
+	_instances = {}
+
 	def __init__(self, low=None, high=None):
 		self.low = low
 		self.high = high
 
+	@classmethod
+	def get(cls, low=None, high=None):
+		key = (low, high)
+		bpm = cls._instances.get(key)
+		if bpm == None:
+			bpm = cls._instances[key] = cls(low, high)
+		return bpm
+
+	def __reduce__(self):
+		return (Bpm.get, (self.low, self.high))
+
 	def __str__(self):
 		if self.low == self.high == None:
 			return "NOBPM"
@@ -99,6 +254,8 @@ class Bpm:
 		return "%s-%s" % (self.low, self.high)
 
 class NameGroup:
+	__slots__ = ("str", "list")
+
 	def __init__(self):
 		self.str = ""
 		self.list = []
@@ -120,6 +277,8 @@ class NameGroup:
 		return self.str
 
 class Song:
+	__slots__ = ("songId", "operations", "title", "gameIdentifier", "category", "bpm", "card", "artist", "cut", "fallbackTitle")
+
 	def __init__(self):
 		self.songId = -1
 		self.operations = VersionedValue()
@@ -133,6 +292,8 @@ class Song:
 		self.fallbackTitle = "NOTITLE"
 
 class Chart:
+	__slots__ = ("chartId", "songId", "operations", "rating", "stepmaker", "labels")
+
 	def __init__(self):
 		self.chartId = -1
 		self.songId = -1
@@ -141,6 +302,33 @@ class Chart:
 		self.stepmaker = NameGroup()
 		self.labels = MultipleVersionedValue()
 
+# One row of a Database.snapshot: every attribute of a chart (and its song) resolved at one
+# version, formatted the same way as the corresponding Database accessors
+SnapshotRow = namedtuple("SnapshotRow", [
+	"cid",        # chartId
+	"sid",        # chart_song
+	"game_id",    # song_game_id
+	"title",      # song_title
+	"cut",        # song_cut_str
+	"rating",     # chart_rating
+	"mode",       # chart_mode_str
+	"difficulty", # chart_difficulty_str
+	"bpm",        # song_bpm_str
+	"category",   # song_category
+	"stepmaker",  # str(chart_stepmaker)
+	"labels",     # chart_labels
+	"card",       # song_card
+	"comment",    # song_comment
+])
+
+# When a chart exists, as worked out for every chart at once by Database.chart_lifetimes
+ChartLifetime = namedtuple("ChartLifetime", [
+	"introduced", # chart_introduced
+	"last_seen",  # chart_last_seen
+	"intervals",  # List of (first versionId, last versionId) of each run of versions, in order,
+	              # in which the chart exists
+])
+
 class Database:
 	def __init__(self):
 		self.mixes = {}
@@ -150,6 +338,160 @@ class Database:
 		self.charts = {}
 		self.songs = {}
 		self.ratingImages = {}
+		# The optional attributes (ATTR_*) that were loaded
+		self.attributes = set(ALL_ATTRIBUTES)
+		# If read_database was given a chart filter, maps mixId -> set of the chartIds that
+		# passed it in that mix (self.charts holds nothing else); otherwise None
+		self.filtered_charts = None
+		# Version-order index, filled in by build_version_index
+		# List of version ids, sorted BACKWARDS by order
+		self.version_list = []
+		# Maps versionId -> rank, where the oldest version has rank 0
+		# VersionedValues are keyed by rank, so this must not change once history is loaded
+		self.version_rank = {}
+		# Maps versionId -> the highest rank of any version with the same or an earlier order;
+		# chronological ("as of") lookups include everything up to and including this rank
+		self.version_cutoff = {}
+		# Maps mixId -> list of the version ids in that mix, sorted BACKWARDS by order
+		self.mix_versions = {}
+		# List of version ids, ordered so that every version comes after its parent
+		self.version_topo = []
+		# Euler-tour labelling of the version tree, indexed by rank: the position of each version
+		# in a depth-first walk of the tree, and the last position within its subtree, so that a
+		# version is an ancestor of (or is) another exactly when the other's position lies within
+		# its own position and last position
+		self.version_enter = array("l")
+		self.version_exit = array("l")
+		# Chart/mix membership index, filled in by build_index
+		# Maps mixId -> position of that mix in the lists below
+		self.mix_index = {}
+		# Maps chartId -> bytearray, with a 1 at the position of every mix the chart appears in
+		self.chart_mixes = {}
+		# Maps chartId -> array holding the newest version of each mix in which the chart exists,
+		# in mix order (one entry per 1 in chart_mixes)
+		self.chart_mix_versions = {}
+		# Maps versionId -> the result of snapshot(versionId)
+		self.snapshots = {}
+		# Maps (versionId, down) -> the result of sorted_charts(versionId, down)
+		self.chart_orders = {}
+		# Maps ("charts" or "songs", field) -> the index of _mvv_live_all
+		self.mvv_indexes = {}
+		# The result of chart_lifetimes, and maps versionId -> list of the chartIds that
+		# charts_removed_in returns, or None until they're needed
+		self.lifetimes = None
+		self.removed_charts = None
+
+	# Snapshots, chart orders, interval indexes and lifetimes are rebuilt on demand, so they are left
+	# out when a Database is pickled
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state["snapshots"] = {}
+		state["chart_orders"] = {}
+		state["mvv_indexes"] = {}
+		state["lifetimes"] = None
+		state["removed_charts"] = None
+		return state
+
+	# Builds the version-order index used by the accessors below
+	# Must be called once self.mixes and self.versions are loaded, before any VersionedValue is
+	# filled in
+	def build_version_index(self):
+		self.version_list = sorted(self.versions, key=lambda e: -self.versions[e].order)
+		self.version_rank = {vid: len(self.version_list) - i - 1 for i, vid in enumerate(self.version_list)}
+		self.version_cutoff = {}
+		cutoff = None
+		for i, vid in enumerate(self.version_list):
+			if i == 0 or self.versions[vid].order != self.versions[self.version_list[i-1]].order:
+				cutoff = self.version_rank[vid]
+			self.version_cutoff[vid] = cutoff
+
+		self.mix_versions = {mid: [] for mid in self.mixes}
+		for vid in self.version_list:
+			self.mix_versions.setdefault(self.versions[vid].mix, []).append(vid)
+
+		self.version_topo = []
+		placed = set()
+		for vid in reversed(self.version_list):
+			chain = []
+			while vid in self.versions and not vid in placed:
+				chain.append(vid)
+				placed.add(vid)
+				vid = self.versions[vid].parent
+			self.version_topo += reversed(chain)
+
+		children = {}
+		roots = []
+		for vid in self.version_topo:
+			parent = self.versions[vid].parent
+			if parent in self.versions:
+				children.setdefault(parent, []).append(vid)
+			else:
+				roots.append(vid)
+		self.version_enter = array("l", [0] * len(self.version_list))
+		self.version_exit = array("l", [0] * len(self.version_list))
+		position = 0
+		for root in roots:
+			# (versionId, whether its subtree has been walked)
+			stack = [(root, False)]
+			while stack:
+				(vid, walked) = stack.pop()
+				rank = self.version_rank[vid]
+				if walked:
+					self.version_exit[rank] = position - 1
+					continue
+				self.version_enter[rank] = position
+				position += 1
+				stack.append((vid, True))
+				stack += [(child, False) for child in reversed(children.get(vid, []))]
+
+	# Builds the chart/mix membership index used by the accessors below
+	# Must be called again if self.mixes or any chart's operations are modified
+	def build_index(self):
+		self.mix_index = {mid: i for i, mid in enumerate(self.mix_versions)}
+		self.chart_mixes = {}
+		self.chart_mix_versions = {}
+		for chartId, chart in self.charts.items():
+			self._index_chart_mixes(chartId, chart)
+
+		self.snapshots = {}
+		self.chart_orders = {}
+		self.mvv_indexes = {}
+		self.lifetimes = None
+		self.removed_charts = None
+
+	# Fills in the membership index for one chart with a single sweep down the version tree,
+	# resolving each version's state the same way _vv_recent does
+	def _index_chart_mixes(self, chartId, chart):
+		ops = dict(zip(chart.operations.ranks, chart.operations.vals))
+		alive = {}
+		for vid in self.version_topo:
+			rank = self.version_rank[vid]
+			if rank in ops:
+				(op, comment) = ops[rank]
+				alive[vid] = op != OP_DELETE
+			else:
+				alive[vid] = alive.get(self.versions[vid].parent, False)
+
+		mixes = bytearray(len(self.mix_index))
+		mix_versions = array("l")
+		for mid, i in self.mix_index.items():
+			for vid in self.mix_versions[mid]:
+				if alive[vid]:
+					mixes[i] = 1
+					mix_versions.append(vid)
+					break
+		self.chart_mixes[chartId] = mixes
+		self.chart_mix_versions[chartId] = mix_versions
+
+	# Raises NotLoadedError unless every one of the given attributes was loaded
+	def _require(self, *attributes):
+		missing = [a for a in attributes if not a in self.attributes]
+		if missing:
+			raise NotLoadedError("attribute(s) not loaded from the database: %s" % ", ".join(sorted(missing)))
+
+	# Returns the versionId with the given rank
+	def _version_at_rank(self, rank):
+		return self.version_list[-1 - rank]
 
 	# Returns the value in a VersionedValue that existed at versionId
 	# Returns default if no value is set at versionId
@@ -168,53 +510,85 @@ class Database:
 	# occurred in a separate branch of the version tree
 	def _vv_at_version(self, versionedValue, versionId, default):
 		if not versionId in self.versions:
-			return default
-		so = self.versions[versionId].order
-		versionedValue.ensure_cache(self.versions)
-		for ver in versionedValue.cache:
-			if self.versions[ver].order <= so:
-				return (ver, versionedValue.values[ver])
-		return (None, default)
+			return (None, default)
+		(rank, value) = versionedValue.as_of(self.version_cutoff[versionId], default)
+		if rank == None:
+			return (None, default)
+		return (self._version_at_rank(rank), value)
 
 	# Returns the value in a VersionedValue, from within the same version tree, that existed
 	# at versionId
 	# Returns default if no value is set at versionId
+	#
+	# That's the value set by the nearest of versionId and its ancestors to set one, which is the
+	# deepest of them: the one that comes last in the Euler tour (see version_enter) of those whose
+	# subtrees hold versionId, so each value is checked once instead of walking up the tree
 	def _vv_recent(self, versionedValue, versionId, default):
-		while True:
-			if not versionId in self.versions:
-				return default
-			if not versionId in versionedValue.values:
-				versionId = self.versions[versionId].parent
-				continue
-			return versionedValue.values[versionId]
+		if not versionId in self.versions:
+			return default
+		enter = self.version_enter
+		exit = self.version_exit
+		position = enter[self.version_rank[versionId]]
+		nearest = -1
+		for (rank, value) in zip(versionedValue.ranks, versionedValue.vals):
+			if nearest < enter[rank] <= position <= exit[rank]:
+				nearest = enter[rank]
+				default = value
+		return default
 
 	# Returns the (versionId,value) associated with the earliest chronological value
 	# in a VersionedValue
 	# If no elements exist, returns (None, default)
 	def _vv_earliest(self, versionedValue, default):
-		if len(versionedValue.values) == 0:
+		if len(versionedValue) == 0:
 			return (None, default)
-		versionedValue.ensure_cache(self.versions)
-		ver = versionedValue.cache[-1]
-		return (ver, versionedValue.values[ver])
+		return (self._version_at_rank(versionedValue.ranks[0]), versionedValue.vals[0])
 
 	# Returns the (versionId,value) associated with the latest chronological value
 	# in a VersionedValue
 	# If no elements exist, returns (None, default)
 	def _vv_latest(self, versionedValue, default):
-		if len(versionedValue.values) == 0:
+		if len(versionedValue) == 0:
 			return (None, default)
-		versionedValue.ensure_cache(self.versions)
-		ver = versionedValue.cache[0]
-		return (ver, versionedValue.values[id])
+		return (self._version_at_rank(versionedValue.ranks[-1]), versionedValue.vals[-1])
+
+	# Returns [(versionId, value)] for the values in a MultipleVersionedValue that exist at
+	# versionId (chronologically, like _vv_at), with the version that set each one
+	def _mvv_live(self, multiVersionedValue, versionId):
+		if not versionId in self.versions:
+			return []
+		return [(self._version_at_rank(rank), value) for (rank, value) in multiVersionedValue.live_at(self.version_cutoff[versionId])]
+
+	# Returns {id: [(rank, value)]} like _mvv_live (but with the rank of the version that set each
+	# value), for the MultipleVersionedValue named field of every one of the charts or songs (as
+	# kind says) that has values at versionId
+	# Rather than querying each one, the validity intervals of all of them are gathered into one
+	# list, in the order of the charts or songs and then of their values, which is filtered in one
+	# sweep
+	def _mvv_live_all(self, kind, field, versionId):
+		if not versionId in self.versions:
+			return {}
+		key = (kind, field)
+		intervals = self.mvv_indexes.get(key)
+		if intervals == None:
+			intervals = []
+			for (entityId, entity) in getattr(self, kind).items():
+				for (start, position, end, value) in sorted(getattr(entity, field).live_intervals(), key=lambda interval: interval[1]):
+					intervals.append((start, (end, NO_END)[end == None], entityId, value))
+			self.mvv_indexes[key] = intervals
+
+		cutoff = self.version_cutoff[versionId]
+		live = {}
+		for (entityId, start, value) in [(entityId, start, value) for (start, end, entityId, value) in intervals if start <= cutoff < end]:
+			if entityId in live:
+				live[entityId].append((start, value))
+			else:
+				live[entityId] = [(start, value)]
+		return live
 
 	# Returns all values in a MultipleVersionedValue that exist at versionId
 	def _mvv_all(self, multiVersionedValue, versionId):
-		res = []
-		for value, vv in multiVersionedValue.values.items():
-			if self._vv_at(vv, versionId, OP_DELETE) != OP_DELETE:
-				res.append(value)
-		return res
+		return [value for (version, value) in self._mvv_live(multiVersionedValue, versionId)]
 
 	# Returns the one value that exists in a MultipleVersionedValue at versionId
 	# If no value exists at versionId, return default
@@ -231,11 +605,7 @@ class Database:
 	# Similar to _mvv_one, except if multiple values exist at versionId, return the one with
 	# the newest version
 	def _mvv_best(self, multiVersionedValue, versionId, default):
-		pairs = []
-		for value, vv in multiVersionedValue.values.items():
-			(version_at, op_at) = self._vv_at_version(vv, versionId, OP_DELETE)
-			if op_at != OP_DELETE:
-				pairs.append((version_at, value))
+		pairs = self._mvv_live(multiVersionedValue, versionId)
 
 		if len(pairs) == 0:
 			return default
@@ -247,71 +617,64 @@ class Database:
 			if so > best_so:
 				best_so = so
 				best_val = val
-		return val
+		return best_val
 
 	def latest_version(self):
-		best_id = None
-		best_so = -1
-		for ver in self.versions.values():
-			if ver.order > best_so:
-				best_so = ver.order
-				best_id = ver.id
-		return best_id
+		if len(self.version_list) == 0:
+			return None
+		return self.version_list[0]
 
 	def newest_version_from_mix(self, mixId):
-		vlist = sorted([v for v in self.versions.values()], key=lambda e: -e.order)
-		for ver in vlist:
-			if ver.mix == mixId:
-				return ver.id
-		return None
+		vlist = self.mix_versions.get(mixId)
+		if not vlist:
+			return None
+		return vlist[0]
 
 	def chart_in_mix(self, chartId, mixId):
-		return self.chart_version_in_mix(chartId, mixId) != None
+		if not chartId in self.chart_mixes or not mixId in self.mix_index:
+			return False
+		return self.chart_mixes[chartId][self.mix_index[mixId]] == 1
 
 	def chart_version_in_mix(self, chartId, mixId):
-		if not chartId in self.charts:
+		if not self.chart_in_mix(chartId, mixId):
 			return None
-		vlist = sorted([v for v in self.versions.values()], key=lambda e: -e.order)
-		for ver in vlist:
-			if ver.mix == mixId:
-				(op, comment) = self._vv_recent(self.charts[chartId].operations, ver.id, (OP_DELETE, None))
-				if op != OP_DELETE:
-					return ver.id
-		return None
+		mixes = self.chart_mixes[chartId]
+		return self.chart_mix_versions[chartId][mixes.count(1, 0, self.mix_index[mixId])]
 
 	def chart_sort_key(self, chartId, versionId, down=True):
 		rating = self.chart_rating(chartId, versionId)
-		title = self.song_title(self.chart_song(chartId), versionId).lower()
+		title = (self.song_title(self.chart_song(chartId), versionId) or "").lower()
 
-		mode_key = 99
+		mode_key = MODE_SORT_OTHER
 		if rating != None and rating.mode != None:
-			mt = self.modes[rating.mode].title.lower()
-			if "single" in mt:
-				mode_key = 0
-			elif "half" in mt:
-				mode_key = 2
-			elif "double" in mt:
-				mode_key = 1
-			elif "routine" in mt:
-				mode_key = 3
-			elif "co" in mt:
-				mode_key = 4
+			mode_key = self.modes[rating.mode].sort_class
 
 		diff_key = 99
-		if rating.difficulty != None:
+		if rating != None and rating.difficulty != None:
 			diff_key = rating.difficulty
 			if down:
 				diff_key = -diff_key
 
 		return (diff_key, mode_key, title)
 
+	# Returns the ids of every chart, sorted by chart_sort_key at a version, then by id so that the
+	# charts that sort alike always come in the same order
+	# The order is worked out once for each version and direction, and shared by every sheet that
+	# lists charts in it, each of which keeps the charts it lists
+	def sorted_charts(self, versionId, down=True):
+		key = (versionId, down)
+		if not key in self.chart_orders:
+			keys = {chartId: self.chart_sort_key(chartId, versionId, down) for chartId in self.charts}
+			self.chart_orders[key] = sorted(self.charts, key=lambda chartId: (keys[chartId], chartId))
+		return self.chart_orders[key]
+
 	def chart_rating(self, chartId, versionId):
 		if not chartId in self.charts:
 			return None
 		return self._vv_at(self.charts[chartId].rating, versionId, None)
 
 	def chart_rating_sequence_str(self, chartId, changes_only=False):
-		ratings = self.charts[chartId].rating.get_list(self.versions)[::-1]
+		ratings = self.charts[chartId].rating.get_list()[::-1]
 
 		elems = []
 		for i in range(len(ratings)):
@@ -356,15 +719,103 @@ class Database:
 			return ver
 		return None
 
+	# Returns the newest version in which the chart exists, or None if there isn't one
+	# Every version is in one mix, so that's the newest of the ones the membership index holds for
+	# each mix the chart is in
 	def chart_last_seen(self, chartId):
-		if not chartId in self.charts:
+		if not chartId in self.chart_mix_versions:
 			return None
-		vlist = sorted([v for v in self.versions.values()], key=lambda v: -v.order)
-		for ver in vlist:
-			(op, comment) = self._vv_recent(self.charts[chartId].operations, ver.id, (OP_DELETE, None))
-			if op != OP_DELETE:
-				return ver.id
-		return None
+		return max(self.chart_mix_versions[chartId], key=self.version_rank.get, default=None)
+
+	# Returns a dict mapping chartId -> ChartLifetime, for every chart
+	#
+	# Worked out in one sweep over the versions from oldest to newest, keeping a bytearray with a 1
+	# for each chart that exists at the version: each version's is a copy of its parent's with the
+	# chart operations of the version applied, so it follows the version tree like _vv_recent, and
+	# the charts that start or stop existing are where it differs from the previous version's
+	# Results are cached until build_index is called again
+	def chart_lifetimes(self):
+		if self.lifetimes == None:
+			self._sweep_lifetimes()
+		return self.lifetimes
+
+	# Returns the ids of the charts that exist in the parent of versionId but not in versionId,
+	# in chart order
+	def charts_removed_in(self, versionId):
+		if self.removed_charts == None:
+			self._sweep_lifetimes()
+		return self.removed_charts.get(versionId, [])
+
+	def _sweep_lifetimes(self):
+		chartIds = list(self.charts)
+		n = len(chartIds)
+		# Maps rank -> [(position of a chart in chartIds, whether it exists after the operation)]
+		changes = {}
+		introduced = [None] * n
+		for (i, chart) in enumerate(self.charts.values()):
+			ops = chart.operations
+			for (rank, (op, comment)) in zip(ops.ranks, ops.vals):
+				if rank in changes:
+					changes[rank].append((i, op != OP_DELETE))
+				else:
+					changes[rank] = [(i, op != OP_DELETE)]
+			# As chart_introduced
+			if ops.vals and ops.vals[0][0] == OP_INSERT:
+				introduced[i] = ops.ranks[0]
+
+		# The bytearray of a version is kept only until its children and the sweep itself have
+		# all taken it, so that only a few are held at once
+		uses = {vid: 1 for vid in self.versions}
+		for version in self.versions.values():
+			if version.parent in uses:
+				uses[version.parent] += 1
+		held = {}
+		removed = {}
+		def take(vid):
+			if not vid in held:
+				parent = self.versions[vid].parent
+				if parent in self.versions:
+					exists = bytearray(take(parent))
+				else:
+					exists = bytearray(n)
+				for (i, alive) in changes.get(self.version_rank[vid], ()):
+					if exists[i] and not alive:
+						removed.setdefault(vid, []).append(i)
+					exists[i] = alive
+				held[vid] = exists
+			exists = held[vid]
+			uses[vid] -= 1
+			if uses[vid] == 0:
+				del held[vid]
+			return exists
+
+		# Maps position -> [first rank, last rank] of each run of versions in which it exists
+		runs = {}
+		previous = bytearray(n)
+		for rank in range(len(self.version_list)):
+			exists = take(self._version_at_rank(rank))
+			changed = int.from_bytes(exists, "little") ^ int.from_bytes(previous, "little")
+			if changed:
+				changed = changed.to_bytes(n, "little")
+				i = changed.find(1)
+				while i >= 0:
+					if exists[i]:
+						runs.setdefault(i, []).append([rank, None])
+					else:
+						runs[i][-1][1] = rank - 1
+					i = changed.find(1, i + 1)
+			previous = exists
+
+		# Indexed by rank, with the newest version again at -1 for the runs that never end
+		versions = self.version_list[::-1] + self.version_list[:1]
+		self.lifetimes = {}
+		for (i, chartId) in enumerate(chartIds):
+			intervals = [(versions[first], versions[-1 if last == None else last]) for (first, last) in runs.get(i, ())]
+			self.lifetimes[chartId] = ChartLifetime(
+				None if introduced[i] == None else versions[introduced[i]],
+				intervals[-1][1] if intervals else None,
+				intervals)
+		self.removed_charts = {vid: [chartIds[i] for i in sorted(positions)] for (vid, positions) in removed.items()}
 
 	def chart_song(self, chartId):
 		if not chartId in self.charts:
@@ -372,16 +823,19 @@ class Database:
 		return self.charts[chartId].songId
 
 	def song_game_id(self, songId, versionId):
+		self._require(ATTR_GAME_ID)
 		if not songId in self.songs:
 			return None
 		return self._mvv_one(self.songs[songId].gameIdentifier, versionId, None)
 
 	def chart_stepmaker(self, chartId):
+		self._require(ATTR_STEPMAKER)
 		if not chartId in self.charts:
 			return None
 		return self.charts[chartId].stepmaker
 
 	def chart_labels(self, chartId, versionId):
+		self._require(ATTR_LABELS)
 		if not chartId in self.charts:
 			return []
 		return self._mvv_all(self.charts[chartId].labels, versionId)
@@ -412,6 +866,7 @@ class Database:
 		return cut.title
 
 	def song_bpm(self, songId, versionId):
+		self._require(ATTR_BPM)
 		if not songId in self.songs:
 			return None
 		return self._vv_at(self.songs[songId].bpm, versionId, None)
@@ -422,11 +877,13 @@ class Database:
 		return str(bpm)
 
 	def song_category(self, songId, versionId):
+		self._require(ATTR_CATEGORY)
 		if not songId in self.songs:
 			return None
 		return self._vv_at(self.songs[songId].category, versionId, "NOCATEGORY")
 
 	def song_card(self, songId, versionId):
+		self._require(ATTR_CARD)
 		if not songId in self.songs:
 			return None
 		# card data seems to be bugged, so use _mvv_best instead of _mvv_one
@@ -455,254 +912,492 @@ class Database:
 			d = "%02d" % rating.difficulty
 		return m+d
 
-def read_database(dbpath):
+	# Resolves every versioned attribute of every chart and song as it existed at versionId
+	# Returns a dict mapping chartId -> SnapshotRow
+	#
+	# Each song is resolved once no matter how many charts it has, and each VersionedValue is
+	# scanned once, so the whole snapshot costs a single pass over the history of the database
+	# Results are cached until build_index is called again
+	def snapshot(self, versionId):
+		if versionId in self.snapshots:
+			return self.snapshots[versionId]
+		self._require(*SNAPSHOT_ATTRIBUTES)
+
+		versions = self.versions
+		cutoff = self.version_cutoff.get(versionId)
+
+		# Returns (versionId, value) for the newest value set at or before versionId
+		def at(versionedValue, default):
+			if cutoff == None:
+				return (None, default)
+			(rank, value) = versionedValue.as_of(cutoff, default)
+			if rank == None:
+				return (None, default)
+			return (self._version_at_rank(rank), value)
+
+		# [(rank, value)] for every value that exists at versionId, by song or chart
+		song_game_ids = self._mvv_live_all("songs", "gameIdentifier", versionId)
+		song_cards = self._mvv_live_all("songs", "card", versionId)
+		chart_labels = self._mvv_live_all("charts", "labels", versionId)
+
+		songs = {}
+		for songId, song in self.songs.items():
+			title = at(song.title, None)[1]
+			if title == None:
+				title = song.fallbackTitle
+
+			cut = self.cuts.get(song.cut, None)
+			cut = "NOCUT" if cut == None else cut.title
+
+			bpm = at(song.bpm, None)[1]
+			bpm = "NOBPM" if bpm == None else str(bpm)
+
+			game_ids = song_game_ids.get(songId, [])
+			if len(game_ids) > 1:
+				raise Exception("too many vals: %s" % [value for (rank, value) in game_ids])
+			game_id = game_ids[0][1] if game_ids else None
+
+			card = "NOCARD"
+			best_so = -1
+			for (rank, value) in song_cards.get(songId, []):
+				so = versions[self._version_at_rank(rank)].order
+				if so > best_so:
+					best_so = so
+					card = value
+
+			(op, comment) = at(song.operations, (OP_NONE, None))[1]
+
+			category = at(song.category, "NOCATEGORY")[1]
+
+			songs[songId] = (game_id, title, cut, bpm, category, card, comment)
+
+		missing_song = (None, None, "NOCUT", "NOBPM", None, None, None)
+		rows = {}
+		for chartId, chart in self.charts.items():
+			(game_id, title, cut, bpm, category, card, comment) = songs.get(chart.songId, missing_song)
+
+			rating = at(chart.rating, None)[1]
+			mode = difficulty = None
+			if rating != None:
+				mode = rating.mode
+				difficulty = rating.difficulty
+			mode = None if mode == None else self.modes[mode].title
+			difficulty = "??" if difficulty == None else "%02d" % difficulty
+
+			labels = [value for (rank, value) in chart_labels.get(chartId, [])]
+
+			rows[chartId] = SnapshotRow(chartId, chart.songId, game_id, title, cut, rating, mode, difficulty,
+				bpm, category, str(chart.stepmaker), labels, card, comment)
+
+		self.snapshots[versionId] = rows
+		return rows
+
+# Finds the charts that pass chart_filter (see read_database) with a single query, leaving their
+# ids in the temporary table filterChart and the ids of their songs in filterSong
+# Returns a dict mapping mixId -> set of the chartIds that pass the filter in that mix
+#
+# A chart passes in a mix if, at the newest version of the mix in which the chart exists
+# (following the version tree like Database._vv_recent), its rating (looked up chronologically
+# like Database._vv_at) has one of the modes and a difficulty in range, or no difficulty if
+# unrated charts are included; i.e. exactly the charts chosen by the filter in generate.py
+def filter_charts(c, db, chart_filter):
+	mix_ids = [mid for mid, mix in db.mixes.items() if mix.title in chart_filter.mixes]
+	mode_ids = [mid for mid, mode in db.modes.items() if mode.title in chart_filter.modes]
+
+	# The version order (including ties) comes from build_version_index, so hand the ranks to
+	# SQLite rather than re-deriving them from sortOrder
+	c.execute("CREATE TEMP TABLE filterVersion (versionId INTEGER PRIMARY KEY, mixId INTEGER, rank INTEGER, cutoff INTEGER, selected INTEGER)")
+	c.executemany("INSERT INTO temp.filterVersion VALUES (?, ?, ?, ?, ?)", [
+		(vid, db.versions[vid].mix, db.version_rank[vid], db.version_cutoff[vid], db.versions[vid].mix in mix_ids)
+		for vid in db.version_list
+	])
+
+	c.execute('''
+		WITH RECURSIVE
+		-- Every selected version paired with itself and each of its ancestors
+		ancestor(versionId, ancestorId, depth) AS (
+			SELECT versionId, versionId, 0 FROM temp.filterVersion WHERE selected
+			UNION ALL
+			SELECT ancestor.versionId, version.parentVersionId, ancestor.depth + 1
+			FROM ancestor
+			JOIN version ON version.versionId = ancestor.ancestorId
+			WHERE version.parentVersionId IS NOT NULL
+		),
+		-- The operation in effect for each chart at each selected version: the one set by the
+		-- nearest ancestor (SQLite takes the bare operationId from the row with the MIN depth)
+		state(chartId, versionId, operationId, depth) AS (
+			SELECT chartVersion.chartId, ancestor.versionId, chartVersion.operationId, MIN(ancestor.depth)
+			FROM ancestor
+			JOIN chartVersion ON chartVersion.versionId = ancestor.ancestorId
+			GROUP BY chartVersion.chartId, ancestor.versionId
+		),
+		-- The newest version of each selected mix in which each chart exists
+		member(chartId, mixId, cutoff, rank) AS (
+			SELECT state.chartId, filterVersion.mixId, filterVersion.cutoff, MAX(filterVersion.rank)
+			FROM state
+			JOIN temp.filterVersion ON filterVersion.versionId = state.versionId
+			WHERE state.operationId != %d
+			GROUP BY state.chartId, filterVersion.mixId
+		),
+		-- The rating of each chart at that version
+		rated(chartId, mixId, modeId, difficulty, rank) AS (
+			SELECT member.chartId, member.mixId, chartRating.modeId, difficulty.value, MAX(ratingVersion.rank)
+			FROM member
+			JOIN chartRatingVersion ON chartRatingVersion.chartId = member.chartId
+			JOIN temp.filterVersion AS ratingVersion ON ratingVersion.versionId = chartRatingVersion.versionId
+			JOIN chartRating ON chartRatingVersion.chartRatingId = chartRating.chartRatingId
+			JOIN difficulty ON chartRating.difficultyId = difficulty.difficultyId
+			WHERE ratingVersion.rank <= member.cutoff
+			GROUP BY member.chartId, member.mixId
+		)
+		SELECT chartId, mixId
+		FROM rated
+		WHERE modeId IN (%s)
+		AND ((difficulty IS NULL AND ?) OR (difficulty >= ? AND difficulty <= ?))
+	''' % (OP_DELETE, ",".join("%d" % mid for mid in mode_ids)), (chart_filter.unrated, chart_filter.diff_min, chart_filter.diff_max))
+
+	filtered = {mid: set() for mid in mix_ids}
+	for chartId, mixId in c.fetchall():
+		filtered[mixId].add(chartId)
+
+	c.execute("CREATE TEMP TABLE filterChart (chartId INTEGER PRIMARY KEY)")
+	c.executemany("INSERT INTO temp.filterChart VALUES (?)", [(cid,) for cid in set().union(*filtered.values())])
+	c.execute('''
+		CREATE TEMP TABLE filterSong AS
+		SELECT DISTINCT songId FROM chart WHERE chartId IN temp.filterChart
+	''')
+
+	return filtered
+
+# Returns every row of the last query run on cursor c, counting them in a profiling stage
+def fetch_counted(c, stage):
+	rows = c.fetchall()
+	stage.count(len(rows))
+	return rows
+
+# Reads the Pump Out database at dbpath
+# attributes is the set of optional attributes (ATTR_*) to load, or None to load all of them;
+# the queries for any other optional attribute are skipped, and the accessors that need one
+# raise NotLoadedError
+# chart_filter is an optional Config (see parse_config), or any object with the same mixes,
+# modes, diff_min, diff_max and unrated fields; if given, only the charts that pass it in at
+# least one of its mixes (see filter_charts) and their songs are loaded
+# Each query is a stage of profile (see profiling), which counts the rows it returns
+def read_database(dbpath, attributes=None, chart_filter=None, profile=NO_PROFILE):
 	conn = sqlite3.connect(dbpath)
 	c = conn.cursor()
 
 	db = Database()
-
-	c.execute('''
-		SELECT
-			operationId,
-			internalTitle
-		FROM operation
-	''')
-	results = c.fetchall()
-	expect = [
-		(OP_INSERT, "INSERT"),
-		(OP_DELETE, "DELETE"),
-		(OP_UPDATE, "UPDATE"),
-		(OP_EXISTS, "EXISTS"),
-		(OP_REVIVE, "REVIVE"),
-		(OP_CROSS,  "CROSS"),
-	]
-	if results != expect:
-		raise ParseError("incompatible operations list")
+	if attributes != None:
+		unknown = set(attributes) - ALL_ATTRIBUTES
+		if unknown:
+			raise ValueError("unknown attribute(s): %s" % ", ".join(sorted(unknown)))
+		db.attributes = set(attributes)
+	load = db.attributes
+
+	# Many history rows repeat the same (operation, comment) pair or label/category/name
+	# strings; share one object per distinct value instead of one per row
+	operations = {}
+	def intern_operation(operationId, comment):
+		key = (operationId, comment)
+		return operations.setdefault(key, key)
+
+	with profile.stage("operation") as stage:
+		c.execute('''
+			SELECT
+				operationId,
+				internalTitle
+			FROM operation
+		''')
+		results = fetch_counted(c, stage)
+		expect = [
+			(OP_INSERT, "INSERT"),
+			(OP_DELETE, "DELETE"),
+			(OP_UPDATE, "UPDATE"),
+			(OP_EXISTS, "EXISTS"),
+			(OP_REVIVE, "REVIVE"),
+			(OP_CROSS,  "CROSS"),
+		]
+		if results != expect:
+			raise ParseError("incompatible operations list")
 
 	# Get mixes
-	c.execute('''
-		SELECT
-			mixId,
-			internalTitle,
-			parentMixId,
-			sortOrder
-		FROM mix
-	''')
-	for mixId, mixTitle, parentId, sortOrder in c.fetchall():
-		db.mixes[mixId] = Mix(mixId, mixTitle, parentId, sortOrder)
+	with profile.stage("mix") as stage:
+		c.execute('''
+			SELECT
+				mixId,
+				internalTitle,
+				parentMixId,
+				sortOrder
+			FROM mix
+		''')
+		for mixId, mixTitle, parentId, sortOrder in fetch_counted(c, stage):
+			db.mixes[mixId] = Mix(mixId, mixTitle, parentId, sortOrder)
 
 	# Get modes
-	c.execute('''
-		SELECT
-			modeId,
-			internalTitle,
-			internalAbbreviation,
-			internalHexColor,
-			sortOrder,
-			padsUsed,
-			routine,
-			coOp,
-			performance
-		FROM mode
-	''')
-	for modeId, title, abbreviation, color, sortOrder, padsUsed, routine, coOp, performance in c.fetchall():
-		db.modes[modeId] = Mode(modeId, title, abbreviation, color, sortOrder, padsUsed, routine, coOp, performance)
+	with profile.stage("mode") as stage:
+		c.execute('''
+			SELECT
+				modeId,
+				internalTitle,
+				internalAbbreviation,
+				internalHexColor,
+				sortOrder,
+				padsUsed,
+				routine,
+				coOp,
+				performance
+			FROM mode
+		''')
+		for modeId, title, abbreviation, color, sortOrder, padsUsed, routine, coOp, performance in fetch_counted(c, stage):
+			db.modes[modeId] = Mode(modeId, title, abbreviation, color, sortOrder, padsUsed, routine, coOp, performance)
 
 	# Get cuts
-	c.execute('''
-		SELECT
-			cutId,
-			internalTitle,
-			sortOrder
-		FROM cut
-	''')
-	for cutId, cutTitle, sortOrder in c.fetchall():
-		db.cuts[cutId] = Cut(cutId, cutTitle, sortOrder)
+	with profile.stage("cut") as stage:
+		c.execute('''
+			SELECT
+				cutId,
+				internalTitle,
+				sortOrder
+			FROM cut
+		''')
+		for cutId, cutTitle, sortOrder in fetch_counted(c, stage):
+			db.cuts[cutId] = Cut(cutId, cutTitle, sortOrder)
 
 	### Get versions
-	c.execute('''
-		SELECT
-			versionId,
-			mixId,
-			internalTitle,
-			parentVersionId,
-			sortOrder
-		FROM version
-	''')
-	for versionId, mixId, versionTitle, parentId, sortOrder in c.fetchall():
-		db.versions[versionId] = Version(versionId, mixId, versionTitle, parentId, sortOrder)
+	with profile.stage("version") as stage:
+		c.execute('''
+			SELECT
+				versionId,
+				mixId,
+				internalTitle,
+				parentVersionId,
+				sortOrder
+			FROM version
+		''')
+		for versionId, mixId, versionTitle, parentId, sortOrder in fetch_counted(c, stage):
+			db.versions[versionId] = Version(versionId, mixId, versionTitle, parentId, sortOrder)
+		db.build_version_index()
+
+	### Restrict everything below to the charts that pass chart_filter, and their songs
+	if chart_filter != None:
+		with profile.stage("filter") as stage:
+			db.filtered_charts = filter_charts(c, db, chart_filter)
+			stage.count(len(set().union(*db.filtered_charts.values())))
+
+	# Return the condition to add to a query to skip rows for other charts/songs
+	def only_charts(column, keyword="WHERE"):
+		if chart_filter == None: return ""
+		return "%s %s IN temp.filterChart" % (keyword, column)
+	def only_songs(column, keyword="WHERE"):
+		if chart_filter == None: return ""
+		return "%s %s IN temp.filterSong" % (keyword, column)
 
 	### Populate charts by version
-	c.execute('''
-		SELECT
-			chartVersion.chartId,
-			chart.songId,
-			chartVersion.versionId,
-			chartVersion.operationId,
-			chartVersion.internalDescription
-		FROM chartVersion
-		JOIN chart ON chart.chartId = chartVersion.chartId
-	''')
-	for chartId, songId, versionId, operationId, comment in c.fetchall():
-		if not chartId in db.charts:
-			db.charts[chartId] = Chart()
-			db.charts[chartId].chartId = chartId
-			db.charts[chartId].songId = songId
-		db.charts[chartId].operations.add(versionId, (operationId, comment))
+	with profile.stage("chartVersion") as stage:
+		c.execute('''
+			SELECT
+				chartVersion.chartId,
+				chart.songId,
+				chartVersion.versionId,
+				chartVersion.operationId,
+				chartVersion.internalDescription
+			FROM chartVersion
+			JOIN chart ON chart.chartId = chartVersion.chartId
+			%s
+		''' % only_charts("chartVersion.chartId"))
+		for chartId, songId, versionId, operationId, comment in fetch_counted(c, stage):
+			if not chartId in db.charts:
+				db.charts[chartId] = Chart()
+				db.charts[chartId].chartId = chartId
+				db.charts[chartId].songId = songId
+			db.charts[chartId].operations.add(db.version_rank[versionId], intern_operation(operationId, comment))
 
 	### Get chart ratings
-	c.execute('''
-		SELECT
-			chartRatingVersion.chartId,
-			chartRatingversion.versionId,
-			chartRating.modeId,
-			difficulty.value
-		FROM chartRatingVersion
-		JOIN chartRating on chartRatingVersion.chartRatingId = chartRating.chartRatingId
-		JOIN difficulty ON chartRating.difficultyId = difficulty.difficultyId
-	''')
-	for chartId, versionId, mode, difficulty in c.fetchall():
-		db.charts[chartId].rating.add(versionId, Rating(mode, difficulty))
+	with profile.stage("chartRatingVersion") as stage:
+		c.execute('''
+			SELECT
+				chartRatingVersion.chartId,
+				chartRatingversion.versionId,
+				chartRating.modeId,
+				difficulty.value
+			FROM chartRatingVersion
+			JOIN chartRating on chartRatingVersion.chartRatingId = chartRating.chartRatingId
+			JOIN difficulty ON chartRating.difficultyId = difficulty.difficultyId
+			%s
+		''' % only_charts("chartRatingVersion.chartId"))
+		for chartId, versionId, mode, difficulty in fetch_counted(c, stage):
+			db.charts[chartId].rating.add(db.version_rank[versionId], Rating.get(mode, difficulty))
 
 	### Get rating paths
-	c.execute('''
-		SELECT
-			rating.modeId,
-			difficulty.value,
-			rating.path
-		FROM rating
-		JOIN difficulty ON difficulty.difficultyId = rating.difficultyId
-	''')
-	for modeId, difficulty, path in c.fetchall():
-		db.ratingImages[(modeId, difficulty)] = path
+	if ATTR_RATING_IMAGES in load:
+		with profile.stage("rating") as stage:
+			c.execute('''
+				SELECT
+					rating.modeId,
+					difficulty.value,
+					rating.path
+				FROM rating
+				JOIN difficulty ON difficulty.difficultyId = rating.difficultyId
+			''')
+			for modeId, difficulty, path in fetch_counted(c, stage):
+				db.ratingImages[(modeId, difficulty)] = path
 
 	### Get chart stepmakers
-	c.execute('''
-		SELECT
-			chartStepmaker.chartId,
-			chartStepmaker.prefix,
-			stepmaker.internalTitle,
-			chartStepmaker.sortOrder
-		FROM chartStepmaker
-		JOIN stepmaker ON chartStepmaker.stepmakerId = stepmaker.stepmakerId
-		ORDER BY chartStepmaker.chartId ASC, chartStepmaker.sortOrder ASC
-	''')
-	for chartId, prefix, stepmaker, _ in c.fetchall():
-		db.charts[chartId].stepmaker.add(prefix, stepmaker)
+	if ATTR_STEPMAKER in load:
+		with profile.stage("chartStepmaker") as stage:
+			c.execute('''
+				SELECT
+					chartStepmaker.chartId,
+					chartStepmaker.prefix,
+					stepmaker.internalTitle,
+					chartStepmaker.sortOrder
+				FROM chartStepmaker
+				JOIN stepmaker ON chartStepmaker.stepmakerId = stepmaker.stepmakerId
+				%s
+				ORDER BY chartStepmaker.chartId ASC, chartStepmaker.sortOrder ASC
+			''' % only_charts("chartStepmaker.chartId"))
+			for chartId, prefix, stepmaker, _ in fetch_counted(c, stage):
+				db.charts[chartId].stepmaker.add(prefix, sys.intern(stepmaker))
 
 	### Get chart labels
-	c.execute('''
-		SELECT
-			chartLabel.chartId,
-			chartLabelVersion.versionId,
-			chartLabelVersion.operationId,
-			label.internalTitle
-		FROM chartLabelVersion
-		JOIN chartLabel ON chartLabelVersion.chartLabelId = chartLabel.chartLabelId
-		JOIN label ON chartLabel.labelId = label.labelId
-	''')
-	for chartId, versionId, operationId, label in c.fetchall():
-		db.charts[chartId].labels.add(versionId, operationId, label)
+	if ATTR_LABELS in load:
+		with profile.stage("chartLabelVersion") as stage:
+			c.execute('''
+				SELECT
+					chartLabel.chartId,
+					chartLabelVersion.versionId,
+					chartLabelVersion.operationId,
+					label.internalTitle
+				FROM chartLabelVersion
+				JOIN chartLabel ON chartLabelVersion.chartLabelId = chartLabel.chartLabelId
+				JOIN label ON chartLabel.labelId = label.labelId
+				%s
+			''' % only_charts("chartLabel.chartId"))
+			for chartId, versionId, operationId, label in fetch_counted(c, stage):
+				db.charts[chartId].labels.add(db.version_rank[versionId], operationId, sys.intern(label))
 
 	### Create songs by version, with cut (Full Song, Remix, etc) and fallback title
-	c.execute('''
-		SELECT
-			songVersion.songId,
-			songVersion.versionId,
-			songVersion.operationId,
-			songVersion.internalDescription,
-			song.cutId,
-			song.internalTitle
-		FROM songVersion
-		JOIN song ON songVersion.songId = song.songId
-	''')
-	for songId, versionId, operationId, comment, cutId, fallbackTitle in c.fetchall():
-		if not songId in db.songs:
-			db.songs[songId] = Song()
-			db.songs[songId].songId = songId
-		db.songs[songId].operations.add(versionId, (operationId, comment))
-		db.songs[songId].cut = cutId
-		db.songs[songId].fallbackTitle = fallbackTitle
+	with profile.stage("songVersion") as stage:
+		c.execute('''
+			SELECT
+				songVersion.songId,
+				songVersion.versionId,
+				songVersion.operationId,
+				songVersion.internalDescription,
+				song.cutId,
+				song.internalTitle
+			FROM songVersion
+			JOIN song ON songVersion.songId = song.songId
+			%s
+		''' % only_songs("songVersion.songId"))
+		for songId, versionId, operationId, comment, cutId, fallbackTitle in fetch_counted(c, stage):
+			if not songId in db.songs:
+				db.songs[songId] = Song()
+				db.songs[songId].songId = songId
+			db.songs[songId].operations.add(db.version_rank[versionId], intern_operation(operationId, comment))
+			db.songs[songId].cut = cutId
+			db.songs[songId].fallbackTitle = fallbackTitle
 
 	### Get song titles
-	c.execute('''
-		SELECT
-			songTitleVersion.songId,
-			songTitleVersion.versionId,
-			songTitle.title
-		FROM songTitleVersion
-		JOIN songTitle ON songTitleVersion.songTitleId = songTitle.songTitleId
-		AND songTitleVersion.languageId = songTitle.languageId
-		JOIN language ON songTitle.languageId = language.languageId
-		WHERE language.code = "%s"
-	''' % LANGUAGE)
-	for songId, versionId, title in c.fetchall():
-		db.songs[songId].title.add(versionId, title)
+	with profile.stage("songTitleVersion") as stage:
+		c.execute('''
+			SELECT
+				songTitleVersion.songId,
+				songTitleVersion.versionId,
+				songTitle.title
+			FROM songTitleVersion
+			JOIN songTitle ON songTitleVersion.songTitleId = songTitle.songTitleId
+			AND songTitleVersion.languageId = songTitle.languageId
+			JOIN language ON songTitle.languageId = language.languageId
+			WHERE language.code = "%s"
+			%s
+		''' % (LANGUAGE, only_songs("songTitleVersion.songId", "AND")))
+		for songId, versionId, title in fetch_counted(c, stage):
+			db.songs[songId].title.add(db.version_rank[versionId], title)
 
 	### Get official song identifiers
-	c.execute('''
-		SELECT
-			songGameIdentifier.songId,
-			songGameIdentifier.gameIdentifier,
-			songGameIdentifierVersion.versionId,
-			songGameIdentifierVersion.operationId
-		FROM songGameIdentifierVersion
-		JOIN songGameIdentifier ON songGameIdentifierVersion.songGameIdentifierId = songGameIdentifier.songGameIdentifierId
-	''')
-	for songId, gameIdentifier, versionId, operationId in c.fetchall():
-		db.songs[songId].gameIdentifier.add(versionId, operationId, gameIdentifier)
+	if ATTR_GAME_ID in load:
+		with profile.stage("songGameIdentifierVersion") as stage:
+			c.execute('''
+				SELECT
+					songGameIdentifier.songId,
+					songGameIdentifier.gameIdentifier,
+					songGameIdentifierVersion.versionId,
+					songGameIdentifierVersion.operationId
+				FROM songGameIdentifierVersion
+				JOIN songGameIdentifier ON songGameIdentifierVersion.songGameIdentifierId = songGameIdentifier.songGameIdentifierId
+				%s
+			''' % only_songs("songGameIdentifier.songId"))
+			for songId, gameIdentifier, versionId, operationId in fetch_counted(c, stage):
+				db.songs[songId].gameIdentifier.add(db.version_rank[versionId], operationId, gameIdentifier)
 
 	### Get song categories (K-Pop, World Music, etc)
-	c.execute('''
-		SELECT
-			songCategoryVersion.songId,
-			category.internalTitle,
-			songCategoryVersion.versionId
-		FROM songCategoryVersion
-		JOIN songCategory ON songCategoryVersion.songCategoryId = songCategory.songCategoryId
-		JOIN category ON songCategory.categoryId = category.categoryId
-	''')
-	for songId, category, versionId in c.fetchall():
-		db.songs[songId].category.add(versionId, category)
+	if ATTR_CATEGORY in load:
+		with profile.stage("songCategoryVersion") as stage:
+			c.execute('''
+				SELECT
+					songCategoryVersion.songId,
+					category.internalTitle,
+					songCategoryVersion.versionId
+				FROM songCategoryVersion
+				JOIN songCategory ON songCategoryVersion.songCategoryId = songCategory.songCategoryId
+				JOIN category ON songCategory.categoryId = category.categoryId
+				%s
+			''' % only_songs("songCategoryVersion.songId"))
+			for songId, category, versionId in fetch_counted(c, stage):
+				db.songs[songId].category.add(db.version_rank[versionId], sys.intern(category))
 
 	### Get song BPM info
-	c.execute('''
-		SELECT
-			songBpmVersion.songId,
-			songBpmVersion.versionId,
-			songBpm.bpmMin,
-			songBpm.bpmMax
-		FROM songBpmVersion
-		JOIN songBpm ON songBpmVersion.songBpmId = songBpm.songBpmId
-	''')
-	for songId, versionId, bpmMin, bpmMax in c.fetchall():
-		db.songs[songId].bpm.add(versionId, Bpm(bpmMin, bpmMax))
+	if ATTR_BPM in load:
+		with profile.stage("songBpmVersion") as stage:
+			c.execute('''
+				SELECT
+					songBpmVersion.songId,
+					songBpmVersion.versionId,
+					songBpm.bpmMin,
+					songBpm.bpmMax
+				FROM songBpmVersion
+				JOIN songBpm ON songBpmVersion.songBpmId = songBpm.songBpmId
+				%s
+			''' % only_songs("songBpmVersion.songId"))
+			for songId, versionId, bpmMin, bpmMax in fetch_counted(c, stage):
+				db.songs[songId].bpm.add(db.version_rank[versionId], Bpm.get(bpmMin, bpmMax))
 
 	### Get song artists
-	c.execute('''
-		SELECT
-			songArtist.songId,
-			songArtist.prefix,
-			artist.internalTitle,
-			songArtist.sortOrder
-		FROM songArtist
-		JOIN artist ON songArtist.artistId = artist.artistId
-		ORDER BY songArtist.songId ASC, songArtist.sortOrder ASC
-	''')
-	for songId, prefix, artist, _ in c.fetchall():
-		db.songs[songId].artist.add(prefix, artist)
+	if ATTR_ARTIST in load:
+		with profile.stage("songArtist") as stage:
+			c.execute('''
+				SELECT
+					songArtist.songId,
+					songArtist.prefix,
+					artist.internalTitle,
+					songArtist.sortOrder
+				FROM songArtist
+				JOIN artist ON songArtist.artistId = artist.artistId
+				%s
+				ORDER BY songArtist.songId ASC, songArtist.sortOrder ASC
+			''' % only_songs("songArtist.songId"))
+			for songId, prefix, artist, _ in fetch_counted(c, stage):
+				db.songs[songId].artist.add(prefix, sys.intern(artist))
 
 	### Get song graphics
-	c.execute('''
-		SELECT
-			songCard.songId,
-			songCard.path,
-			songCardVersion.versionId,
-			songCardVersion.operationId
-		FROM songCardVersion
-		JOIN songCard ON songCardVersion.songCardId = songCard.songCardId
-	''')
-	for songId, path, versionId, operationId in c.fetchall():
-		db.songs[songId].card.add(versionId, operationId, path)
+	if ATTR_CARD in load:
+		with profile.stage("songCardVersion") as stage:
+			c.execute('''
+				SELECT
+					songCard.songId,
+					songCard.path,
+					songCardVersion.versionId,
+					songCardVersion.operationId
+				FROM songCardVersion
+				JOIN songCard ON songCardVersion.songCardId = songCard.songCardId
+				%s
+			''' % only_songs("songCard.songId"))
+			for songId, path, versionId, operationId in fetch_counted(c, stage):
+				db.songs[songId].card.add(db.version_rank[versionId], operationId, path)
+
+	with profile.stage("index"):
+		db.build_index()
 
 	return db
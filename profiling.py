@@ -0,0 +1,127 @@
+import contextlib
+import cProfile
+import datetime
+import json
+import sys
+import time
+
+try:
+	import resource
+except ImportError:
+	resource = None
+
+MB = 1024*1024
+
+# Returns the maximum resident set size of this process so far in MB, or None if it's unknown
+# (there's no resource module on Windows)
+def max_rss_mb():
+	if resource == None:
+		return None
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# Reported in KB, except on macOS
+	if sys.platform == "darwin":
+		return round(rss / MB, 1)
+	return round(rss / 1024, 1)
+
+# One stage of a Profile
+# Stages nest, and the name of each is the path of names from the outermost one, separated by "/"
+# rows and cells are left as None unless the code of the stage counts them
+class Stage:
+	def __init__(self, name, process="main"):
+		self.name = name
+		self.process = process
+		self.wall_seconds = None
+		self.cpu_seconds = None
+		self.max_rss_mb = None
+		self.rss_growth_mb = None
+		self.rows = None
+		self.cells = None
+
+	def count(self, rows, cells=None):
+		self.rows = rows
+		self.cells = cells
+
+	def as_dict(self):
+		return dict(self.__dict__)
+
+# Records the wall time, CPU time, peak memory and row and cell counts of each stage of creating a
+# spreadsheet, for the --profile option of generate.py
+#
+# Peak memory is the process's maximum resident set size at the end of each stage, along with how
+# much the stage raised it; CPU time is that of this process, so the stages that run in worker
+# processes are measured there (see sheet_pool) and added with add
+# If cprofile_stage is the name of a stage, that stage is also run under cProfile
+#
+# A disabled Profile (NO_PROFILE) measures nothing, so that the code of every stage can be wrapped
+# in stage() whether or not profiling was asked for
+class Profile:
+	def __init__(self, enabled=True, cprofile_stage=None):
+		self.enabled = enabled
+		self.cprofile_stage = cprofile_stage
+		self.cprofile = None
+		self.stages = []
+		self.names = []
+		self.info = {}
+		self.started = time.perf_counter()
+
+	# Runs the body of a with statement as a stage, yielding its Stage
+	@contextlib.contextmanager
+	def stage(self, name):
+		self.names.append(name)
+		stage = Stage("/".join(self.names))
+		if not self.enabled:
+			try:
+				yield stage
+			finally:
+				self.names.pop()
+			return
+
+		self.stages.append(stage)
+		rss = max_rss_mb()
+		profiler = None
+		if stage.name == self.cprofile_stage:
+			profiler = cProfile.Profile()
+			profiler.enable()
+		wall = time.perf_counter()
+		cpu = time.process_time()
+		try:
+			yield stage
+		finally:
+			stage.wall_seconds = round(time.perf_counter() - wall, 4)
+			stage.cpu_seconds = round(time.process_time() - cpu, 4)
+			if profiler != None:
+				profiler.disable()
+				self.cprofile = profiler
+			stage.max_rss_mb = max_rss_mb()
+			if rss != None:
+				stage.rss_growth_mb = round(stage.max_rss_mb - rss, 1)
+			self.names.pop()
+
+	# Adds a stage that was measured in another process, within the current stage
+	def add(self, name, stage):
+		if not self.enabled:
+			return
+		stage.name = "/".join(self.names + [name])
+		self.stages.append(stage)
+
+	# Returns the report, as a dict that json can serialise
+	def report(self):
+		report = {
+			"created": datetime.datetime.now().isoformat(timespec="seconds"),
+			"python": "%d.%d.%d" % sys.version_info[:3],
+		}
+		report.update(self.info)
+		report["wall_seconds"] = round(time.perf_counter() - self.started, 4)
+		report["max_rss_mb"] = max_rss_mb()
+		report["stages"] = [stage.as_dict() for stage in self.stages]
+		return report
+
+	# Writes the report as JSON to path, and the cProfile statistics of cprofile_stage, if it ran,
+	# to cprofile_path
+	def save(self, path, cprofile_path=None):
+		with open(path, "w") as f:
+			json.dump(self.report(), f, indent=1)
+		if cprofile_path != None and self.cprofile != None:
+			self.cprofile.dump_stats(cprofile_path)
+
+NO_PROFILE = Profile(enabled=False)
@@ -0,0 +1,291 @@
+import functools
+import posixpath
+import xml.etree.ElementTree as ET
+import zipfile
+
+PAD_HEADERS = ["Passed (Pad)", "Grade (Pad)", "Miss (Pad)", "Comment (Pad)"]
+KBD_HEADERS = ["Passed (Kbd)", "Grade (Kbd)", "Miss (Kbd)", "Comment (Kbd)"]
+
+REL_SHARED_STRINGS = "/sharedStrings"
+REL_STYLES = "/styles"
+
+class Score:
+	def __init__(self, cid, pad, passed, grade, miss, comment):
+		self.cid = cid
+		self.pad = pad
+		self.passed = passed
+		self.grade = grade
+		self.miss = miss
+		self.comment = comment
+
+	def empty(self):
+		return not self.passed and not self.grade and not self.miss and not self.comment
+
+# Placeholder for the value of a cell that refers to a shared string, until the shared strings
+# that are actually used have been read
+class SharedString:
+	__slots__ = ("index",)
+
+	def __init__(self, index):
+		self.index = index
+
+# Returns the tag of an element without its namespace, so that both transitional and strict
+# OOXML files can be read
+def local_name(tag):
+	return tag.rsplit("}", 1)[-1]
+
+# Returns the 1-based column number of a cell reference such as "AB12"
+def column_number(ref):
+	n = 0
+	for ch in ref:
+		if not ch.isalpha(): break
+		n = n*26 + ord(ch.upper()) - ord("A") + 1
+	return n
+
+# Returns the value of a <c> element, converted the same way openpyxl does for the types a
+# score sheet holds; formulas are returned as "=<formula>"
+# Shared strings are returned as SharedString placeholders, and numbers in the cell formats of
+# date_styles (see read_date_styles) are converted by them
+def cell_value(c, date_styles=None):
+	ctype = c.get("t", "n")
+	v = None
+	formula = None
+	inline = None
+	for child in c:
+		name = local_name(child.tag)
+		if name == "v":
+			v = child.text
+		elif name == "f":
+			formula = child.text
+		elif name == "is":
+			inline = string_item_text(child)
+
+	if formula != None:
+		return "=" + formula
+	if ctype == "inlineStr":
+		return inline
+	if v == None:
+		return None
+	if ctype == "s":
+		return SharedString(int(v))
+	if ctype == "b":
+		return v == "1"
+	if ctype == "n":
+		if "." in v or "E" in v or "e" in v:
+			v = float(v)
+		else:
+			v = int(v)
+		to_date = date_styles.get(int(c.get("s", 0))) if date_styles else None
+		if to_date != None:
+			# Like openpyxl, numbers outside the range of dates are read as an error
+			try:
+				return to_date(v)
+			except (OverflowError, ValueError):
+				return "#VALUE!"
+		return v
+	# "str" (formula result), "e" (error) and "d" (ISO date) are kept as text
+	return v
+
+# Returns the text of an <si> or <is> element, concatenating rich text runs and leaving out
+# phonetic hints
+def string_item_text(si):
+	text = []
+	for child in si:
+		name = local_name(child.tag)
+		if name == "t":
+			text.append(child.text or "")
+		elif name == "r":
+			for t in child:
+				if local_name(t.tag) == "t":
+					text.append(t.text or "")
+	return "".join(text)
+
+# Returns a dict mapping the id of each relationship in a .rels part to
+# (type, path of the target within the archive)
+def read_relationships(zf, part):
+	base = posixpath.dirname(posixpath.dirname(part))
+	rels = {}
+	root = ET.fromstring(zf.read(part))
+	for rel in root:
+		target = rel.get("Target")
+		if target.startswith("/"):
+			path = target[1:]
+		else:
+			path = posixpath.normpath(posixpath.join(base, target))
+		rels[rel.get("Id")] = (rel.get("Type"), path)
+	return rels
+
+# Returns ({sheet name: path of its worksheet part}, path of the shared strings part)
+# The shared strings path is None if the workbook doesn't have any
+def find_parts(zf):
+	workbook = "xl/workbook.xml"
+	rels = read_relationships(zf, "xl/_rels/workbook.xml.rels")
+
+	sheets = {}
+	for el in ET.fromstring(zf.read(workbook)).iter():
+		if local_name(el.tag) == "sheet":
+			rid = [val for (key, val) in el.attrib.items() if local_name(key) == "id"]
+			if rid and rid[0] in rels:
+				sheets[el.get("name")] = rels[rid[0]][1]
+
+	shared_strings = None
+	for (rtype, path) in rels.values():
+		if rtype.endswith(REL_SHARED_STRINGS):
+			shared_strings = path
+	return (sheets, shared_strings)
+
+# Returns a dict mapping the index of each cell format of the workbook that shows numbers as dates,
+# times or durations to a function converting such a number to a datetime, time or timedelta
+#
+# openpyxl is only imported if the workbook formats numbers at all, so that reading the score
+# sheets created by generate.py doesn't need it; without openpyxl, numbers are read as numbers
+def read_date_styles(zf):
+	rels = read_relationships(zf, "xl/_rels/workbook.xml.rels")
+	styles = [path for (rtype, path) in rels.values() if rtype.endswith(REL_STYLES)]
+	if not styles or not styles[0] in zf.namelist():
+		return {}
+
+	custom = {}
+	xf_formats = []
+	for el in ET.fromstring(zf.read(styles[0])):
+		name = local_name(el.tag)
+		if name == "numFmts":
+			for fmt in el:
+				custom[int(fmt.get("numFmtId"))] = fmt.get("formatCode")
+		elif name == "cellXfs":
+			xf_formats = [int(xf.get("numFmtId", 0)) for xf in el if local_name(xf.tag) == "xf"]
+	if not [fmt_id for fmt_id in xf_formats if fmt_id != 0]:
+		return {}
+
+	try:
+		from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format, is_timedelta_format
+		from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900, from_excel
+	except ImportError:
+		return {}
+
+	epoch = CALENDAR_WINDOWS_1900
+	for el in ET.fromstring(zf.read("xl/workbook.xml")):
+		if local_name(el.tag) == "workbookPr" and el.get("date1904") in ("1", "true"):
+			epoch = CALENDAR_MAC_1904
+
+	date_styles = {}
+	for (i, fmt_id) in enumerate(xf_formats):
+		fmt = custom.get(fmt_id, BUILTIN_FORMATS.get(fmt_id))
+		if is_date_format(fmt):
+			date_styles[i] = functools.partial(from_excel, epoch=epoch, timedelta=is_timedelta_format(fmt))
+	return date_styles
+
+# Yields (row number, {column number: value}) for each row of a worksheet part, keeping only the
+# columns for which wanted(row number, column number) is True
+# Only one row is held in memory at a time
+def iter_rows(zf, part, wanted, date_styles=None):
+	with zf.open(part) as f:
+		row_num = 0
+		for event, el in ET.iterparse(f, events=("end",)):
+			name = local_name(el.tag)
+			if name != "row": continue
+
+			row_num = int(el.get("r", row_num + 1))
+			values = {}
+			col_num = 0
+			for c in el:
+				if local_name(c.tag) != "c": continue
+				ref = c.get("r")
+				col_num = column_number(ref) if ref else col_num + 1
+				if wanted(row_num, col_num):
+					values[col_num] = cell_value(c, date_styles)
+			el.clear()
+			yield (row_num, values)
+
+# Returns a dict mapping each of the given shared string indices to its text
+# Strings that aren't needed are parsed and discarded one at a time, and reading stops after the
+# last one that is needed
+def read_shared_strings(zf, part, indices):
+	strings = {}
+	if part == None or not indices:
+		return strings
+	last = max(indices)
+	with zf.open(part) as f:
+		i = 0
+		for event, el in ET.iterparse(f, events=("end",)):
+			if local_name(el.tag) != "si": continue
+			if i in indices:
+				strings[i] = string_item_text(el)
+			el.clear()
+			i += 1
+			if i > last: break
+	return strings
+
+# Replaces the SharedString placeholders in each of the given {column number: value} dicts
+def resolve_shared_strings(zf, part, rows):
+	indices = set()
+	for values in rows:
+		for val in values.values():
+			if isinstance(val, SharedString):
+				indices.add(val.index)
+	strings = read_shared_strings(zf, part, indices)
+	for values in rows:
+		for col, val in values.items():
+			if isinstance(val, SharedString):
+				values[col] = strings.get(val.index)
+
+# Reads the scores from the "Scores" sheet of a spreadsheet created by generate.py
+# Returns a dict mapping (cid, pad) -> Score
+#
+# Only the Scores worksheet and the shared strings it uses are parsed, streaming through both,
+# so the size of the other sheets doesn't matter: the header row is read first to find the
+# columns, then only those columns are kept from the remaining rows
+def read_scores(frompath):
+	with zipfile.ZipFile(frompath) as zf:
+		(sheets, shared_strings_part) = find_parts(zf)
+		if not "Scores" in sheets:
+			raise Exception("Old scores spreadsheet doesn't contain a sheet named 'Scores'. Did you rename it?")
+		part = sheets["Scores"]
+		date_styles = read_date_styles(zf)
+
+		(row_num, header) = next(iter_rows(zf, part, lambda r, c: r == 1), (None, {}))
+		if row_num != 1:
+			header = {}
+		resolve_shared_strings(zf, shared_strings_part, [header])
+
+		pad_cols = {}
+		kbd_cols = {}
+		cid_col = None
+		for c, val in sorted(header.items()):
+			if val in PAD_HEADERS:
+				pad_cols[PAD_HEADERS.index(val)] = c
+			if val in KBD_HEADERS:
+				kbd_cols[KBD_HEADERS.index(val)] = c
+			if val == "CID":
+				cid_col = c
+
+		if cid_col == None:
+			raise Exception("Old 'Scores' sheet doesn't contain a column named 'CID'. Did you rename it?")
+
+		if pad_cols:
+			for i in range(4):
+				if not i in pad_cols:
+					print("WARNING: Pad scores available but column '%s' is missing" % PAD_HEADERS[i])
+		if kbd_cols:
+			for i in range(4):
+				if not i in kbd_cols:
+					print("WARNING: Keyboard scores available but column '%s' is missing" % KBD_HEADERS[i])
+
+		columns = set([cid_col]) | set(pad_cols.values()) | set(kbd_cols.values())
+		rows = [values for (row_num, values) in iter_rows(zf, part, lambda r, c: r > 1 and c in columns, date_styles) if row_num > 1]
+		resolve_shared_strings(zf, shared_strings_part, rows)
+
+	scores = {}
+	for values in rows:
+		cid = values.get(cid_col)
+		for (pad, cols) in ((True, pad_cols), (False, kbd_cols)):
+			if not cols: continue
+			passed = grade = miss = comment = None
+			if 0 in cols: passed  = values.get(cols[0])
+			if 1 in cols: grade   = values.get(cols[1])
+			if 2 in cols: miss    = values.get(cols[2])
+			if 3 in cols: comment = values.get(cols[3])
+			s = Score(cid, pad, passed, grade, miss, comment)
+			if not s.empty():
+				scores[(cid, pad)] = s
+	return scores
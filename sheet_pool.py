@@ -0,0 +1,162 @@
+from profiling import Stage, max_rss_mb
+from scores_reader import find_parts
+
+import openpyxl
+from openpyxl import Workbook
+from openpyxl.styles.cell_style import StyleArray
+from openpyxl.styles.numbers import BUILTIN_FORMATS_MAX_SIZE
+from openpyxl.worksheet._writer import WorksheetWriter
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+import re
+import shutil
+import tempfile
+import time
+import zipfile
+
+# Match the cell style index of <c>, <row> and <col> elements, and the differential style index of
+# <cfRule> elements, in a worksheet part
+STYLE_ATTR_REGEX = re.compile(rb'(<(?:c|row)\b[^>]*? s=")(\d+)"')
+COL_STYLE_ATTR_REGEX = re.compile(rb'(<col\b[^>]*? style=")(\d+)"')
+DXF_ATTR_REGEX = re.compile(rb'(<cfRule\b[^>]*? dxfId=")(\d+)"')
+
+# The oldest openpyxl whose worksheets can be spliced into another workbook: from 3.1 on, strings
+# are written inline, while older versions refer to the worker's own shared strings, which
+# save_with_sheets doesn't remap
+OPENPYXL_MIN_VERSION = (3, 1)
+
+# Returns the error that keeps sheets from being rendered in worker processes with the installed
+# openpyxl, if any
+def check_openpyxl_version():
+	version = tuple(int(part) for part in re.findall(r"\d+", openpyxl.__version__)[:2])
+	if version < OPENPYXL_MIN_VERSION:
+		return "--jobs requires openpyxl %s or later (installed: %s)" % (".".join(str(part) for part in OPENPYXL_MIN_VERSION), openpyxl.__version__)
+	return None
+
+# Set in each worker process by init_worker
+worker_render = None
+worker_state = None
+
+# A worksheet rendered by a worker process
+#
+# The worksheet XML is left in a temporary file, with style indices that refer to the worker's
+# own workbook; styles and dxfs hold the objects behind those indices so that save_with_sheets can
+# register them with the main workbook and rewrite the indices
+# stage is the profiling Stage of rendering it, if it was rendered by render_job
+class RenderedSheet:
+	def __init__(self, title, path, styles, dxfs, stage=None):
+		self.title = title
+		self.path = path
+		self.styles = styles
+		self.dxfs = dxfs
+		self.stage = stage
+
+def init_worker(render, state):
+	global worker_render, worker_state
+	worker_render = render
+	worker_state = state
+
+# Renders one job in a worker process: render(ws, job, state) draws on a fresh worksheet titled
+# job[0], which is then serialised on its own
+# The rendering is timed and counted in a profiling Stage, since the worker's own time, memory and
+# cells can't be measured from the main process
+def render_job(job):
+	stage = Stage(job[0], "worker %d" % os.getpid())
+	wall = time.perf_counter()
+	cpu = time.process_time()
+	wb = Workbook()
+	ws = wb.active
+	ws.title = job[0]
+	worker_render(ws, job, worker_state)
+	stage.count(ws.max_row, len(ws._cells))
+
+	fd, path = tempfile.mkstemp(suffix=".xml")
+	os.close(fd)
+	writer = WorksheetWriter(ws, out=path)
+	writer.write()
+	stage.wall_seconds = round(time.perf_counter() - wall, 4)
+	stage.cpu_seconds = round(time.process_time() - cpu, 4)
+	stage.max_rss_mb = max_rss_mb()
+
+	styles = []
+	for style in wb._cell_styles:
+		numfmt = None
+		if style.numFmtId >= BUILTIN_FORMATS_MAX_SIZE:
+			numfmt = wb._number_formats[style.numFmtId - BUILTIN_FORMATS_MAX_SIZE]
+		styles.append((
+			wb._fonts[style.fontId],
+			wb._fills[style.fillId],
+			wb._borders[style.borderId],
+			wb._protections[style.protectionId],
+			wb._alignments[style.alignmentId],
+			style.numFmtId, numfmt,
+			style.pivotButton, style.quotePrefix, style.xfId,
+		))
+	return RenderedSheet(ws.title, writer.out, styles, list(wb._differential_styles.styles), stage)
+
+# Renders every job with render(ws, job, state) in a pool of worker processes
+# Each job is a tuple whose first element is the title of its sheet
+# Returns a list of RenderedSheet, in the same order as jobs
+#
+# The state is sent to each worker once, when it starts, rather than with every job
+def render_sheets(jobs, render, state, workers):
+	with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(render, state)) as pool:
+		return list(pool.map(render_job, jobs))
+
+# Registers the styles used by a rendered sheet with wb
+# Returns (style index map, dxf index map) from the worker's indices to wb's
+def add_styles(wb, sheet):
+	style_map = []
+	for (font, fill, border, protection, alignment, numFmtId, numfmt, pivotButton, quotePrefix, xfId) in sheet.styles:
+		if numfmt != None:
+			numFmtId = wb._number_formats.add(numfmt) + BUILTIN_FORMATS_MAX_SIZE
+		style = StyleArray()
+		style.fontId = wb._fonts.add(font)
+		style.fillId = wb._fills.add(fill)
+		style.borderId = wb._borders.add(border)
+		style.protectionId = wb._protections.add(protection)
+		style.alignmentId = wb._alignments.add(alignment)
+		style.numFmtId = numFmtId
+		style.pivotButton = pivotButton
+		style.quotePrefix = quotePrefix
+		style.xfId = xfId
+		style_map.append(wb._cell_styles.add(style))
+	dxf_map = [wb._differential_styles.add(dxf) for dxf in sheet.dxfs]
+	return (style_map, dxf_map)
+
+# Returns the XML of a rendered sheet with its style indices rewritten for the main workbook
+def remap_sheet(sheet, style_map, dxf_map):
+	with open(sheet.path, "rb") as f:
+		xml = f.read()
+	xml = STYLE_ATTR_REGEX.sub(lambda m: b'%s%d"' % (m.group(1), style_map[int(m.group(2))]), xml)
+	xml = COL_STYLE_ATTR_REGEX.sub(lambda m: b'%s%d"' % (m.group(1), style_map[int(m.group(2))]), xml)
+	xml = DXF_ATTR_REGEX.sub(lambda m: b'%s%d"' % (m.group(1), dxf_map[int(m.group(2))]), xml)
+	return xml
+
+# Saves wb to outpath, replacing each of its (empty) sheets that has the same title as one of the
+# rendered sheets with the rendered one
+def save_with_sheets(wb, outpath, sheets):
+	maps = {sheet.title: add_styles(wb, sheet) for sheet in sheets}
+
+	fd, tmppath = tempfile.mkstemp(suffix=".xlsx", dir=os.path.dirname(os.path.abspath(outpath)))
+	os.close(fd)
+	try:
+		wb.save(tmppath)
+		with zipfile.ZipFile(tmppath) as src:
+			(parts, _) = find_parts(src)
+			replace = {parts[sheet.title]: sheet for sheet in sheets}
+			with zipfile.ZipFile(outpath, "w", zipfile.ZIP_DEFLATED) as dst:
+				for info in src.infolist():
+					if info.filename in replace:
+						sheet = replace[info.filename]
+						(style_map, dxf_map) = maps[sheet.title]
+						dst.writestr(info, remap_sheet(sheet, style_map, dxf_map))
+					else:
+						with src.open(info) as f_src, dst.open(info, "w") as f_dst:
+							shutil.copyfileobj(f_src, f_dst)
+	finally:
+		os.remove(tmppath)
+		for sheet in sheets:
+			if os.path.exists(sheet.path):
+				os.remove(sheet.path)
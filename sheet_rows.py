@@ -0,0 +1,245 @@
+from parse_pump_out import read_database, SNAPSHOT_ATTRIBUTES
+from database_cache import read_database_cached
+from parse_config import config_all
+from scores_reader import PAD_HEADERS, KBD_HEADERS
+from profiling import NO_PROFILE
+
+# What the sheets of a score spreadsheet hold, worked out from the database: the charts each one
+# lists, in order, and the values of their rows
+# generate.py lays these rows out in a workbook, and export.py streams them to CSV or SQLite; this
+# module doesn't use openpyxl, so that exporting doesn't need it
+
+# The sheets that can be selected with --sheets, in the order they are written
+SHEET_SCORES   = "scores"   # Scores
+SHEET_SUMMARY  = "summary"  # Summary (Pad/Kbd) <mix>
+SHEET_DATA     = "data"     # Data
+SHEET_COMPLETE = "complete" # Data (Complete)
+SHEET_ABOUT    = "about"    # About
+ALL_SHEETS = [SHEET_SCORES, SHEET_SUMMARY, SHEET_DATA, SHEET_COMPLETE, SHEET_ABOUT]
+
+# The name of the range that the lookups of the score sheet search, defined by generate.py: the CID
+# to Difficulty columns of Data (Complete), sorted by CID
+NAME_COMPLETE = "CompleteLookup"
+
+# Returns the set of optional database attributes (see parse_pump_out.read_database) needed to
+# write the given sheets
+def sheet_attributes(sheets):
+	attributes = set()
+	if SHEET_DATA in sheets or SHEET_COMPLETE in sheets:
+		attributes |= SNAPSHOT_ATTRIBUTES
+	return attributes
+
+# Reads the database, or loads it from the cache directory if one is given, with the attributes
+# that the selected sheets show
+# If chart_filter is a config, the charts are filtered by SQLite as they are read (see sql_filter)
+def load_database(dbpath, cachedir, cache_size, sheets, chart_filter=None, profile=NO_PROFILE):
+	attributes = sheet_attributes(sheets)
+	with profile.stage("read_database") as stage:
+		if cachedir:
+			print("Reading database file (cache: %s)..." % cachedir)
+			db, hit = read_database_cached(dbpath, cachedir, cache_size, attributes, chart_filter, profile)
+			print(("Database not found in cache; parsed and stored it","Database loaded from cache")[hit])
+		else:
+			print("Reading database file...")
+			db = read_database(dbpath, attributes, chart_filter, profile)
+		stage.count(len(db.charts))
+	return db
+
+# Returns ({mix id: set of cids}, set of all those cids) for the charts that pass the config's
+# filters in each of its mixes
+# The set of each mix depends only on the mix and the config's mode and difficulty filters, so if
+# a cache dict is given, the sets are kept in it and shared between configs that filter alike
+def filter_charts(db, config, cache=None):
+	mix_to_charts = {}
+	all_filtered_charts = set()
+	for mid in config.mix_ids:
+		if db.filtered_charts != None:
+			mix_to_charts[mid] = db.filtered_charts[mid]
+			all_filtered_charts |= db.filtered_charts[mid]
+			continue
+		key = (mid, frozenset(config.mode_ids), config.diff_min, config.diff_max, config.unrated)
+		if cache != None and key in cache:
+			mix_to_charts[mid] = cache[key]
+			all_filtered_charts |= cache[key]
+			continue
+		charts = set()
+		for cid in db.charts.keys():
+			ver = db.chart_version_in_mix(cid, mid)
+			if ver != None:
+				rating = db.chart_rating(cid, ver)
+				if rating != None and rating.mode in config.mode_ids:
+					diff = rating.difficulty
+					if diff == None and config.unrated:
+						charts.add(cid)
+						continue
+					if diff != None and (diff >= config.diff_min and diff <= config.diff_max):
+						charts.add(cid)
+						continue
+		mix_to_charts[mid] = charts
+		all_filtered_charts |= charts
+		if cache != None:
+			cache[key] = charts
+	return (mix_to_charts, all_filtered_charts)
+
+def get_latest_filtered_mix(db, mixes):
+	latest = -1
+	for mid in mixes:
+		if latest == -1:
+			latest = mid
+		elif db.mixes[mid].order > db.mixes[latest].order:
+			latest = mid
+	return latest
+
+# Returns the charts of chart_set in the order in which the sheets list them at version fver (see
+# Database.sorted_charts)
+def sort_charts(db, chart_set, fver, config):
+	return [cid for cid in db.sorted_charts(fver, config.down) if cid in chart_set]
+
+# Returns (headers, rows) of a data sheet, where rows yields the list of values of each chart's row
+# If chart_set or config is None, all the charts or all the mixes are listed
+# If by_cid is True, the charts are sorted by CID (so that they can be looked up with a binary
+# search) instead of by mode and difficulty
+def data_sheet_rows(db, chart_set, config, by_cid=False):
+	if chart_set == None:
+		chart_set = set(db.charts)
+	if config == None:
+		config = config_all(db)
+
+	fmix = get_latest_filtered_mix(db, config.mix_ids)
+	fver = db.newest_version_from_mix(fmix)
+
+	if by_cid:
+		charts = sorted(chart_set)
+	else:
+		charts = sort_charts(db, chart_set, fver, config)
+
+	headers = [
+		"CID", # A
+		"SID", # B
+		"GID", # C
+		"Title", # D
+		"Cut", # E
+		"Mode", # F
+		"Difficulty", # G
+		"First Seen", # H
+		"Last Seen", # I
+		"BPM", # J
+		"Category", # K
+		"Stepmaker", # L
+	]
+	headers += config.mixes
+	headers += [
+		"Labels",
+		"Card",
+		"Comment"
+	]
+	return (headers, data_sheet_values(db, charts, config, fver))
+
+# Yields the values of the data sheet row of each chart, in order
+def data_sheet_values(db, charts, config, fver):
+	snapshot = db.snapshot(fver)
+	lifetimes = db.chart_lifetimes()
+	for cid in charts:
+		row = snapshot[cid]
+		lifetime = lifetimes[cid]
+
+		game_id = row.game_id
+		if game_id == None: game_id = ""
+
+		first_seen = last_seen = "???"
+		if lifetime.introduced != None:
+			first_seen = db.version_title(lifetime.introduced)
+		if lifetime.last_seen != None:
+			last_seen = db.version_title(lifetime.last_seen)
+
+		values = [cid, row.sid, game_id, row.title, row.cut, row.mode, row.difficulty, first_seen, last_seen, row.bpm, row.category, row.stepmaker]
+		values += ["NY"[db.chart_in_mix(cid, mid)] for mid in config.mix_ids]
+		values += [",".join(row.labels), row.card, row.comment]
+		yield values
+
+# Returns (headers, summary key headers, rows) of the score sheet, where rows yields
+# (cid, {column number: value}) for every column of a chart other than its scores
+# If lookup is False, the title/cut/mode/difficulty columns hold values instead of lookups into
+# the Data (Complete) sheet, which is then not required
+# If mix_to_charts is given, hidden columns after History hold the summary key (see summary_key)
+# of each chart in each of the config's mixes, for the summary sheets
+def score_sheet_rows(db, chart_set, config, lookup=True, mix_to_charts=None):
+	latest_filtered_mix = get_latest_filtered_mix(db, config.mix_ids)
+	fver = db.newest_version_from_mix(latest_filtered_mix)
+
+	charts = sort_charts(db, chart_set, fver, config)
+
+	mixes = config.mix_ids
+	if len(mixes) == 1:
+		mixes = []
+
+	headers = [
+		"CID",           # A
+		"Title",         # B
+		"Cut",           # C
+		"Mode",          # D
+		"Difficulty",    # E
+	]
+	if config.pad:
+		headers += PAD_HEADERS   # F
+	if config.keyboard:
+		headers += KBD_HEADERS   # F J
+	col_mix = len(headers) + 1
+	headers += [db.mixes[m].title for m in mixes] # F J N
+	headers += ["History"]
+	col_keys = len(headers) + 1
+	key_headers = []
+	if mix_to_charts != None:
+		key_headers = ["Summary Key (%s)" % db.mixes[m].title for m in config.mix_ids]
+
+	return (headers, key_headers, score_sheet_values(db, charts, config, lookup, mix_to_charts, mixes, col_mix, col_keys))
+
+def score_sheet_values(db, charts, config, lookup, mix_to_charts, mixes, col_mix, col_keys):
+	# The version shown by the Data (Complete) sheet
+	cver = db.newest_version_from_mix(get_latest_filtered_mix(db, db.mixes))
+
+	for i, cid in enumerate(charts):
+		values = {1: cid}
+		if lookup:
+			# Data (Complete) is sorted by CID, so an approximate VLOOKUP does a binary search; it
+			# returns the nearest lower CID for a missing one, hence the check
+			for col in range(2, 6):
+				values[col] = "=IF(VLOOKUP(A%d, %s, 1, TRUE)=A%d, VLOOKUP(A%d, %s, %d, TRUE), NA())" % (i+2, NAME_COMPLETE, i+2, i+2, NAME_COMPLETE, col+2)
+		else:
+			sid = db.chart_song(cid)
+			values[2] = db.song_title(sid, cver)
+			values[3] = db.song_cut_str(sid)
+			values[4] = db.chart_mode_str(cid, cver)
+			values[5] = db.chart_difficulty_str(cid, cver)
+
+		for j, mid in enumerate(mixes):
+			values[col_mix+j] = "NY"[db.chart_in_mix(cid, mid)]
+		values[col_mix+len(mixes)] = db.chart_rating_sequence_str(cid, changes_only=True)
+		if mix_to_charts != None:
+			for j, mid in enumerate(config.mix_ids):
+				if not cid in mix_to_charts[mid]: continue
+				group = summary_group(db, cid, mid)
+				if group != None:
+					values[col_keys+j] = summary_key(*group)
+		yield (cid, values)
+
+# Returns (table number, difficulty) of a chart in the summary sheets of a mix, or None if it
+# doesn't belong in any of their tables
+def summary_group(db, cid, mid):
+	ver = db.chart_version_in_mix(cid, mid)
+
+	# The tables are those of the kinds of modes, in the order of MODE_KIND_*
+	mode = db.chart_mode(cid, ver)
+	if mode == None: return None
+	table_num = db.modes[mode].kind
+	if table_num == None: return None
+
+	return (table_num, db.chart_difficulty(cid, ver))
+
+# Returns the text that identifies a row of the summary tables, written next to each chart on the
+# Scores sheet for the summary formulas to match; Excel can't mistake it for a number or a date,
+# and it has no wildcard characters
+def summary_key(table_num, difficulty):
+	if difficulty == None:
+		return "T%d D--" % table_num
+	return "T%d D%02d" % (table_num, difficulty)
@@ -0,0 +1,261 @@
+from scores_reader import SharedString, find_parts, iter_rows, local_name, read_relationships, string_item_text
+from sheet_pool import RenderedSheet
+from xlsx_writer import row_xml
+
+from openpyxl.styles.numbers import BUILTIN_FORMATS_MAX_SIZE
+from openpyxl.styles.stylesheet import Stylesheet
+from openpyxl.xml.functions import fromstring
+
+from itertools import zip_longest
+import os
+import posixpath
+import re
+import tempfile
+import xml.etree.ElementTree as ET
+import zipfile
+
+REL_STYLES = "/styles"
+
+# Match a cell that refers to a shared string, any such cell left over, a shared string item, and
+# the attribute that selects a sheet's tab, in the XML of a worksheet or of the shared strings
+SHARED_STRING_CELL_REGEX = re.compile(rb'<c\b([^>]*?) t="s"([^>]*)>\s*<v>(\d+)</v>\s*</c>')
+SHARED_STRING_LEFT_REGEX = re.compile(rb'<c\b[^>]*? t="s"')
+STRING_ITEM_REGEX = re.compile(rb'<si>(.*?)</si>|<si/>', re.S)
+TAB_SELECTED_REGEX = re.compile(rb' tabSelected="(?:1|true)"')
+
+# Match the rows of a worksheet part, with their row number, and the last row of its dimension
+SHEET_DATA_REGEX = re.compile(rb'<sheetData\s*/>|<sheetData>.*?</sheetData>', re.S)
+ROW_REGEX = re.compile(rb'<row\b[^>]*? r="(\d+)"[^>]*?(?:/>|>.*?</row>)', re.S)
+DIMENSION_REGEX = re.compile(rb'(<dimension ref="[A-Z]+\d+:[A-Z]+)\d+"')
+
+# What changed in a sheet since it was last written
+# If the rows were compared by key, added, removed and changed list the keys of the rows that were
+# added, removed or changed (the header row left aside), old_rows maps the number of each old row
+# to its values as normalize_row returns them, and new_rows lists the rows that were compared
+class SheetChanges:
+	def __init__(self, same, added=None, removed=None, changed=None, old_rows=None, new_rows=None):
+		self.same = same
+		self.added = added
+		self.removed = removed
+		self.changed = changed
+		self.old_rows = old_rows
+		self.new_rows = new_rows
+
+# Returns a value as it compares with the value read back from a worksheet: empty strings are
+# empty cells, and numbers are kept to the precision that both backends write
+def normalize(value):
+	if value == "":
+		return None
+	if isinstance(value, (int, float)) and not isinstance(value, bool):
+		return float("%.15g" % value)
+	return value
+
+# Returns the {column number: value} of a row, keeping only the cells for which
+# wanted(row number, column number) is True and that aren't empty
+def normalize_row(r, values, wanted):
+	normalized = {}
+	for (c, v) in values.items():
+		if not wanted(r, c): continue
+		v = normalize(v)
+		if v != None:
+			normalized[c] = v
+	return normalized
+
+# Yields (row number, {column number: value}) for rows given the same way, normalized by
+# normalize_row and leaving out empty rows
+def normalize_rows(rows, wanted):
+	for (r, values) in rows:
+		normalized = normalize_row(r, values, wanted)
+		if normalized:
+			yield (r, normalized)
+
+# An existing spreadsheet created by generate.py, which an update compares with the sheets it
+# would create, and from which it copies the sheets that are still up to date
+#
+# The worksheets are streamed like the scores are (see scores_reader), and are copied as raw XML,
+# so that neither costs as much as loading the workbook with openpyxl
+class OldWorkbook:
+	def __init__(self, path):
+		self.path = path
+		self.zf = zipfile.ZipFile(path)
+		(self.parts, self.shared_strings_part) = find_parts(self.zf)
+		self.titles = list(self.parts)
+		self.names = set(self.zf.namelist())
+		self.strings = None
+		self.raw_strings = None
+		self.styles = None
+
+	def close(self):
+		self.zf.close()
+
+	# Returns the text of every shared string, in order
+	def shared_strings(self):
+		if self.strings == None:
+			self.strings = []
+			if self.shared_strings_part != None:
+				with self.zf.open(self.shared_strings_part) as f:
+					for event, el in ET.iterparse(f, events=("end",)):
+						if local_name(el.tag) != "si": continue
+						self.strings.append(string_item_text(el))
+						el.clear()
+		return self.strings
+
+	# Returns the XML content of every shared string, in order, which is also valid inline
+	def raw_shared_strings(self):
+		if self.raw_strings == None:
+			self.raw_strings = []
+			if self.shared_strings_part != None:
+				xml = self.zf.read(self.shared_strings_part)
+				self.raw_strings = [m.group(1) or b"" for m in STRING_ITEM_REGEX.finditer(xml)]
+		return self.raw_strings
+
+	# Yields (row number, {column number: value}) for each row of a sheet, like iter_rows, with
+	# the shared strings resolved
+	def rows(self, title, wanted):
+		strings = None
+		for (r, values) in iter_rows(self.zf, self.parts[title], wanted):
+			for (c, v) in values.items():
+				if isinstance(v, SharedString):
+					if strings == None:
+						strings = self.shared_strings()
+					values[c] = strings[v.index] if v.index < len(strings) else None
+			yield (r, values)
+
+	# Returns the value of a cell, or None if the sheet or the cell doesn't exist
+	def cell(self, title, row, column):
+		if not title in self.parts:
+			return None
+		for (r, values) in self.rows(title, lambda r, c: r == row and c == column):
+			if r >= row:
+				return values.get(column)
+		return None
+
+	# Compares a sheet with the rows that would replace it, given as (row number, {column number:
+	# value}) in order, where only the cells for which wanted(row number, column number) is True
+	# matter
+	# If key_column is given, the rows below the header are also matched up by the value of that
+	# column, to tell which were added, removed or changed; otherwise both stop being read at the
+	# first difference
+	# Returns a SheetChanges
+	def compare_sheet(self, title, rows, wanted, key_column=None):
+		if not title in self.parts:
+			return SheetChanges(False)
+		old = normalize_rows(self.rows(title, wanted), wanted)
+		new = normalize_rows(rows, wanted)
+		if key_column == None:
+			return SheetChanges(all(a == b for (a, b) in zip_longest(old, new)))
+
+		old = list(old)
+		rows = list(rows)
+		new = list(normalize_rows(rows, wanted))
+		changes = SheetChanges(old == new, old_rows=dict(old), new_rows=rows)
+		old_rows = {values.get(key_column): values for (r, values) in old if r > 1}
+		new_rows = {values.get(key_column): values for (r, values) in new if r > 1}
+		changes.added = [key for key in new_rows if not key in old_rows]
+		changes.removed = [key for key in old_rows if not key in new_rows]
+		changes.changed = [key for key in new_rows if key in old_rows and new_rows[key] != old_rows[key]]
+		return changes
+
+	# Returns the styles and differential styles of the workbook, in the form of those of a
+	# RenderedSheet, loading them the first time
+	def sheet_styles(self):
+		if self.styles == None:
+			part = "xl/styles.xml"
+			for (rtype, path) in read_relationships(self.zf, "xl/_rels/workbook.xml.rels").values():
+				if rtype.endswith(REL_STYLES):
+					part = path
+			stylesheet = Stylesheet.from_tree(fromstring(self.zf.read(part)))
+			styles = []
+			for style in stylesheet.cell_styles:
+				numfmt = None
+				if style.numFmtId >= BUILTIN_FORMATS_MAX_SIZE:
+					numfmt = stylesheet.number_formats[style.numFmtId - BUILTIN_FORMATS_MAX_SIZE]
+				# Named styles aren't carried over, so every style is based on the default one
+				styles.append((
+					stylesheet.fonts[style.fontId],
+					stylesheet.fills[style.fillId],
+					stylesheet.borders[style.borderId],
+					stylesheet.protections[style.protectionId],
+					stylesheet.alignments[style.alignmentId],
+					style.numFmtId, numfmt,
+					style.pivotButton, style.quotePrefix, 0,
+				))
+			self.styles = (styles, list(stylesheet.dxfs))
+		return self.styles
+
+	# Returns True if a sheet can be copied by copy_sheet: it mustn't have relationships to other
+	# parts, such as comments, drawings or tables
+	def can_copy(self, title):
+		part = self.parts[title]
+		rels = posixpath.join(posixpath.dirname(part), "_rels", posixpath.basename(part) + ".rels")
+		return not rels in self.names
+
+	# Copies a sheet as it is, with its cell values, formatting and layout, to a RenderedSheet that
+	# save_with_sheets can put in a new workbook
+	# Returns None if the sheet can't be copied (see can_copy)
+	def copy_sheet(self, title):
+		if not self.can_copy(title):
+			return None
+		return self.rendered_sheet(title, self.zf.read(self.parts[title]))
+
+	# Copies a sheet like copy_sheet, except that its rows are replaced by the new rows of changes
+	# (as compared by compare_sheet with a key column): the old rows that are the same as the new
+	# ones are kept, with their formatting, and the others are written anew, without any
+	# The header row is expected to be the same, so that the layout of the sheet still fits
+	# Returns None if the sheet can't be copied
+	def patch_sheet(self, title, changes, wanted):
+		if not self.can_copy(title):
+			return None
+		xml = self.zf.read(self.parts[title])
+		sheet_data = SHEET_DATA_REGEX.search(xml)
+		if sheet_data == None:
+			return None
+		old_xml = {int(m.group(1)): m.group(0) for m in ROW_REGEX.finditer(xml, sheet_data.start(), sheet_data.end())}
+
+		rows = []
+		last = 0
+		for (r, values) in changes.new_rows:
+			normalized = normalize_row(r, values, wanted)
+			if not normalized: continue
+			if r in old_xml and changes.old_rows.get(r) == normalized:
+				rows.append(old_xml[r])
+			else:
+				cells = [(c, values[c], 0) for c in sorted(values) if values[c] != None]
+				rows.append(row_xml(r, cells).encode("utf-8"))
+			last = r
+
+		rows = b"<sheetData>%s</sheetData>" % b"".join(rows)
+		xml = xml[:sheet_data.start()] + rows + xml[sheet_data.end():]
+		xml = DIMENSION_REGEX.sub(lambda m: b'%s%d"' % (m.group(1), max(last, 1)), xml, 1)
+		return self.rendered_sheet(title, xml)
+
+	# Returns a RenderedSheet with the XML of one of the sheets, which refers to the styles and
+	# shared strings of this workbook
+	# Returns None if the XML can't be made to stand on its own
+	def rendered_sheet(self, title, xml):
+		# The shared strings go with the old workbook, so they become inline strings
+		strings = self.raw_shared_strings()
+		def inline(m):
+			i = int(m.group(3))
+			if i >= len(strings):
+				return m.group(0)
+			return b'<c%s t="inlineStr"%s><is>%s</is></c>' % (m.group(1), m.group(2), strings[i])
+		xml = SHARED_STRING_CELL_REGEX.sub(inline, xml)
+		if SHARED_STRING_LEFT_REGEX.search(xml):
+			return None
+		# The new workbook selects its own tab
+		xml = TAB_SELECTED_REGEX.sub(b"", xml)
+
+		fd, path = tempfile.mkstemp(suffix=".xml")
+		with os.fdopen(fd, "wb") as f:
+			f.write(xml)
+		(styles, dxfs) = self.sheet_styles()
+		return RenderedSheet(title, path, styles, dxfs)
+
+	# Returns [(name, formula)] for the names defined for the whole workbook
+	def defined_names(self):
+		names = []
+		for el in ET.fromstring(self.zf.read("xl/workbook.xml")).iter():
+			if local_name(el.tag) == "definedName" and el.get("localSheetId") == None:
+				names.append((el.get("name"), el.text))
+		return names
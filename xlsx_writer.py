@@ -0,0 +1,459 @@
+from openpyxl import Workbook as OpenpyxlWorkbook
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE, ERROR_CODES, TIME_TYPES, get_time_format
+from openpyxl.formatting.formatting import ConditionalFormattingList
+from openpyxl.styles.differential import DifferentialStyle
+from openpyxl.styles.numbers import BUILTIN_FORMATS, BUILTIN_FORMATS_MAX_SIZE, BUILTIN_FORMATS_REVERSE, is_date_format
+from openpyxl.styles.stylesheet import write_stylesheet
+from openpyxl.utils import get_column_letter, column_index_from_string
+from openpyxl.utils.cell import coordinate_from_string
+from openpyxl.utils.datetime import to_excel
+from openpyxl.utils.exceptions import IllegalCharacterError
+from openpyxl.workbook.defined_name import DefinedNameDict, DefinedNameList
+from openpyxl.writer.theme import theme_xml
+from openpyxl.xml.functions import tostring
+
+from copy import copy
+import datetime
+import shutil
+import tempfile
+import zipfile
+
+# A minimal XLSX writer that serialises SpreadsheetML directly, for the subset of features that
+# generate.py uses: values, formulas, fonts, fills, borders, alignment, merged cells, conditional
+# formatting, column widths, hidden columns and frozen panes
+#
+# It mirrors the parts of openpyxl's Workbook/Worksheet/Cell API that generate.py calls, so the
+# same sheet writers work with either, and reuses openpyxl's style objects and stylesheet
+# serialisation. Cells are stored as plain [value, style id] pairs instead of objects, and rows
+# added with Worksheet.append are written to a temporary file straight away unless cells have been
+# set out of order with Worksheet.cell
+
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+REL_DOCUMENT = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"
+REL_WORKSHEET = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"
+REL_STYLES = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles"
+REL_THEME = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/theme"
+REL_CORE = "http://schemas.openxmlformats.org/package/2006/relationships/metadata/core-properties"
+REL_APP = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/extended-properties"
+CT_WORKBOOK = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"
+CT_WORKSHEET = "application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"
+CT_STYLES = "application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"
+CT_THEME = "application/vnd.openxmlformats-officedocument.theme+xml"
+CT_CORE = "application/vnd.openxmlformats-package.core-properties+xml"
+CT_APP = "application/vnd.openxmlformats-officedocument.extended-properties+xml"
+
+# Maps a style attribute of Cell -> (name of the Workbook collection, name of the StyleArray field)
+STYLE_FIELDS = {
+	"font": ("_fonts", "fontId"),
+	"fill": ("_fills", "fillId"),
+	"border": ("_borders", "borderId"),
+	"alignment": ("_alignments", "alignmentId"),
+	"protection": ("_protections", "protectionId"),
+}
+
+# Column letters by column number, filled in as needed
+COLUMN_LETTERS = [None]
+
+def column_letter(col):
+	while len(COLUMN_LETTERS) <= col:
+		COLUMN_LETTERS.append(get_column_letter(len(COLUMN_LETTERS)))
+	return COLUMN_LETTERS[col]
+
+def escape(text):
+	if "&" in text: text = text.replace("&", "&amp;")
+	if "<" in text: text = text.replace("<", "&lt;")
+	if ">" in text: text = text.replace(">", "&gt;")
+	return text
+
+def escape_attr(text):
+	return escape(text).replace('"', "&quot;")
+
+# Returns the XML of one cell, following the conventions of openpyxl's writer (inline strings,
+# "=..." strings as formulas, numbers formatted with %.16g, dates and times as serial numbers)
+def cell_xml(ref, value, style_id):
+	s = ' s="%d"' % style_id if style_id else ""
+	t = type(value)
+	if value is None:
+		if not style_id: return ""
+		return '<c r="%s"%s/>' % (ref, s)
+	if t is bool:
+		return '<c r="%s"%s t="b"><v>%d</v></c>' % (ref, s, value)
+	if t is int and -10**15 < value < 10**15:
+		return '<c r="%s"%s t="n"><v>%d</v></c>' % (ref, s, value)
+	if t is int or t is float:
+		return '<c r="%s"%s t="n"><v>%.16g</v></c>' % (ref, s, value)
+	if isinstance(value, TIME_TYPES):
+		return '<c r="%s"%s t="n"><v>%.16g</v></c>' % (ref, s, to_excel(value))
+	if t is not str:
+		raise ValueError("Cannot convert %r to Excel" % (value,))
+	if ILLEGAL_CHARACTERS_RE.search(value):
+		raise IllegalCharacterError("%r cannot be used in worksheets." % value)
+	if len(value) > 1 and value[0] == "=":
+		return '<c r="%s"%s><f>%s</f><v></v></c>' % (ref, s, escape(value[1:]))
+	if value in ERROR_CODES:
+		return '<c r="%s"%s t="e"><v>%s</v></c>' % (ref, s, value)
+	if value == "":
+		return '<c r="%s"%s t="inlineStr"/>' % (ref, s)
+	space = ""
+	stripped = value.strip()
+	if stripped and stripped != value:
+		space = ' xml:space="preserve"'
+	return '<c r="%s"%s t="inlineStr"><is><t%s>%s</t></is></c>' % (ref, s, space, escape(value))
+
+class ColumnDimension:
+	__slots__ = ("width", "hidden")
+
+	def __init__(self):
+		self.width = None
+		self.hidden = False
+
+class ColumnDimensions(dict):
+	def __missing__(self, key):
+		dim = self[key] = ColumnDimension()
+		return dim
+
+# A reference to one cell of a Worksheet, created on demand by Worksheet.cell
+class Cell:
+	__slots__ = ("parent", "row", "column")
+
+	def __init__(self, parent, row, column):
+		self.parent = parent
+		self.row = row
+		self.column = column
+
+	@property
+	def coordinate(self):
+		return "%s%d" % (column_letter(self.column), self.row)
+
+	@property
+	def value(self):
+		return self.parent._get(self.row, self.column)[0]
+
+	@value.setter
+	def value(self, value):
+		if isinstance(value, TIME_TYPES):
+			self.parent._set(self.row, self.column, 1, self.parent.parent._date_style(self.style_id, value))
+		self.parent._set(self.row, self.column, 0, value)
+
+	@property
+	def style_id(self):
+		return self.parent._get(self.row, self.column)[1]
+
+	def _get_style(self, name):
+		(collection, field) = STYLE_FIELDS[name]
+		wb = self.parent.parent
+		return getattr(wb, collection)[getattr(wb._cell_styles[self.style_id], field)]
+
+	def _set_style(self, name, obj):
+		self.parent._set(self.row, self.column, 1, self.parent.parent._restyle(self.style_id, name, obj))
+
+	font = property(lambda self: self._get_style("font"), lambda self, obj: self._set_style("font", obj))
+	fill = property(lambda self: self._get_style("fill"), lambda self, obj: self._set_style("fill", obj))
+	border = property(lambda self: self._get_style("border"), lambda self, obj: self._set_style("border", obj))
+	alignment = property(lambda self: self._get_style("alignment"), lambda self, obj: self._set_style("alignment", obj))
+	protection = property(lambda self: self._get_style("protection"), lambda self, obj: self._set_style("protection", obj))
+
+class Worksheet:
+	def __init__(self, parent, title):
+		self.parent = parent
+		self.title = title
+		self.column_dimensions = ColumnDimensions()
+		self.freeze_panes = None
+		self.merged_cells = []
+		self.conditional_formatting = ConditionalFormattingList()
+		# Maps (row, column) -> [value, style id] for cells not yet written out
+		self._cells = {}
+		# Temporary file holding the XML of the rows written out by append, in order
+		self._rows_file = None
+		# The last row written to _rows_file
+		self._written_row = 0
+		self._max_row = 0
+		self._max_column = 0
+		# The number of cells set so far, including those written out
+		self._cell_count = 0
+
+	@property
+	def max_row(self):
+		return self._max_row
+
+	@property
+	def max_column(self):
+		return self._max_column
+
+	def _get(self, row, column):
+		return self._cells.get((row, column), (None, 0))
+
+	def _set(self, row, column, index, value):
+		if row <= self._written_row:
+			raise ValueError("row %d of sheet %s has already been written" % (row, self.title))
+		cell = self._cells.get((row, column))
+		if cell == None:
+			cell = self._cells[(row, column)] = [None, 0]
+			self._cell_count += 1
+			self._max_row = max(self._max_row, row)
+			self._max_column = max(self._max_column, column)
+		cell[index] = value
+
+	def cell(self, row, column, value=None):
+		c = Cell(self, row, column)
+		if value != None:
+			c.value = value
+		return c
+
+	def merge_cells(self, range_string):
+		self.merged_cells.append(range_string)
+
+	# Adds a row after the last one that has any cells
+	# Values may also be openpyxl cells (e.g. WriteOnlyCell) created on this sheet, to set styles
+	def append(self, values):
+		row = self._max_row + 1
+		cells = []
+		for col, value in enumerate(values, 1):
+			style_id = 0
+			if hasattr(value, "_style"):
+				style_id = self.parent._style_id(value._style)
+				value = value._value
+			if isinstance(value, TIME_TYPES):
+				style_id = self.parent._date_style(style_id, value)
+			if value is None and not style_id: continue
+			cells.append((col, value, style_id))
+		self._max_row = row
+		self._cell_count += len(cells)
+		if cells:
+			self._max_column = max(self._max_column, cells[-1][0])
+
+		# Rows can be written out immediately as long as no later cells are waiting
+		if self._cells:
+			for (col, value, style_id) in cells:
+				self._cells[(row, col)] = [value, style_id]
+			return
+		if self._rows_file == None:
+			self._rows_file = tempfile.TemporaryFile()
+		self._rows_file.write(row_xml(row, cells).encode("utf-8"))
+		self._written_row = row
+
+	# Returns the <sheetViews> element
+	def _views_xml(self):
+		if self.freeze_panes == None or self.freeze_panes == "A1":
+			return '<sheetViews><sheetView workbookViewId="0"><selection activeCell="A1" sqref="A1"/></sheetView></sheetViews>'
+		(letter, row) = coordinate_from_string(self.freeze_panes)
+		column = column_index_from_string(letter)
+		attrs = ""
+		if column > 1:
+			attrs += ' xSplit="%d"' % (column - 1)
+		if row > 1:
+			attrs += ' ySplit="%d"' % (row - 1)
+		active = "topRight"
+		if row > 1:
+			active = ("bottomLeft", "bottomRight")[column > 1]
+		selections = '<selection pane="%s" activeCell="A1" sqref="A1"/>' % active
+		if row > 1 and column > 1:
+			selections = '<selection pane="topRight"/><selection pane="bottomLeft"/>' + selections
+		return '<sheetViews><sheetView workbookViewId="0"><pane%s topLeftCell="%s" activePane="%s" state="frozen"/>%s</sheetView></sheetViews>' % (
+			attrs, self.freeze_panes, active, selections)
+
+	# Returns the <cols> element
+	def _cols_xml(self):
+		cols = []
+		for (key, dim) in self.column_dimensions.items():
+			index = column_index_from_string(key)
+			attrs = ""
+			if dim.width != None:
+				attrs += ' width="%s" customWidth="1"' % dim.width
+			if dim.hidden:
+				attrs += ' hidden="1"'
+			if attrs:
+				cols.append((index, '<col min="%d" max="%d"%s/>' % (index, index, attrs)))
+		if not cols:
+			return ""
+		return "<cols>%s</cols>" % "".join(xml for (index, xml) in sorted(cols))
+
+	# Returns the elements that follow <sheetData>
+	def _tail_xml(self):
+		xml = ""
+		if self.merged_cells:
+			xml += '<mergeCells count="%d">%s</mergeCells>' % (len(self.merged_cells),
+				"".join('<mergeCell ref="%s"/>' % ref for ref in self.merged_cells))
+		empty = DifferentialStyle()
+		for cf in self.conditional_formatting:
+			for rule in cf.rules:
+				if rule.dxf and rule.dxf != empty:
+					rule.dxfId = self.parent._differential_styles.add(rule.dxf)
+			xml += tostring(cf.to_tree()).decode("utf-8")
+		xml += '<pageMargins left="0.75" right="0.75" top="1" bottom="1" header="0.5" footer="0.5"/>'
+		return xml
+
+	# Writes the worksheet part to f (a binary file)
+	def _write(self, f):
+		dimension = "A1"
+		if self._max_row and self._max_column:
+			dimension = "A1:%s%d" % (column_letter(self._max_column), self._max_row)
+		f.write((XML_HEADER + '<worksheet xmlns="%s" xmlns:r="%s"><dimension ref="%s"/>%s<sheetFormatPr baseColWidth="8" defaultRowHeight="15"/>%s<sheetData>' % (
+			NS_MAIN, NS_REL, dimension, self._views_xml(), self._cols_xml())).encode("utf-8"))
+
+		if self._rows_file != None:
+			self._rows_file.seek(0)
+			shutil.copyfileobj(self._rows_file, f)
+			self._rows_file.close()
+			self._rows_file = None
+
+		rows = {}
+		for ((row, col), (value, style_id)) in self._cells.items():
+			rows.setdefault(row, []).append((col, value, style_id))
+		for row in sorted(rows):
+			f.write(row_xml(row, sorted(rows[row])).encode("utf-8"))
+		self._cells = {}
+
+		f.write(("</sheetData>%s</worksheet>" % self._tail_xml()).encode("utf-8"))
+
+# Returns the XML of one row, given a list of (column, value, style id) sorted by column
+def row_xml(row, cells):
+	r = "%d" % row
+	return '<row r="%s">%s</row>' % (r, "".join([cell_xml(column_letter(col) + r, value, style_id) for (col, value, style_id) in cells]))
+
+class Workbook:
+	write_only = False
+
+	def __init__(self):
+		self._sheets = []
+		self.defined_names = DefinedNameDict()
+		# Cache for _restyle: maps (style id, StyleArray field, new value) -> new style id
+		self._restyle_cache = {}
+		# Maps id(style object) -> (style object, index in its collection), for _restyle, and
+		# id(StyleArray) -> (StyleArray, style id), for _style_id
+		self._shared_styles = {}
+		# Style collections laid out like openpyxl's, so that its stylesheet writer and style
+		# objects can be reused as-is
+		OpenpyxlWorkbook._setup_styles(self)
+
+	add_named_style = OpenpyxlWorkbook.add_named_style
+
+	@property
+	def sheetnames(self):
+		return [ws.title for ws in self._sheets]
+
+	@property
+	def worksheets(self):
+		return list(self._sheets)
+
+	def __getitem__(self, title):
+		for ws in self._sheets:
+			if ws.title == title:
+				return ws
+		raise KeyError("Worksheet %s does not exist." % title)
+
+	def create_sheet(self, title):
+		if title in self.sheetnames:
+			raise ValueError("a sheet named %s already exists" % title)
+		ws = Worksheet(self, title)
+		self._sheets.append(ws)
+		return ws
+
+	# Returns the id of the cell style of a StyleArray
+	# Style arrays that are shared between cells are only hashed the first time
+	def _style_id(self, style):
+		shared = self._shared_styles.get(id(style))
+		if shared != None and shared[0] is style:
+			return shared[1]
+		style_id = self._cell_styles.add(style)
+		self._shared_styles[id(style)] = (style, style_id)
+		return style_id
+
+	# Returns the id of the cell style that is style_id with one attribute (see STYLE_FIELDS)
+	# replaced by obj
+	def _restyle(self, style_id, name, obj):
+		# Style objects that are shared between cells are only hashed the first time
+		shared = self._shared_styles.get(id(obj))
+		if shared != None and shared[0] is obj:
+			index = shared[1]
+		else:
+			index = getattr(self, STYLE_FIELDS[name][0]).add(obj)
+			self._shared_styles[id(obj)] = (obj, index)
+		field = STYLE_FIELDS[name][1]
+		key = (style_id, field, index)
+		new_id = self._restyle_cache.get(key)
+		if new_id == None:
+			style = copy(self._cell_styles[style_id])
+			setattr(style, field, index)
+			new_id = self._restyle_cache[key] = self._cell_styles.add(style)
+		return new_id
+
+	# Returns the id of the cell style that is style_id with the number format that openpyxl gives
+	# value (a date, time or duration), unless style_id already shows numbers as dates
+	def _date_style(self, style_id, value):
+		numfmt_id = self._cell_styles[style_id].numFmtId
+		if numfmt_id < BUILTIN_FORMATS_MAX_SIZE:
+			fmt = BUILTIN_FORMATS.get(numfmt_id)
+		else:
+			fmt = self._number_formats[numfmt_id - BUILTIN_FORMATS_MAX_SIZE]
+		if is_date_format(fmt):
+			return style_id
+		fmt = get_time_format(type(value))
+		index = BUILTIN_FORMATS_REVERSE.get(fmt)
+		if index == None:
+			index = self._number_formats.add(fmt) + BUILTIN_FORMATS_MAX_SIZE
+		key = (style_id, "numFmtId", index)
+		new_id = self._restyle_cache.get(key)
+		if new_id == None:
+			style = copy(self._cell_styles[style_id])
+			style.numFmtId = index
+			new_id = self._restyle_cache[key] = self._cell_styles.add(style)
+		return new_id
+
+	def save(self, path):
+		with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+			for i, ws in enumerate(self._sheets, 1):
+				with zf.open("xl/worksheets/sheet%d.xml" % i, "w", force_zip64=True) as f:
+					ws._write(f)
+
+			# Sheets have to be written first, since they register conditional formatting styles
+			zf.writestr("xl/styles.xml", XML_HEADER + tostring(write_stylesheet(self)).decode("utf-8"))
+			zf.writestr("xl/theme/theme1.xml", theme_xml)
+			zf.writestr("xl/workbook.xml", self._workbook_xml())
+			zf.writestr("xl/_rels/workbook.xml.rels", self._workbook_rels_xml())
+			zf.writestr("docProps/core.xml", self._core_xml())
+			zf.writestr("docProps/app.xml", XML_HEADER + '<Properties xmlns="http://schemas.openxmlformats.org/officeDocument/2006/extended-properties"><Application>Microsoft Excel</Application></Properties>')
+			zf.writestr("_rels/.rels", XML_HEADER + '<Relationships xmlns="%s"><Relationship Id="rId1" Type="%s" Target="xl/workbook.xml"/><Relationship Id="rId2" Type="%s" Target="docProps/core.xml"/><Relationship Id="rId3" Type="%s" Target="docProps/app.xml"/></Relationships>' % (
+				NS_PKG_REL, REL_DOCUMENT, REL_CORE, REL_APP))
+			zf.writestr("[Content_Types].xml", self._content_types_xml())
+
+	def close(self):
+		for ws in self._sheets:
+			if ws._rows_file != None:
+				ws._rows_file.close()
+				ws._rows_file = None
+
+	def _workbook_xml(self):
+		sheets = "".join('<sheet name="%s" sheetId="%d" r:id="rId%d"/>' % (escape_attr(ws.title), i, i) for i, ws in enumerate(self._sheets, 1))
+		names = ""
+		if self.defined_names:
+			names = tostring(DefinedNameList(definedName=list(self.defined_names.values())).to_tree()).decode("utf-8")
+		return XML_HEADER + '<workbook xmlns="%s" xmlns:r="%s"><workbookPr/><bookViews><workbookView activeTab="0"/></bookViews><sheets>%s</sheets>%s<calcPr calcId="124519" fullCalcOnLoad="1"/></workbook>' % (
+			NS_MAIN, NS_REL, sheets, names)
+
+	def _workbook_rels_xml(self):
+		n = len(self._sheets)
+		rels = "".join('<Relationship Id="rId%d" Type="%s" Target="worksheets/sheet%d.xml"/>' % (i, REL_WORKSHEET, i) for i in range(1, n+1))
+		rels += '<Relationship Id="rId%d" Type="%s" Target="styles.xml"/>' % (n+1, REL_STYLES)
+		rels += '<Relationship Id="rId%d" Type="%s" Target="theme/theme1.xml"/>' % (n+2, REL_THEME)
+		return XML_HEADER + '<Relationships xmlns="%s">%s</Relationships>' % (NS_PKG_REL, rels)
+
+	def _core_xml(self):
+		now = datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+		return XML_HEADER + ('<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" '
+			'xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:dcterms="http://purl.org/dc/terms/" '
+			'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+			'<dc:creator>openpyxl</dc:creator>'
+			'<dcterms:created xsi:type="dcterms:W3CDTF">%s</dcterms:created>'
+			'<dcterms:modified xsi:type="dcterms:W3CDTF">%s</dcterms:modified>'
+			'</cp:coreProperties>') % (now, now)
+
+	def _content_types_xml(self):
+		overrides = [("/xl/workbook.xml", CT_WORKBOOK), ("/xl/styles.xml", CT_STYLES), ("/xl/theme/theme1.xml", CT_THEME),
+			("/docProps/core.xml", CT_CORE), ("/docProps/app.xml", CT_APP)]
+		overrides += [("/xl/worksheets/sheet%d.xml" % i, CT_WORKSHEET) for i in range(1, len(self._sheets)+1)]
+		return XML_HEADER + '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types"><Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/><Default Extension="xml" ContentType="application/xml"/>%s</Types>' % (
+			"".join('<Override PartName="%s" ContentType="%s"/>' % o for o in overrides))